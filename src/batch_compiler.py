@@ -0,0 +1,62 @@
+#!/opt/rh/rh-python38/root/usr/bin/python
+"""
+Compile all workbooks in directories / matching glob patterns, in parallel.
+
+Usage: batch_compiler.py <directory-or-glob> [<directory-or-glob> ...] <local> [--workers=<n>] [--out=<directory>] [compiler.py options]
+
+The return code is 2 if any workbook had errors, 53 if any had warnings, otherwise 0.
+"""
+
+import sys
+import os
+import time
+import expcompiler.batch
+
+options = [a for a in sys.argv[1:] if a.startswith('--') and '=' not in a]
+option_values = dict(a.split('=', 1) for a in sys.argv[1:] if a.startswith('--') and '=' in a)
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+
+workers = option_values.pop('--workers', None)
+target_dir = option_values.pop('--out', None)
+try:
+    compile_args = expcompiler.compile.parse_cli_options(options, option_values)
+except ValueError as e:
+    print(str(e))
+    sys.exit(1)
+
+if len(args) < 2 or compile_args is None or (workers is not None and not workers.isdigit()):
+    print("Usage: {} <directory-or-glob> [<directory-or-glob> ...] <local> [--workers=<n>] [--out=<directory>] {}".format(
+        os.path.basename(sys.argv[0]), expcompiler.compile.cli_usage_options()))
+    print(expcompiler.compile.cli_usage_notes())
+    sys.exit(1)
+
+src_fns = expcompiler.batch.find_workbooks(args[:-1])
+if len(src_fns) == 0:
+    print('No workbooks were found')
+    sys.exit(1)
+
+status = {0: 'OK', 2: 'ERROR', 53: 'WARNINGS'}
+
+
+def print_result(result):
+    print('{}: {} (rc={}, {:.2f} sec)'.format(result['source'], status.get(result['rc'], 'FAILED'), result['rc'], result['seconds']))
+    if result['rc'] != 0:
+        for line in result['output'].splitlines():
+            print('    ' + line)
+
+
+start = time.perf_counter()
+try:
+    results = expcompiler.batch.compile_batch(src_fns, args[-1], compile_args, target_dir=target_dir,
+                                              n_workers=None if workers is None else int(workers), on_result=print_result)
+except ValueError as e:
+    print(str(e))
+    sys.exit(1)
+
+elapsed = time.perf_counter() - start
+
+n_by_rc = {rc: sum(r['rc'] == rc for r in results) for rc in sorted({r['rc'] for r in results})}
+print('{} workbooks compiled in {:.2f} sec ({:.2f} sec of compile time in all workers): {}'.format(
+    len(results), elapsed, sum(r['seconds'] for r in results), ', '.join('{} {}'.format(n, status.get(rc, 'FAILED')) for rc, n in n_by_rc.items())))
+
+sys.exit(expcompiler.batch.batch_return_code(results))
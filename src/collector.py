@@ -0,0 +1,11 @@
+#!/opt/rh/rh-python38/root/usr/bin/python
+
+import sys
+import os
+import expcompiler.collector
+
+if len(sys.argv) not in (2, 3):
+    print("Usage: {} <results-dir> [port]".format(os.path.basename(sys.argv[0])))
+    sys.exit(1)
+
+expcompiler.collector.run(sys.argv[1], port=int(sys.argv[2]) if len(sys.argv) == 3 else 8080)
@@ -0,0 +1,95 @@
+#!/opt/rh/rh-python38/root/usr/bin/python
+"""
+Load test for the results collector (collector.py): simulate many concurrent sessions, each uploading its results
+in batches, the way the experiment page does. Some batches are sent twice, as happens when a retry and the
+page-close beacon both arrive.
+
+Usage: collector_load_test.py <host> <port> [n-sessions] [batches-per-session] [trials-per-batch]
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+
+#-----------------------------------------------------------------------------
+async def post(reader, writer, host, body):
+    """
+    Send one POST request over an open connection; return the HTTP status
+    """
+    request = 'POST / HTTP/1.1\r\nHost: {}\r\nContent-Type: text/plain\r\nContent-Length: {}\r\n\r\n'.format(host, len(body))
+    writer.write(request.encode('latin-1') + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            content_length = int(line.split(b':')[1])
+    await reader.readexactly(content_length)
+
+    return status
+
+
+#-----------------------------------------------------------------------------
+async def run_session(session_num, host, port, n_batches, n_trials, latencies, failures):
+    session = 'loadtest_{}_{}'.format(os.getpid(), session_num)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        for batch_num in range(n_batches):
+            #-- Participants don't start and respond at the same time
+            await asyncio.sleep(random.uniform(0, 0.2))
+
+            rows = [dict(trial_index=batch_num * n_trials + i, rt=random.randint(200, 2000), config_trial_number=i + 2)
+                    for i in range(n_trials)]
+            body = json.dumps(dict(session=session, batch=batch_num, rows=rows)).encode('utf-8')
+
+            for _ in range(2 if random.random() < 0.05 else 1):
+                start = time.perf_counter()
+                status = await post(reader, writer, host, body)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    failures.append(status)
+
+    finally:
+        writer.close()
+
+
+#-----------------------------------------------------------------------------
+def main(host, port, n_sessions, n_batches, n_trials):
+    latencies = []
+    failures = []
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    start = time.perf_counter()
+    sessions = [run_session(i, host, port, n_batches, n_trials, latencies, failures) for i in range(n_sessions)]
+    loop.run_until_complete(asyncio.gather(*sessions))
+    duration = time.perf_counter() - start
+    loop.close()
+
+    latencies.sort()
+    print('{} sessions, {} requests in {:.2f} seconds ({:.0f} requests/sec)'.format(n_sessions, len(latencies), duration, len(latencies) / duration))
+    print('Latency: median {:.1f} ms, 95% {:.1f} ms, max {:.1f} ms'.format(latencies[len(latencies) // 2] * 1000,
+                                                                          latencies[int(len(latencies) * 0.95)] * 1000,
+                                                                          latencies[-1] * 1000))
+    print('Failed requests: {}'.format(len(failures)))
+
+    return 0 if len(failures) == 0 else 2
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or len(sys.argv) > 6:
+        print("Usage: {} <host> <port> [n-sessions] [batches-per-session] [trials-per-batch]".format(os.path.basename(sys.argv[0])))
+        sys.exit(1)
+
+    args = [int(a) for a in sys.argv[2:]] + [300, 10, 20][len(sys.argv) - 3:]
+    sys.exit(main(sys.argv[1], *args))
@@ -0,0 +1,49 @@
+#!/opt/rh/rh-python38/root/usr/bin/python
+"""
+Compile an experiment with the compile server (see compile_daemon.py). The arguments are the same as compiler.py's,
+and so are the messages and the return code.
+
+Usage: compile_client.py <source-file-xlsx> <target-file-html> <local> [compiler.py options] [--socket=<path>] [--json]
+"""
+
+import sys
+import os
+import json
+import expcompiler.daemon
+
+options = [a for a in sys.argv[1:] if a.startswith('--') and '=' not in a]
+option_values = dict(a.split('=', 1) for a in sys.argv[1:] if a.startswith('--') and '=' in a)
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+
+print_json = '--json' in options
+if print_json:
+    options.remove('--json')
+socket_path = option_values.pop('--socket', None) or expcompiler.daemon.default_socket_path()
+try:
+    compile_args = expcompiler.compile.parse_cli_options(options, option_values)
+except ValueError as e:
+    print(str(e))
+    sys.exit(1)
+
+if len(args) != 3 or compile_args is None:
+    print("Usage: {} <source-file-xlsx> <target-file-html> <local> {} [--socket=<path>] [--json]".format(
+        os.path.basename(sys.argv[0]), expcompiler.compile.cli_usage_options()))
+    print(expcompiler.compile.cli_usage_notes())
+    sys.exit(1)
+
+try:
+    result = expcompiler.daemon.send_job(socket_path, args[0], args[1], args[2], compile_args)
+except OSError as e:
+    print('The compile server is not available at {}: {}'.format(socket_path, e))
+    sys.exit(1)
+
+if print_json:
+    print(json.dumps(result, indent=2))
+elif 'error' in result:
+    print(result['error'])
+else:
+    sys.stdout.write(result['output'])
+    for line in expcompiler.compile.compression_summary(result.get('compressed_files', [])):
+        print(line)
+
+sys.exit(result['rc'])
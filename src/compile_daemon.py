@@ -0,0 +1,26 @@
+#!/opt/rh/rh-python38/root/usr/bin/python
+"""
+Run the compile server (see expcompiler.daemon). Use compile_client.py to compile experiments with it.
+
+Usage: compile_daemon.py [--socket=<path>] [--workers=<n>] [--queue=<n>]
+"""
+
+import sys
+import os
+import expcompiler.daemon
+
+option_values = dict(a.split('=', 1) for a in sys.argv[1:] if a.startswith('--') and '=' in a)
+valid_option_values = ('--socket', '--workers', '--queue')
+
+if len(option_values) != len(sys.argv) - 1 or any(o not in valid_option_values for o in option_values) or \
+        any(not option_values[o].isdigit() for o in ('--workers', '--queue') if o in option_values):
+    print("Usage: {} [--socket=<path>] [--workers=<n>] [--queue=<n>]".format(os.path.basename(sys.argv[0])))
+    sys.exit(1)
+
+daemon = expcompiler.daemon.CompileDaemon(socket_path=option_values.get('--socket'),
+                                          n_workers=int(option_values['--workers']) if '--workers' in option_values else None,
+                                          max_queue=int(option_values.get('--queue', 100)))
+try:
+    daemon.run()
+except KeyboardInterrupt:
+    pass
@@ -1,12 +1,26 @@
-#!/opt/rh/rh-python35/root/usr/bin/python
+#!/opt/rh/rh-python38/root/usr/bin/python
 
 import sys
 import os
-import expcompiler.parser
+import expcompiler.compile
 
-if len(sys.argv) != 4:
-    print("Usage: {} <source-file-xlsx> <target-file-html> <local>".format(os.path.basename(sys.argv[0])))
+options = [a for a in sys.argv[1:] if a.startswith('--') and '=' not in a]
+option_values = dict(a.split('=', 1) for a in sys.argv[1:] if a.startswith('--') and '=' in a)
+args = [a for a in sys.argv[1:] if not a.startswith('--')]
+try:
+    compile_args = expcompiler.compile.parse_cli_options(options, option_values)
+except ValueError as e:
+    print(str(e))
     sys.exit(1)
 
-rc = expcompiler.compile.compile_exp(sys.argv[1], sys.argv[2], sys.argv[3])
+if len(args) != 3 or compile_args is None:
+    print("Usage: {} <source-file-xlsx> <target-file-html> <local> {}".format(os.path.basename(sys.argv[0]),
+                                                                             expcompiler.compile.cli_usage_options()))
+    print(expcompiler.compile.cli_usage_notes())
+    sys.exit(1)
+
+compressed_files = []
+rc = expcompiler.compile.compile_exp(args[0], args[1], args[2], compressed_files=compressed_files, **compile_args)
+for line in expcompiler.compile.compression_summary(compressed_files):
+    print(line)
 sys.exit(rc)
@@ -1,7 +1,27 @@
+"""
+The experiment compiler. Requires Python 3.8 or later.
 
-from . import logger
-from . import experiment
-from . import xlsreader
-from . import parser
-from . import generator
-from . import compile
+The submodules are imported when they are first used (e.g. "expcompiler.parser"), rather than when the package is
+imported: the heavy libraries (pandas, openpyxl, cssutils, ...) are loaded only by the stages that need them, so a
+script that doesn't compile anything (e.g. on a usage error) starts quickly. Modules that use other submodules
+import them explicitly, unless they are heavy.
+"""
+
+import importlib
+import sys
+
+if sys.version_info < (3, 8):
+    raise ImportError('expcompiler requires Python 3.8 or later (this is Python {}.{})'.format(*sys.version_info[:2]))
+
+_submodules = ('logger', 'experiment', 'xlsreader', 'parser', 'generator', 'compile', 'results', 'offline', 'bundle',
+               'collector', 'telemetry', 'pages', 'batch', 'daemon', 'utils')
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_submodules))
@@ -0,0 +1,124 @@
+"""
+Compiling many experiments at once: the workbooks are compiled in parallel, by a pool of worker processes. Each
+worker imports the compiler once, and then compiles many workbooks.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import io
+import os
+import time
+
+import expcompiler.compile
+import expcompiler.logger
+
+
+#-----------------------------------------------------------------------------
+def find_workbooks(patterns):
+    """
+    Find the workbooks to compile
+
+    :param patterns: Directories (all .xlsx files in the directory are compiled) or glob patterns
+    :return: list of file names, sorted, without duplicates
+    """
+    result = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*.xlsx')
+        #-- Excel's lock files ("~$name.xlsx") are not workbooks
+        result.update(fn for fn in glob.glob(pattern) if os.path.isfile(fn) and not os.path.basename(fn).startswith('~$'))
+    return sorted(result)
+
+
+#-----------------------------------------------------------------------------
+def target_filename(src_fn, target_dir=None):
+    """ The HTML file of a workbook: in target_dir, or next to the workbook """
+    fn = os.path.splitext(os.path.basename(src_fn))[0] + '.html'
+    return os.path.join(target_dir if target_dir is not None else os.path.dirname(src_fn), fn)
+
+
+#-----------------------------------------------------------------------------
+def init_worker():
+    """ Load the heavy modules (pandas, openpyxl, etc.) once per worker process, rather than in its first job """
+    import expcompiler.xlsreader
+    import expcompiler.parser
+    import expcompiler.generator
+    #-- The parser imports these on first use
+    import cssutils
+    import webcolors
+
+
+#-----------------------------------------------------------------------------
+def compile_one(src_fn, target_fn, local_imports, compile_args):
+    """
+    Compile one workbook, capturing the compiler's messages
+
+    :return: dict(source, target, rc, seconds, output, diagnostics, compressed_files). rc is compile_exp()'s return
+             code (0 = OK, 2 = errors, 53 = warnings), or 1 if the compiler failed unexpectedly. diagnostics is a list
+             of dict(code, message) - the errors and warnings. compressed_files is compile_exp()'s list of compressed
+             files (see expcompiler.compile.compression_summary()).
+    """
+    start = time.perf_counter()
+    output = io.StringIO()
+    logger = expcompiler.logger.Logger()
+    compressed_files = []
+
+    with contextlib.redirect_stdout(output):
+        try:
+            rc = expcompiler.compile.compile_exp(src_fn, target_fn, local_imports, logger=logger, compressed_files=compressed_files,
+                                                 **compile_args)
+        except Exception as e:
+            print('Internal error: {}: {}'.format(type(e).__name__, e))
+            rc = 1
+
+    return dict(source=src_fn, target=target_fn, rc=rc, seconds=time.perf_counter() - start, output=output.getvalue(),
+                diagnostics=[dict(code=code, message=message) for code, message in logger.messages],
+                compressed_files=compressed_files)
+
+
+#-----------------------------------------------------------------------------
+def compile_batch(src_fns, local_imports, compile_args, target_dir=None, n_workers=None, on_result=None):
+    """
+    Compile several workbooks in parallel
+
+    :param compile_args: compile_exp() keyword arguments, used for all workbooks
+    :param target_dir: The directory of the HTML files (None = next to each workbook)
+    :param n_workers: The number of worker processes (None = the number of CPUs)
+    :param on_result: Called with each workbook's result (see compile_one()) as soon as the workbook was compiled
+    :return: list of results, in the order of src_fns
+    :raises ValueError: Several workbooks would be compiled into the same HTML file (e.g. workbooks with the same name
+                        in different directories, with one target_dir)
+    """
+    targets = [target_filename(fn, target_dir) for fn in src_fns]
+    n_by_target = collections.Counter(os.path.abspath(fn) for fn in targets)
+    duplicates = sorted(fn for fn, n in n_by_target.items() if n > 1)
+    if len(duplicates) > 0:
+        raise ValueError('Several workbooks would be compiled into the same file: {}'.format(', '.join(duplicates)))
+
+    if target_dir is not None:
+        os.makedirs(target_dir, exist_ok=True)
+
+    n_workers = min(n_workers or os.cpu_count() or 1, max(len(src_fns), 1))
+    results = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker) as executor:
+        futures = {executor.submit(compile_one, fn, target_fn, local_imports, compile_args): fn
+                   for fn, target_fn in zip(src_fns, targets)}
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if on_result is not None:
+                on_result(result)
+
+    return [results[fn] for fn in src_fns]
+
+
+#-----------------------------------------------------------------------------
+def batch_return_code(results):
+    """ The return code of the whole batch: 2 if any workbook failed, 53 if any had warnings, otherwise 0 """
+    codes = {result['rc'] for result in results}
+    if codes - {0, 53}:
+        return 2
+    return 53 if 53 in codes else 0
@@ -0,0 +1,89 @@
+"""
+Bundling the experiment's assets (jsPsych's scripts and CSS, the start-of-session beep) with the HTML file.
+
+The assets are copied into an "assets" directory next to the HTML file, under names that include a hash of their
+content. A static server can therefore serve them with long-lived ("immutable") cache headers, and the browser
+reuses them across all experiments in the same directory.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import expcompiler.generator
+
+
+assets_dir_name = 'assets'
+
+
+#-----------------------------------------------------------------------------
+def bundle_manifest_filename(target_fn):
+    return os.path.splitext(target_fn)[0] + '.assets.json'
+
+
+#-----------------------------------------------------------------------------
+def experiment_assets(exp, generator):
+    """
+    The local URLs of the assets that the experiment's page uses (as they are referred to when imports are local)
+    """
+    result = list(generator.script_urls(exp))
+    result.append(generator.css_url())
+    if exp.start_of_session_beep:
+        result.append(expcompiler.generator.start_of_session_beep_file)
+    return result
+
+
+#-----------------------------------------------------------------------------
+def hashed_filename(url, content):
+    """
+    The name of a bundled asset: <assets dir>/<name>.<content hash>.<extension>
+    """
+    name, extension = os.path.splitext(os.path.basename(url))
+    return '{}/{}.{}{}'.format(assets_dir_name, name, hashlib.sha256(content).hexdigest()[:12], extension)
+
+
+#-----------------------------------------------------------------------------
+def bundle_assets(urls, src_dir, target_dir, logger):
+    """
+    Copy the assets into the target directory, under content-hashed names. An asset that was already copied
+    (e.g. by another experiment) is not copied again.
+
+    :param urls: The assets' URLs, relative to src_dir
+    :return: dict: URL -> dict(file=bundled URL, size=size in bytes, sha256=content hash); None if some assets were not found
+    """
+    result = {}
+    ok = True
+
+    for url in urls:
+        src_fn = os.path.join(src_dir, url)
+        if not os.path.isfile(src_fn):
+            logger.error('Error: the file "{}" was not found (it should be in "{}")'.format(url, src_dir), 'BUNDLE_FILE_NOT_FOUND')
+            ok = False
+            continue
+
+        with open(src_fn, 'rb') as fp:
+            content = fp.read()
+
+        bundled_url = hashed_filename(url, content)
+        bundled_fn = os.path.join(target_dir, bundled_url)
+        if not os.path.exists(bundled_fn):
+            os.makedirs(os.path.dirname(bundled_fn), exist_ok=True)
+            shutil.copyfile(src_fn, bundled_fn)
+
+        result[url] = dict(file=bundled_url, size=len(content), sha256=hashlib.sha256(content).hexdigest())
+
+    return result if ok else None
+
+
+#-----------------------------------------------------------------------------
+def write_bundle_manifest(target_fn, assets):
+    """
+    Write the list of bundled assets (see bundle_assets())
+
+    :return: The manifest's file name
+    """
+    fn = bundle_manifest_filename(target_fn)
+    with open(fn, 'w', encoding='utf-8') as fp:
+        json.dump(assets, fp, indent=2, sort_keys=True)
+    return fn
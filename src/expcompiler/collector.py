@@ -0,0 +1,246 @@
+"""
+A small server that collects the results uploaded by experiments (see the "results_upload_url" parameter).
+
+Each request uploads one batch of trials, as JSON: {"session": ..., "batch": <batch number>, "rows": [...]}.
+The batches of each session are appended to a per-session file (<session>.jsonl, one batch per line). The files are
+written in worker threads, so a slow disk doesn't block the server from handling the other sessions' uploads.
+"""
+
+import asyncio
+import json
+import os
+import re
+
+
+#============================================================================================
+class ResultsCollector(object):
+    """
+    Collect the results batches of all sessions into one directory
+    """
+
+    session_name_pattern = re.compile('^[a-zA-Z0-9_-][a-zA-Z0-9_.-]{0,99}$')
+
+    # ----------------------------------------------------------------------------
+    def __init__(self, out_dir, max_request_size=10 * 1024 * 1024):
+        self.out_dir = out_dir
+        self.max_request_size = max_request_size
+        self.n_batches = 0
+        self.n_rows = 0
+        self._received_batches = {}     # key = session, value = set of batch numbers
+        self._session_locks = {}        # key = session, value = asyncio.Lock - the session's file is written by one upload at a time
+
+    # ----------------------------------------------------------------------------
+    def session_filename(self, session):
+        return os.path.join(self.out_dir, session + '.jsonl')
+
+    # ----------------------------------------------------------------------------
+    def store_batch(self, body):
+        """
+        Save one batch of results
+
+        :param body: The request body (bytes)
+        :return: (HTTP status, message)
+        """
+        error, (session, batch_num, rows) = self._parse_batch(body)
+        if error is not None:
+            return error
+
+        #-- The same batch may be uploaded twice (e.g., a retry and a beacon on page close)
+        received = self._session_batches(session)
+        if batch_num in received:
+            return 200, 'Duplicate batch ignored'
+
+        self._append_batch(session, batch_num, rows)
+        received.add(batch_num)
+        return 200, 'OK'
+
+    # ----------------------------------------------------------------------------
+    async def store_batch_async(self, body):
+        """
+        Save one batch of results, like store_batch(), with the file access in a worker thread
+
+        :return: (HTTP status, message)
+        """
+        error, (session, batch_num, rows) = self._parse_batch(body)
+        if error is not None:
+            return error
+
+        loop = asyncio.get_event_loop()
+        lock = self._session_locks.setdefault(session, asyncio.Lock())
+        async with lock:
+            if session not in self._received_batches:
+                self._received_batches[session] = await loop.run_in_executor(None, self._session_batches, session)
+            received = self._received_batches[session]
+            if batch_num in received:
+                return 200, 'Duplicate batch ignored'
+
+            try:
+                await loop.run_in_executor(None, self._append_batch, session, batch_num, rows)
+            except OSError:
+                return 500, 'The results could not be saved'
+            received.add(batch_num)
+
+        return 200, 'OK'
+
+    # ----------------------------------------------------------------------------
+    def _parse_batch(self, body):
+        """
+        :return: (error, (session, batch number, rows)). error is (HTTP status, message), or None if the batch is valid
+        """
+        invalid = (None, None, None)
+        try:
+            batch = json.loads(body.decode('utf-8'))
+            session = batch['session']
+            batch_num = batch['batch']
+            rows = batch['rows']
+        except (ValueError, KeyError, TypeError):
+            return (400, 'Invalid results batch'), invalid
+
+        if not isinstance(session, str) or self.session_name_pattern.match(session) is None:
+            return (400, 'Invalid session name'), invalid
+        if not isinstance(batch_num, int) or not isinstance(rows, list):
+            return (400, 'Invalid results batch'), invalid
+
+        return None, (session, batch_num, rows)
+
+    # ----------------------------------------------------------------------------
+    def _append_batch(self, session, batch_num, rows):
+        with open(self.session_filename(session), 'a', encoding='utf-8') as fp:
+            fp.write(json.dumps(dict(batch=batch_num, rows=rows), ensure_ascii=False) + '\n')
+
+        self.n_batches += 1
+        self.n_rows += len(rows)
+
+    # ----------------------------------------------------------------------------
+    def _session_batches(self, session):
+        """
+        The batch numbers already saved for this session (also those saved before the server was restarted)
+        """
+        if session not in self._received_batches:
+            self._received_batches[session] = set(b['batch'] for b in load_session_batches(self.session_filename(session)))
+        return self._received_batches[session]
+
+    # ----------------------------------------------------------------------------
+    async def handle_connection(self, reader, writer):
+        """
+        Handle the HTTP requests of one connection (a connection may send several requests)
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                method = request_line.decode('latin-1').split(' ')[0].upper()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                try:
+                    content_length = int(headers.get('content-length', '0'))
+                except ValueError:
+                    content_length = -1
+
+                if content_length < 0 or content_length > self.max_request_size:
+                    self._write_response(writer, 413, 'Invalid request size', False)
+                    break
+
+                body = (await reader.readexactly(content_length)) if content_length > 0 else b''
+
+                if method == 'OPTIONS':
+                    self._write_response(writer, 204, '', keep_alive)
+                elif method == 'POST':
+                    status, message = await self.store_batch_async(body)
+                    self._write_response(writer, status, message, keep_alive)
+                else:
+                    self._write_response(writer, 405, 'Only POST requests are supported', keep_alive)
+
+                await writer.drain()
+                if not keep_alive:
+                    break
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            writer.close()
+
+    # ----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _write_response(self, writer, status, message, keep_alive):
+        body = message.encode('utf-8')
+        reasons = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+                   500: 'Internal Server Error'}
+        headers = [
+            'HTTP/1.1 {} {}'.format(status, reasons[status]),
+            'Access-Control-Allow-Origin: *',
+            'Access-Control-Allow-Methods: POST, OPTIONS',
+            'Access-Control-Allow-Headers: Content-Type',
+            'Content-Type: text/plain; charset=utf-8',
+            'Content-Length: {}'.format(len(body)),
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close'),
+        ]
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + body)
+
+    # ----------------------------------------------------------------------------
+    def start(self, loop, host, port):
+        """
+        Start listening (the server runs when the event loop runs)
+
+        :return: asyncio.Server
+        """
+        return loop.run_until_complete(asyncio.start_server(self.handle_connection, host, port))
+
+
+#-----------------------------------------------------------------------------
+def load_session_batches(filename):
+    """
+    Load the batches saved for one session
+
+    :return: list of dict (batch, rows), ordered by batch number
+    """
+    if not os.path.exists(filename):
+        return []
+
+    with open(filename, 'r', encoding='utf-8') as fp:
+        batches = [json.loads(line) for line in fp if line.strip() != '']
+
+    return sorted(batches, key=lambda b: b['batch'])
+
+
+#-----------------------------------------------------------------------------
+def load_session_rows(filename):
+    """
+    Load the results rows saved for one session, in the order of the trials
+    """
+    return [row for batch in load_session_batches(filename) for row in batch['rows']]
+
+
+#-----------------------------------------------------------------------------
+def run(out_dir, host='0.0.0.0', port=8080):
+    """
+    Run the collector server until it is interrupted
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    collector = ResultsCollector(out_dir)
+    server = collector.start(loop, host, port)
+    print('Collecting results into {} (listening on {}:{})'.format(out_dir, host, port))
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    loop.close()
+    print('{} batches ({} trials) were saved'.format(collector.n_batches, collector.n_rows))
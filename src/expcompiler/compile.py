@@ -1,9 +1,25 @@
+import gzip
+import hashlib
+import os
 
-import expcompiler
+import expcompiler.bundle
+import expcompiler.generator
+import expcompiler.logger
+import expcompiler.offline
+import expcompiler.pages
+import expcompiler.parser
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 #-----------------------------------------------------------------------------
-def compile_exp(src_fn, target_fn, local_imports, reader=None, logger=None):
+def compile_exp(src_fn, target_fn, local_imports, reader=None, logger=None, minify=False, compress=False, external_trial_data=False,
+                compact_trials=False, persist_results=False, drop_filtered_results=False,
+                compact_results=False, offline=False, bundle_from=None, persistent_layout=False,
+                precise_timing=False, telemetry=False, pages=None, compressed_files=None):
     """
     Compile an experiment from Excel into a javascript file
 
@@ -11,23 +27,252 @@ def compile_exp(src_fn, target_fn, local_imports, reader=None, logger=None):
     :param target_fn:
     :param reader:
     :param logger:
+    :param minify: Generate a compact script (for production): short internal names, no indentation, empty lines or
+                   whole-line comments. This is not a full JavaScript minifier - see generator.minify_script()
+    :param compress: Also write precompressed copies of the output (.gz, and .br if the brotli module is installed)
+    :param external_trial_data: Write the trial data to a separate JSON file (see trial_data_filename()), which the
+                                HTML page loads asynchronously. If the trials are divided into blocks, there is one file per block.
+    :param compact_trials: Write identical consecutive trials only once (with the number of repetitions)
+    :param persist_results: The HTML page stores each trial's results in the browser's IndexedDB as soon as the
+                            trial ends, so the results of a session that crashed can be recovered
+    :param drop_filtered_results: The HTML page removes the trials that are not saved in the results file (e.g.
+                                  instructions) from jsPsych's data store as soon as each trial ends
+    :param compact_results: Save the results file in the compact JSON format (see expcompiler.results) rather than as CSV
+    :param offline: Also write a service worker that caches all the experiment's files, so it can run offline (see
+                    expcompiler.offline)
+    :param bundle_from: A directory with the jsPsych files (in a "jspsych-7.1" subdirectory) and the start-of-session
+                        beep. If specified, these files are copied into the target directory under content-hashed
+                        names (see expcompiler.bundle), and local_imports is ignored.
+    :param persistent_layout: The layout controls are created once, as persistent elements; each step only updates and
+                              shows the controls it uses, rather than rebuilding their HTML
+    :param precise_timing: The steps' onset and offset are aligned to display frames, RTs are measured from the
+                           stimulus onset, and the requested and measured durations are saved in the results
+    :param telemetry: Save the display's refresh rate and frame jitter, the long tasks and dropped frames in each trial,
+                      and the page-load timings in the results (see expcompiler.telemetry)
+    :param pages: Split the experiment into this number of pages, with the trials divided evenly between them, or -
+                  if pages="blocks" - into one page per block (see expcompiler.pages). The first page is target_fn.
+    :param compressed_files: A list, to which (output file, its size, write_precompressed() result) is appended for
+                             each output file that was compressed (see compression_summary())
     """
     logger = logger or expcompiler.logger.Logger()
     parser = expcompiler.parser.Parser(src_fn, reader=reader, logger=logger)
-    generator = expcompiler.generator.ExpGenerator(logger=logger, imports_local=bool(int(local_imports)))
+
+    service_worker_url = os.path.basename(expcompiler.offline.service_worker_filename(target_fn)) if offline else None
+    generator = expcompiler.generator.ExpGenerator(logger=logger, imports_local=bundle_from is not None or bool(int(local_imports)), minify=minify,
+                                                   trial_data_url=os.path.basename(trial_data_filename(target_fn)) if external_trial_data else None,
+                                                   compact_trials=compact_trials, persist_results=persist_results,
+                                                   drop_filtered_results=drop_filtered_results, compact_results=compact_results,
+                                                   service_worker_url=service_worker_url,
+                                                   persistent_layout=persistent_layout, precise_timing=precise_timing,
+                                                   telemetry=telemetry)
 
     exp = parser.parse()
     if exp is None:
         return 2
 
+    if pages is None:
+        page_exps = [(exp, target_fn)]
+    else:
+        page_exps = expcompiler.pages.split_experiment(exp, pages, target_fn, logger)
+        if page_exps is None:
+            return 2
+
+    for page_exp, page_fn in page_exps:
+        if external_trial_data:
+            generator.trial_data_url = os.path.basename(trial_data_filename(page_fn))
+        if service_worker_url is not None:
+            generator.service_worker_url = os.path.basename(expcompiler.offline.service_worker_filename(page_fn))
+        if not _write_experiment(page_exp, page_fn, generator, logger, compress, offline, bundle_from, compressed_files):
+            return 2
+
+    if parser.warnings_found:
+        return 53
+
+    return 0
+
+
+#-----------------------------------------------------------------------------
+def _write_experiment(exp, target_fn, generator, logger, compress, offline, bundle_from, compressed_files):
+    """
+    Write the HTML file of the experiment (or of one page), and the accompanying files
+
+    :return: bool - whether the files were written successfully
+    """
+    output_files = [target_fn]
+
+    if bundle_from is not None:
+        #-- The generator may still have the bundled names of the previous page's assets
+        generator.asset_urls = {}
+        assets = expcompiler.bundle.bundle_assets(expcompiler.bundle.experiment_assets(exp, generator), bundle_from,
+                                                  os.path.dirname(target_fn), logger)
+        if assets is None:
+            return False
+        generator.asset_urls = {url: asset['file'] for url, asset in assets.items()}
+        output_files.append(expcompiler.bundle.write_bundle_manifest(target_fn, assets))
+
     script = generator.generate(exp)
     if script is None:
-        return 2
+        return False
 
     with open(target_fn, 'w', encoding="utf-8") as fp:
         fp.write(script)
 
-    if parser.warnings_found:
-        return 53
+    data_files = generator.trial_data_files(exp) if generator.trial_data_url is not None else []
+    for url, content in data_files:
+        fn = os.path.join(os.path.dirname(target_fn), url)
+        with open(fn, 'w', encoding="utf-8") as fp:
+            fp.write(content)
+        output_files.append(fn)
 
-    return 0
+    if offline:
+        output_files.extend(expcompiler.offline.write_offline_files(exp, generator, target_fn, [url for url, content in data_files], logger))
+
+    if compress:
+        for fn in output_files:
+            compressed = write_precompressed(fn)
+            if compressed_files is not None:
+                compressed_files.append((fn, os.path.getsize(fn), compressed))
+
+    return True
+
+
+#=============================================================================================
+# Command-line options (of compiler.py and batch_compiler.py)
+#=============================================================================================
+
+#-- Options without a value: option -> compile_exp() argument
+cli_flags = (('--minify', 'minify'), ('--compress', 'compress'), ('--external-data', 'external_trial_data'),
+             ('--compact', 'compact_trials'), ('--persist-results', 'persist_results'),
+             ('--drop-filtered-results', 'drop_filtered_results'), ('--compact-results', 'compact_results'),
+             ('--offline', 'offline'), ('--persistent-layout', 'persistent_layout'), ('--precise-timing', 'precise_timing'),
+             ('--telemetry', 'telemetry'))
+
+#-- Options with a value: (option, compile_exp() argument, description of the value)
+cli_value_options = (('--bundle', 'bundle_from', '<jspsych-dir>'), ('--pages', 'pages', '<n>|blocks'))
+
+#-- Options that need more explanation than their name: option -> note
+cli_option_notes = (('--minify', 'shorten internal names; remove indentation, empty lines and whole-line comments. '
+                                 'Line breaks and end-of-line comments are kept (the script is not fully minified)'),)
+
+
+#-----------------------------------------------------------------------------
+def cli_usage_options():
+    """ The options part of the usage message """
+    return ' '.join(['[{}]'.format(option) for option, arg in cli_flags] +
+                    ['[{}={}]'.format(option, value_desc) for option, arg, value_desc in cli_value_options])
+
+
+#-----------------------------------------------------------------------------
+def cli_usage_notes():
+    """ The lines explaining some options, printed after the usage message """
+    return '\n'.join('  {}: {}'.format(option, note) for option, note in cli_option_notes)
+
+
+#-----------------------------------------------------------------------------
+def parse_cli_options(options, option_values):
+    """
+    Convert the command-line options into compile_exp() arguments
+
+    :param options: The options without a value (e.g. "--minify")
+    :param option_values: The options with a value (dict, e.g. "--bundle" -> directory)
+    :return: dict of compile_exp() arguments; None if some option is unknown
+    :raises ValueError: an invalid option value (the message explains it)
+    """
+    flags = dict(cli_flags)
+    value_args = {option: arg for option, arg, value_desc in cli_value_options}
+    if any(o not in flags for o in options) or any(o not in value_args for o in option_values):
+        return None
+
+    result = {arg: option in options for option, arg in cli_flags}
+    for option, value in option_values.items():
+        result[value_args[option]] = value
+
+    pages = result.get('pages')
+    if pages is not None and pages != expcompiler.pages.by_blocks:
+        if not pages.isdigit():
+            raise ValueError('Invalid --pages option: specify the number of pages, or "{}"'.format(expcompiler.pages.by_blocks))
+        result['pages'] = int(pages)
+
+    return result
+
+
+#-----------------------------------------------------------------------------
+def trial_data_filename(target_fn):
+    """
+    The name of the trial-data file, when it's written separately from the HTML file
+    """
+    return os.path.splitext(target_fn)[0] + '.trials.json'
+
+
+#=============================================================================================
+# Precompressed output
+#=============================================================================================
+
+#-----------------------------------------------------------------------------
+def _gzip_compress(data):
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli_compress(data):
+    return brotli.compress(data, quality=11)
+
+
+def _compressors():
+    """ The available compression formats: list of (file suffix, compress function, decompress function) """
+    result = [('.gz', _gzip_compress, gzip.decompress)]
+    if brotli is not None:
+        result.append(('.br', _brotli_compress, brotli.decompress))
+    return result
+
+
+#-----------------------------------------------------------------------------
+def write_precompressed(filename):
+    """
+    Write compressed copies of a file (filename.gz, filename.br) using maximal compression, so that a static server
+    can serve them as-is. A compressed copy is rewritten only if its content differs from the file.
+
+    :return: list of (compressed file name, size in bytes)
+    """
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+
+    data_hash = hashlib.sha256(data).digest()
+
+    result = []
+    for suffix, compress_func, decompress_func in _compressors():
+        compressed_fn = filename + suffix
+        if _compressed_hash(compressed_fn, decompress_func) != data_hash:
+            with open(compressed_fn, 'wb') as fp:
+                fp.write(compress_func(data))
+        result.append((compressed_fn, os.path.getsize(compressed_fn)))
+
+    return result
+
+
+#-----------------------------------------------------------------------------
+def _compressed_hash(filename, decompress_func):
+    """ The hash of the uncompressed content of a compressed file (None if there is no valid file) """
+    if not os.path.exists(filename):
+        return None
+
+    try:
+        with open(filename, 'rb') as fp:
+            return hashlib.sha256(decompress_func(fp.read())).digest()
+    except Exception:
+        return None
+
+
+#-----------------------------------------------------------------------------
+def compression_summary(compressed_files):
+    """
+    The sizes of the compressed files, for printing
+
+    :param compressed_files: list of (output file, its size, write_precompressed() result) - see compile_exp()
+    :return: list of lines
+    """
+    result = []
+    for filename, raw_size, compressed in compressed_files:
+        result.append('{}: {:,} bytes'.format(os.path.basename(filename), raw_size))
+        for compressed_fn, size in compressed:
+            result.append('{}: {:,} bytes ({:.1f}% of original)'.format(os.path.basename(compressed_fn), size, 100 * size / max(raw_size, 1)))
+    return result
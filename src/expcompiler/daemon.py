@@ -0,0 +1,202 @@
+"""
+A long-running compile server. The compilation runs in warm worker processes (see expcompiler.batch), which keep
+the compiler's modules, the script template and the validation caches loaded between jobs, so a job costs only
+the compilation itself.
+
+The protocol: the client connects to the server's Unix domain socket, and sends one job - a JSON object in one line:
+
+    {"source": <xlsx file>, "target": <html file>, "local": "0"|"1", "options": {<compile_exp() argument>: <value>}}
+
+The server answers with one line - the job's result (see expcompiler.batch.compile_one()) with the time that the
+job waited in the queue ("queue_seconds"), or {"rc": 1, "error": <message>} if the job could not be run.
+At most n_workers jobs run at the same time; up to max_queue other jobs wait, and further jobs are rejected.
+"""
+
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import json
+import os
+import signal
+import socket
+import stat
+import tempfile
+import time
+
+import expcompiler.batch
+import expcompiler.compile
+
+
+#-----------------------------------------------------------------------------
+def default_socket_path():
+    return os.path.join(tempfile.gettempdir(), 'expcompiler-{}.sock'.format(os.getuid()))
+
+
+#-----------------------------------------------------------------------------
+def _valid_options():
+    """ The compile_exp() arguments that a job may specify """
+    return {arg for option, arg in expcompiler.compile.cli_flags} | \
+           {arg for option, arg, value_desc in expcompiler.compile.cli_value_options}
+
+
+#=============================================================================================
+class CompileDaemon(object):
+
+    def __init__(self, socket_path=None, n_workers=None, max_queue=100):
+        self.socket_path = socket_path or default_socket_path()
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._executor = None
+        self._slots = None
+        self._n_jobs = 0        # Running and waiting
+
+
+    #-----------------------------------------------------------------------------
+    def run(self):
+        """ Run the server until the process is stopped (with SIGTERM or SIGINT) """
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.serve())
+        finally:
+            loop.close()
+
+
+    #-----------------------------------------------------------------------------
+    async def serve(self):
+        self._remove_stale_socket()
+
+        self._slots = asyncio.Semaphore(self.n_workers)
+        self._executor = self._create_executor()
+        try:
+            server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+            print('Listening on {} ({} workers)'.format(self.socket_path, self.n_workers), flush=True)
+
+            loop = asyncio.get_event_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, server.close)
+
+            try:
+                async with server:
+                    await server.serve_forever()
+            except asyncio.CancelledError:
+                pass    # The server was closed
+            finally:
+                if os.path.exists(self.socket_path):
+                    os.unlink(self.socket_path)
+        finally:
+            self._executor.shutdown()
+
+
+    #-----------------------------------------------------------------------------
+    def _create_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.n_workers, initializer=expcompiler.batch.init_worker)
+
+
+    #-----------------------------------------------------------------------------
+    def _remove_stale_socket(self):
+        """ A socket file that was left by a server that didn't exit cleanly """
+        if os.path.exists(self.socket_path):
+            if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                raise ValueError('{} exists and is not a socket'.format(self.socket_path))
+            os.unlink(self.socket_path)
+
+
+    #-----------------------------------------------------------------------------
+    async def _handle_connection(self, reader, writer):
+        received = time.perf_counter()
+        try:
+            try:
+                job = json.loads((await reader.readline()).decode('utf-8'))
+                job_args = self._job_args(job)
+            except ValueError as e:
+                response = dict(rc=1, error='Invalid job: {}'.format(e))
+            else:
+                response = await self._run_job(job_args, received)
+
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+    #-----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _job_args(self, job):
+        """
+        Validate a job
+
+        :return: compile_one() arguments
+        :raises ValueError: invalid job
+        """
+        if not isinstance(job, dict):
+            raise ValueError('expecting a JSON object')
+
+        for key in ('source', 'target'):
+            if not isinstance(job.get(key), str) or not os.path.isabs(job[key]):
+                raise ValueError('"{}" must be an absolute path'.format(key))
+
+        options = job.get('options', {})
+        if not isinstance(options, dict):
+            raise ValueError('"options" must be a JSON object')
+        invalid = set(options) - _valid_options()
+        if len(invalid) > 0:
+            raise ValueError('unknown options: {}'.format(', '.join(sorted(invalid))))
+
+        #-- The server's working directory is not the client's
+        bundle_from = options.get('bundle_from')
+        if bundle_from is not None and (not isinstance(bundle_from, str) or not os.path.isabs(bundle_from)):
+            raise ValueError('"bundle_from" must be an absolute path')
+
+        return job['source'], job['target'], str(job.get('local', '0')), options
+
+
+    #-----------------------------------------------------------------------------
+    async def _run_job(self, job_args, received):
+        if self._n_jobs >= self.n_workers + self.max_queue:
+            return dict(rc=1, error='The compile server is busy ({} jobs are running or waiting)'.format(self._n_jobs))
+
+        self._n_jobs += 1
+        try:
+            async with self._slots:
+                started = time.perf_counter()
+                executor = self._executor
+                try:
+                    result = await asyncio.get_event_loop().run_in_executor(executor, expcompiler.batch.compile_one, *job_args)
+                except concurrent.futures.process.BrokenProcessPool as e:
+                    #-- A worker process died (e.g. it was killed), so the pool can't run any more jobs: replace it
+                    #-- (unless another job that failed at the same time already did)
+                    if self._executor is executor:
+                        self._executor = self._create_executor()
+                        executor.shutdown(wait=False)
+                    return dict(rc=1, error='The compiler process failed: {}'.format(e))
+        finally:
+            self._n_jobs -= 1
+
+        result['queue_seconds'] = started - received
+        return result
+
+
+#-----------------------------------------------------------------------------
+def send_job(socket_path, source, target, local_imports, options, timeout=None):
+    """
+    Send a job to the compile server, and wait for its result
+
+    :param options: compile_exp() arguments
+    :return: dict (see the protocol above)
+    """
+    if options.get('bundle_from') is not None:
+        options = dict(options, bundle_from=os.path.abspath(options['bundle_from']))
+    job = dict(source=os.path.abspath(source), target=os.path.abspath(target), local=str(local_imports), options=options)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(job) + '\n').encode('utf-8'))
+        response = b''
+        while not response.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+
+    return json.loads(response.decode('utf-8'))
@@ -2,6 +2,8 @@
 The definitions of an experiment, in internal format
 """
 
+import re
+
 
 #-----------------------------------------------------------
 class Experiment(object):
@@ -10,7 +12,8 @@ class Experiment(object):
     """
 
     def __init__(self, get_subj_id=False, get_session_id=False, save_results=False, start_of_session_beep=False,
-                 results_filename=None, background_color=None, full_screen=None, title=None, instructions=()):
+                 results_filename=None, background_color=None, full_screen=None, title=None, instructions=(), block_break_text=None,
+                 results_upload_url=None, results_upload_batch_size=20, results_upload_interval=10):
 
         assert isinstance(get_subj_id, bool)
         assert isinstance(get_session_id, bool)
@@ -22,6 +25,10 @@ class Experiment(object):
         assert background_color is None or isinstance(background_color, str)
         assert title is None or isinstance(title, str)
         assert instructions is None or isinstance(instructions, (list, tuple))
+        assert block_break_text is None or isinstance(block_break_text, str)
+        assert results_upload_url is None or isinstance(results_upload_url, str)
+        assert isinstance(results_upload_batch_size, int) and results_upload_batch_size > 0
+        assert isinstance(results_upload_interval, (int, float)) and results_upload_interval > 0
 
         self.get_subj_id = get_subj_id              # Whether to ask for the subject ID
         self.get_session_id = get_session_id        # Whether to ask for the session ID
@@ -32,6 +39,10 @@ class Experiment(object):
         self.title = title
         self.start_of_session_beep = start_of_session_beep
         self.instructions = [] if instructions is None else list(instructions)
+        self.block_break_text = block_break_text    # Text of the page shown between blocks (None = no such page)
+        self.results_upload_url = results_upload_url                # URL to which the results are uploaded (None = no upload)
+        self.results_upload_batch_size = results_upload_batch_size  # Upload the results after this number of trials...
+        self.results_upload_interval = results_upload_interval      # ... or after this number of seconds
 
         self.save_steps_without_responses = False
 
@@ -40,6 +51,36 @@ class Experiment(object):
         self.responses = {}     # key = name, value = Response
         self.trials = []        # list of Trial objects
         self.url_parameters = []
+        self.results_columns = []   # list of ResultsColumn objects - the custom columns of the results file, in order
+        self.page = None            # When the experiment is split into several pages: the Page that this object defines
+
+    @property
+    def uses_blocks(self):
+        """
+        Whether the trials are divided into blocks
+        """
+        return any(trial.block is not None for trial in self.trials)
+
+    @property
+    def blocks(self):
+        """
+        The trials, divided into blocks (each block is a sequence of consecutive trials)
+
+        :return: list of (block name, list of Trial)
+        """
+        result = []
+        for trial in self.trials:
+            if len(result) == 0 or result[-1][0] != trial.block:
+                result.append((trial.block, []))
+            result[-1][1].append(trial)
+        return result
+
+    @property
+    def results_column_names(self):
+        """
+        The names of the custom columns in the results file, in the order in which they are defined
+        """
+        return [col.name for col in self.results_columns]
 
 
 #===============================================================================================
@@ -67,6 +108,48 @@ class TextControl(Control):
         self.frame = frame
         self.css = css or {}    # CSS definitions
 
+
+#-----------------------------------------------------------
+class MediaControl(Control):
+    """
+    A control that presents a media file. The file (URL) is specified per trial; "source" is used in trials that
+    don't specify it.
+    """
+
+    #-- The file extensions of the supported files
+    extensions = ()
+
+    def __init__(self, name, source):
+        super().__init__(name)
+        self.source = source
+
+    @classmethod
+    def is_valid_source(cls, source):
+        return re.match(r'^[^\s<>"\']+\.({})$'.format('|'.join(cls.extensions)), source, re.IGNORECASE) is not None
+
+
+#-----------------------------------------------------------
+class ImageControl(MediaControl):
+
+    extensions = ('png', 'jpg', 'jpeg', 'gif', 'svg', 'webp', 'bmp')
+
+    def __init__(self, name, source, frame, css=None):
+        assert frame is not None and isinstance(frame, Frame)
+
+        super().__init__(name, source)
+        self.frame = frame
+        self.css = css or {}    # CSS definitions
+
+
+#-----------------------------------------------------------
+class AudioControl(MediaControl):
+    """
+    A sound, played when the step that uses it is shown. It has no visual presentation.
+    """
+
+    extensions = ('mp3', 'wav', 'ogg', 'oga', 'm4a', 'aac', 'flac')
+
+
 #-----------------------------------------------------------
 class Frame(object):
 
@@ -165,6 +248,8 @@ class Trial(object):
 
     def __init__(self, trial_type):
         self.trial_type = trial_type
+        self.block = None           # Name of the block to which this trial belongs (None = no blocks)
+        self.repetitions = 1        # Number of times to run this trial (in a row)
         self.control_values = {}    # Values to assign to each control (e.g., the text for a TextControl). dict key = the control name
         self.save_values = {}       # Values to save to the results file (dict key = output column name)
         self.css = {}
@@ -174,6 +259,23 @@ class Trial(object):
             self.css[control_name] = {}
         self.css[control_name][css_attr] = value
 
+#===============================================================================================
+# Results
+#===============================================================================================
+
+class ResultsColumn(object):
+    """
+    A custom column in the results file, whose value is taken from the trial data
+    """
+
+    config_trial_number = 'config_trial_number'
+    block = 'block'
+
+    def __init__(self, name, timeline_var):
+        self.name = name                    # Column name in the results file
+        self.timeline_var = timeline_var    # Name of the per-trial variable from which the value is taken
+
+
 #===============================================================================================
 # URL parameters
 #===============================================================================================
@@ -187,3 +289,23 @@ class UrlParameter(object):
     @property
     def js_var_name(self):
         return "param_" + self.name
+
+
+#===============================================================================================
+# Pages
+#===============================================================================================
+
+class Page(object):
+    """
+    One page of an experiment that was split into several pages (see expcompiler.pages)
+    """
+
+    def __init__(self, num, n_pages, first_trial_number, next_page_url):
+        self.num = num                                  # 1-based
+        self.n_pages = n_pages
+        self.first_trial_number = first_trial_number    # The index of the page's first trial in the full experiment
+        self.next_page_url = next_page_url              # None for the last page
+
+    @property
+    def is_last(self):
+        return self.next_page_url is None
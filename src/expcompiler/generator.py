@@ -3,15 +3,18 @@ Generate the experiment script
 """
 
 import os
+import re
 import html
+import hashlib
 import enum
 import numbers
+import functools
 
 import json
 
-import expcompiler
+import expcompiler.experiment
 import expcompiler.experiment as expobj
-from expcompiler.parser import _to_str
+from expcompiler.utils import to_str as _to_str
 
 
 class StepType(enum.Enum):
@@ -29,6 +32,13 @@ class StepType(enum.Enum):
     html_button_response = 'jsPsychHtmlButtonResponse'
 
 
+#-- The sound file played at the beginning of the session
+start_of_session_beep_file = 'start-session-beep.mp3'
+
+#-- The number of hash digits in the per-trial formatting's CSS class names (more are used if two names collide)
+css_class_hash_length = 8
+
+
 #============================================================================================
 class ExpGenerator(object):
     """
@@ -36,20 +46,38 @@ class ExpGenerator(object):
     """
 
     # ----------------------------------------------------------------------------
-    def __init__(self, logger, imports_local=True):
+    def __init__(self, logger, imports_local=True, minify=False, trial_data_url=None, compact_trials=False,
+                 persist_results=False, drop_filtered_results=False, compact_results=False, service_worker_url=None,
+                 asset_urls=None, persistent_layout=False, precise_timing=False,
+                 telemetry=False):
         self.template = self._load_template()
         self.logger = logger
         self.errors_found = False
         self.imports_local = imports_local
+        self.minify = minify                    # Generate compact output: no indentation/comments, short internal names
+        self.trial_data_url = trial_data_url    # If specified, the trial data is loaded from this JSON file rather than embedded in the HTML
+        self.compact_trials = compact_trials    # Merge identical consecutive trials into one trial with repetitions
+        self.persist_results = persist_results  # Store each trial's results in the browser's IndexedDB as soon as it ends
+        self.drop_filtered_results = drop_filtered_results  # Remove the trials that are not saved from jsPsych's data store
+        self.compact_results = compact_results  # Save the results file in the compact JSON format rather than as CSV
+        self.service_worker_url = service_worker_url    # If specified, the page registers this service worker (for running offline)
+        self.asset_urls = asset_urls or {}      # The URLs of bundled assets. key = the asset's local URL
+        self.persistent_layout = persistent_layout  # Create the layout controls once, and only show/hide/update them in each step
+        self.precise_timing = precise_timing    # Align the steps' onset/offset to display frames, and save the measured durations
+        self.telemetry = telemetry              # Save the display's refresh rate, long tasks, dropped frames and page-load timings
+        self._short_names = {}
+        self._trial_css_classes = {}    # CSS class names for the per-trial formatting. key = CSS definitions
+        self._blocks = []               # exp.blocks (empty if the trials are not divided into blocks)
+        self._block_first_trials = []   # The index of each block's first trial in exp.trials
+        self._media_manifest = None     # media_manifest() of the experiment that was last generated
+        self._media_manifest_exp = None
 
     # ----------------------------------------------------------------------------
     def _load_template(self):
         """
         Load the template file (contains HTML text with placeholders for JS code)
         """
-        template_filename = os.path.dirname(__file__) + os.sep + 'script_template.js'
-        with open(template_filename, 'r') as fp:
-            return fp.read()
+        return _read_template(os.path.dirname(__file__) + os.sep + 'script_template.js')
 
     # ----------------------------------------------------------------------------
     def generate(self, exp):
@@ -65,29 +93,88 @@ class ExpGenerator(object):
             return None
 
         self.errors_found = False
+        self._init_short_names(exp)
+        self._init_trial_css_classes(exp)
+        self._init_blocks(exp)
+        self._media_manifest = self._create_media_manifest(exp)
+        self._media_manifest_exp = exp
+
         script = self.template
         script = script.replace('${title}', self.generate_title_code(exp))
-        script = script.replace('${imports}', self.generate_imports())
+        script = script.replace('${imports}', self.generate_imports(exp))
         script = script.replace('${layout_css}', self.generate_layout_code(exp))
         script = script.replace('${url_parameters}', self.generate_url_parameters(exp))
         script = script.replace('${preload_sounds}', self.generate_preload_sounds(exp))
         script = script.replace('${play_start_of_session_beep}', self.generate_play_start_of_session_beep(exp))
+        script = script.replace('${telemetry}', self.generate_telemetry_code(exp))
         script = script.replace('${instructions}', self.generate_instructions_code(exp))
         script = script.replace('${trials}', self.generate_trials_code(exp))
         script = script.replace('${trial_flow}', self.generate_trial_flow_code(exp))
         script = script.replace('${filter_trials_func}', self.generate_filter_trials_func(exp))
+        script = script.replace('${save_results}', self.generate_save_results_code(exp))
         script = script.replace('${init_jspsych_params}', self.generate_init_jspysch_params(exp))
+        script = script.replace('${layout_plugin}', self.generate_layout_plugin_code(exp))
+        script = script.replace('${page}', self.generate_page_code(exp))
         script = script.replace('${results_filename}', self.generate_results_file_name(exp))
 
+        if self.minify:
+            script = minify_script(script)
+
         return script
 
 
+    #------------------------------------------------------------
+    #  Names of internal JS identifiers
+    #------------------------------------------------------------
+
+    #----------------------------------------------------------------------------
+    def _init_short_names(self, exp):
+        """
+        In minify mode, assign a short name to each internal identifier (step names and timeline variables).
+        The names are assigned in a fixed order, so the same experiment always gets the same names.
+        """
+        self._short_names = {}
+        if not self.minify:
+            return
+
+        for ttype in exp.trial_types.values():
+            for step in ttype.steps:
+                self._short_name(self._full_step_name(step, ttype))
+                if self._has_audio(step, exp):
+                    self._short_name(self._step_audio_name(step, ttype))
+
+        for column in exp.results_columns:
+            self._short_name(column.timeline_var)
+
+        self._short_name('repetitions')
+        self._short_name('images')
+
+    #----------------------------------------------------------------------------
+    def _short_name(self, name):
+        """
+        Get the name to use in the script for an internal identifier (in minify mode - a short name)
+        """
+        if not self.minify:
+            return name
+
+        if name not in self._short_names:
+            self._short_names[name] = '_' + _to_base36(len(self._short_names))
+
+        return self._short_names[name]
+
+
     #------------------------------------------------------------
     #  Code replacing the ${results_filename} keyword
     #------------------------------------------------------------
 
     def generate_results_file_name(self, exp):
-        return "'"+exp.results_filename+"'.replace('${date}', new Date().toISOString().slice(0, 10))"
+        filename = exp.results_filename
+        if exp.page is not None:
+            #-- Each page saves its own results file
+            filename = '{}_page{}{}'.format(os.path.splitext(filename)[0], exp.page.num, os.path.splitext(filename)[1])
+        if self.compact_results:
+            filename = os.path.splitext(filename)[0] + '.json'
+        return "'"+filename+"'.replace('${date}', new Date().toISOString().slice(0, 10))"
 
 
     #------------------------------------------------------------
@@ -102,29 +189,100 @@ class ExpGenerator(object):
     #  Code replacing the ${imports} keyword
     #------------------------------------------------------------
 
-    def generate_imports(self):
+    def generate_imports(self, exp):
+        """
+        Import jsPsych and the plugins used by this experiment. The scripts are deferred (the experiment's script
+        runs only after they were loaded), so they don't block the page.
+        """
+        lines = []
+
+        if not self.imports_local:
+            lines.append('<link rel="preconnect" href="https://unpkg.com">')
 
-        lines = [
-            self._import_script('jspsych-7.1/jspsych.js' if self.imports_local else 'https://unpkg.com/jspsych@7.1.2'),
-            self._import_plugin('html-keyboard-response'),
-            self._import_plugin('html-button-response'),
-            self._import_plugin('audio-keyboard-response'),
-            self._import_plugin('preload'),
-            self._import_css("jspsych-7.1/css/jspsych.css" if self.imports_local else "https://unpkg.com/jspsych@7.1.2/css/jspsych.css"),
-        ]
+        data_url = self._first_trial_data_url(exp)
+        if data_url is not None:
+            #-- Start loading the trial data immediately
+            lines.append('<link rel="preload" href="{}" as="fetch" crossorigin="anonymous">'.format(html.escape(data_url)))
+
+        lines.extend(self._import_script(url) for url in self.script_urls(exp))
+        lines.append(self._import_css(self.css_url()))
+
+        if self.service_worker_url is not None:
+            lines.extend([
+                '<script>',
+                tabs(1) + '//-- The service worker caches the experiment\'s files, so it can run offline',
+                tabs(1) + "if ('serviceWorker' in navigator) {",
+                tabs(2) + "window.addEventListener('load', function() {{ navigator.serviceWorker.register('{}'); }});".format(self.service_worker_url),
+                tabs(1) + '}',
+                '</script>',
+            ])
 
         return '\n'.join(tabs(1) + line for line in lines)
 
 
-    def _import_plugin(self, plugin_name):
-        if self.imports_local:
-            return '<script src="jspsych-7.1/plugin-{}.js"></script>'.format(plugin_name)
+    def script_urls(self, exp):
+        """
+        The URLs of the scripts to import: jsPsych and the plugins used by this experiment
+        """
+        result = [self._asset_url('jspsych-7.1/jspsych.js') if self.imports_local else 'https://unpkg.com/jspsych@7.1.2']
+        for plugin_name in self.required_plugins(exp):
+            if self.imports_local:
+                result.append(self._asset_url('jspsych-7.1/plugin-{}.js'.format(plugin_name)))
+            else:
+                result.append('https://unpkg.com/@jspsych/plugin-{}@1.1.0'.format(plugin_name))
+        return result
+
+
+    def css_url(self):
+        return self._asset_url("jspsych-7.1/css/jspsych.css") if self.imports_local else "https://unpkg.com/jspsych@7.1.2/css/jspsych.css"
+
+
+    def _asset_url(self, url):
+        """ The URL of a local asset (which may be bundled under another name) """
+        return self.asset_urls.get(url, url)
+
+
+    def required_plugins(self, exp):
+        """
+        Get the names of jsPsych plugins that this experiment uses
+        """
+        response_types = [self.check_response_type(instruction.response_names, exp) for instruction in exp.instructions]
+        response_types += [self.check_response_type(step.responses, exp) for ttype in exp.trial_types.values() for step in ttype.steps
+                           if not self._layout_step(step, exp)]
+
+        result = []
+
+        #-- Steps without button responses are keyboard-response steps
+        if any(t != StepType.html_button_response for t in response_types) or (exp.uses_blocks and exp.block_break_text is not None):
+            result.append('html-keyboard-response')
+
+        if StepType.html_button_response in response_types:
+            result.append('html-button-response')
+
+        if exp.start_of_session_beep:
+            result.extend(['audio-keyboard-response', 'preload'])
+        elif len(self.media_manifest(exp)) > 0:
+            result.append('preload')
+
+        if self.trial_data_url is not None or exp.uses_blocks or self._uses_telemetry(exp) or \
+                any(self._has_images(ttype, exp) for ttype in exp.trial_types.values()):
+            result.append('call-function')
+
+        return result
+
+
+    def _first_trial_data_url(self, exp):
+        """ The URL of the first trial data file to load (None if the trial data is embedded in the HTML) """
+        if self.trial_data_url is None:
+            return None
+        elif exp.uses_blocks:
+            return self._block_data_url(0)
         else:
-            return '<script src="https://unpkg.com/@jspsych/plugin-{}@1.1.0"></script>'.format(plugin_name)
+            return self.trial_data_url
 
 
     def _import_script(self, url):
-        return '<script src="{}"></script>'.format(url)
+        return '<script src="{}" defer></script>'.format(url)
 
     def _import_css(self, url):
         return '<link href="{}" rel="stylesheet" type="text/css"/>'.format(url)
@@ -139,9 +297,13 @@ class ExpGenerator(object):
         """ Main function in this part - returns the text replacing the ${layout} keyword """
         result = []
         for control in exp.layout.values():
-            if isinstance(control, expobj.TextControl):
+            if isinstance(control, (expobj.TextControl, expobj.ImageControl)):
                 result.extend(self.generate_single_layout_css_text(control))
 
+        #-- Per-trial formatting (defined after the layout, so it overrides the layout's formatting)
+        for css_text, class_name in sorted(self._trial_css_classes.items(), key=lambda item: item[1]):
+            result.append('.{} {{ {} }}'.format(class_name, css_text))
+
         return "\n".join([tabs(2) + r for r in result])
 
     #----------------------------------------------------------------------------
@@ -156,6 +318,10 @@ class ExpGenerator(object):
 
         result.append("}")
 
+        #-- The image is scaled down to fit its frame
+        if isinstance(ctl, expobj.ImageControl):
+            result.append(".{} img {{ max-width: 100%; max-height: 100%; }}".format(ctl.name))
+
         return result
 
 
@@ -185,6 +351,59 @@ class ExpGenerator(object):
         return result
 
 
+    #------------------------------------------------------------
+    #  Code replacing the ${layout_plugin} keyword
+    #------------------------------------------------------------
+
+    #----------------------------------------------------------------------------
+    def generate_layout_plugin_code(self, exp):
+        """
+        In persistent-layout or precise-timing mode: a jsPsych plugin that shows the trial steps.
+
+        In persistent-layout mode, the controls' <div>s are created once; each step only updates the text and
+        formatting of its controls, and shows them.
+        In precise-timing mode, the stimulus is shown and hidden on display frames (with requestAnimationFrame), and
+        the measured durations are saved in the results.
+        """
+        if not self.persistent_layout and not self.precise_timing:
+            return ''
+
+        #-- Controls with an explicit position are hidden with "visibility", so showing them doesn't move other controls
+        controls = [[control.name, control.frame.top is not None or control.frame.left is not None]
+                    for control in exp.layout.values() if isinstance(control, (expobj.TextControl, expobj.ImageControl))]
+
+        return _LAYOUT_STEP_PLUGIN_CODE \
+            .replace('${layout_controls}', json.dumps(controls)) \
+            .replace('${precise_timing}', 'true' if self.precise_timing else 'false')
+
+
+    #------------------------------------------------------------
+    #  Code replacing the ${page} keyword
+    #------------------------------------------------------------
+
+    #----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def generate_page_code(self, exp):
+        """
+        When the experiment is split into pages (see expcompiler.pages): the session ID, which is saved with each
+        trial, and the continuation to the next page
+        """
+        if exp.page is None:
+            return ''
+
+        return _PAGE_CODE \
+            .replace('${page_num}', str(exp.page.num)) \
+            .replace('${n_pages}', str(exp.page.n_pages)) \
+            .replace('${next_page_url}', json.dumps(exp.page.next_page_url))
+
+
+    #----------------------------------------------------------------------------
+    def _layout_step(self, step, exp):
+        """ Whether the step is shown by the layout-step plugin (steps with button responses are not) """
+        return (self.persistent_layout or self.precise_timing) and \
+            self.check_response_type(step.responses, exp) != StepType.html_button_response
+
+
     #------------------------------------------------------------
     #  Code replacing the ${url_parameters} keyword
     #------------------------------------------------------------
@@ -215,22 +434,164 @@ class ExpGenerator(object):
     #------------------------------------------------------------
     def generate_preload_sounds(self, exp):
         """
-        Code replacing the ${init_sounds} keyword
+        Code replacing the ${init_sounds} keyword: preload the start-of-session beep and the media files of the
+        first preloading stage (see media_manifest())
         """
-        if not exp.start_of_session_beep:
+        manifest = self.media_manifest(exp)
+        if not exp.start_of_session_beep and len(manifest) == 0:
             return ''
 
-        lines = [
+        lines = []
+
+        if len(manifest) > 0:
+            lines.extend(self._media_preload_code(manifest))
+
+        lines.extend([
             '//-- Preload audio files',
             'const preload_audio = {',
             tabs(1) + "type: jsPsychPreload,",
-            tabs(1) + "auto_preload: true",
+        ])
+
+        if len(manifest) > 0:
+            lines.extend([
+                tabs(1) + "auto_preload: {},".format('true' if exp.start_of_session_beep else 'false'),
+                tabs(1) + "images: media_manifest[0].images,",
+                tabs(1) + "audio: media_manifest[0].audio,",
+                tabs(1) + "video: media_manifest[0].video,",
+                tabs(1) + "continue_after_error: true,",
+                tabs(1) + "data: {media_preload: 0},",
+                tabs(1) + "on_start: function() {",
+                tabs(2) + "preload_media_in_background(1);",
+                tabs(2) + "media_preload_start = performance.now();",
+                tabs(1) + "},",
+                tabs(1) + "on_finish: record_media_preload,",
+            ])
+        else:
+            lines.append(tabs(1) + "auto_preload: true")
+
+        lines.extend([
             "}",
             "timeline.push(preload_audio);",
-        ]
+        ])
 
         return '\n'.join(tabs(2) + line for line in lines)
 
+    #------------------------------------------------------------
+    def _media_preload_code(self, manifest):
+        """
+        The preloading manifest, and the functions for preloading the media files of the later stages in the background
+        """
+        lines = [
+            '//-- The media files to preload. Stage #0 is loaded before the experiment starts; stage #i (for i > 0) has',
+            '//-- the files of block #i, which are loaded in the background while the previous block runs',
+            'const media_manifest = [',
+        ]
+        for stage in manifest:
+            lines.append(tabs(1) + '{{images: {}, audio: {}, video: {}}},'.format(_js_str(stage['images']), _js_str(stage['audio']),
+                                                                               _js_str(stage['video'])))
+        lines.extend([
+            '];',
+            'const media_background_loads = {};   // key = stage number',
+            'let media_preload_start = null;',
+            '',
+            'function preload_media_in_background(stage) {',
+            tabs(1) + 'if (stage >= media_manifest.length || stage in media_background_loads) {',
+            tabs(2) + 'return;',
+            tabs(1) + '}',
+            tabs(1) + 'const load = {start: performance.now(), duration: null, failed: []};',
+            tabs(1) + 'media_background_loads[stage] = load;',
+            tabs(1) + 'let n_pending = 3;',
+            tabs(1) + 'function complete() {',
+            tabs(2) + 'n_pending--;',
+            tabs(2) + 'if (n_pending == 0) {',
+            tabs(3) + 'load.duration = Math.round(performance.now() - load.start);',
+            tabs(2) + '}',
+            tabs(1) + '}',
+            tabs(1) + 'function failed(error) {',
+            tabs(2) + 'load.failed.push(error.source || String(error));',
+            tabs(1) + '}',
+            tabs(1) + 'jsPsych.pluginAPI.preloadImages(media_manifest[stage].images, complete, function() {}, failed);',
+            tabs(1) + 'jsPsych.pluginAPI.preloadAudio(media_manifest[stage].audio, complete, function() {}, failed);',
+            tabs(1) + 'jsPsych.pluginAPI.preloadVideo(media_manifest[stage].video, complete, function() {}, failed);',
+            '}',
+            '',
+            '//-- The time spent waiting for the files, and the background loading results, are saved in the results',
+            'function record_media_preload(data) {',
+            tabs(1) + 'data.preload_duration = Math.round(performance.now() - media_preload_start);',
+            tabs(1) + 'const load = media_background_loads[data.media_preload];',
+            tabs(1) + 'if (load) {',
+            tabs(2) + 'data.background_load_duration = load.duration;',
+            tabs(2) + 'data.background_load_failed = load.failed;',
+            tabs(1) + '}',
+            '}',
+            '',
+            '//-- Before each block: wait until its files were loaded (they were cached by the background loading)',
+            'function media_preload_step(stage) {',
+            tabs(1) + 'return {',
+            tabs(2) + 'type: jsPsychPreload,',
+            tabs(2) + 'images: media_manifest[stage].images,',
+            tabs(2) + 'audio: media_manifest[stage].audio,',
+            tabs(2) + 'video: media_manifest[stage].video,',
+            tabs(2) + 'continue_after_error: true,',
+            tabs(2) + 'data: {media_preload: stage},',
+            tabs(2) + 'on_start: function() {',
+            tabs(3) + 'media_preload_start = performance.now();',
+            tabs(2) + '},',
+            tabs(2) + 'on_finish: record_media_preload,',
+            tabs(1) + '};',
+            '}',
+            '',
+        ])
+        return lines
+
+    #------------------------------------------------------------
+    def media_manifest(self, exp):
+        """
+        The media files (images, audio, video) to which the layout and the trials refer, divided into preloading
+        stages: the first stage has the files in the layout and in the first block; each further stage has the
+        (new) files of one block.
+
+        The manifest of the experiment that was last generated is computed once, in generate().
+
+        :return: list of dict (key = 'images', 'audio', 'video'; value = list of URLs). Empty list if there are no media files
+        """
+        if exp is self._media_manifest_exp:
+            return self._media_manifest
+        return self._create_media_manifest(exp)
+
+
+    #----------------------------------------------------------------------------
+    def _create_media_manifest(self, exp):
+        """ Compute media_manifest() """
+        texts = []
+        for control in exp.layout.values():
+            texts.append(getattr(control, 'text', None))
+            texts.append(getattr(control, 'source', None))
+            texts.extend(getattr(control, 'css', {}).values())
+
+        blocks = exp.blocks if exp.uses_blocks else [(None, exp.trials)]
+        stages = []
+        loaded = set()
+
+        for i, (block_name, trials) in enumerate(blocks):
+            #-- The layout's media are loaded with the first block
+            block_texts = list(texts) if i == 0 else []
+            for trial in trials:
+                block_texts.extend(trial.control_values.values())
+                block_texts.extend(v for control_css in trial.css.values() for v in control_css.values())
+
+            stage = dict(images=[], audio=[], video=[])
+            for url in _media_references(block_texts):
+                if url not in loaded:
+                    loaded.add(url)
+                    stage[_media_kind(url)].append(url)
+            stages.append(stage)
+
+        if len(loaded) == 0:
+            return []
+
+        return stages
+
 
     #------------------------------------------------------------
     def generate_play_start_of_session_beep(self, exp):
@@ -244,7 +605,7 @@ class ExpGenerator(object):
             '//-- Play the start-session sound',
             'const play_start_session_beep = {',
             tabs(1) + 'type: jsPsychAudioKeyboardResponse,',
-            tabs(1) + 'stimulus: ["start-session-beep.mp3"],',
+            tabs(1) + 'stimulus: ["{}"],'.format(self._asset_url(start_of_session_beep_file)),
             tabs(1) + 'choices: "NO_KEYS",',
             tabs(1) + 'trial_ends_after_audio: true,',
             tabs(1) + 'post_trial_gap: 1000,',
@@ -316,6 +677,7 @@ class ExpGenerator(object):
             type: ${response_type},
             stimulus: "<div>${instruction_text}</div>",
             choices: ${choices},
+            data: {instruction: true},
         }
         
         const instruction${pos}_flow =
@@ -328,6 +690,33 @@ class ExpGenerator(object):
 
         return result
 
+    #------------------------------------------------------------
+    #  Code replacing the ${telemetry} keyword
+    #------------------------------------------------------------
+
+    #----------------------------------------------------------------------------
+    def generate_telemetry_code(self, exp):
+        """
+        Measuring how the experiment performs on the participant's machine: the display's refresh rate and frame
+        jitter (in a short calibration step before the first trial), the long tasks and dropped frames during each
+        saved step, and the page-load timings. See expcompiler.telemetry for summarizing these measures.
+        """
+        if not self.telemetry:
+            return ''
+
+        if not exp.save_results:
+            self.logger.error('Warning: the telemetry is saved only in the results file, but the experiment does not save results',
+                              'TELEMETRY_WITHOUT_SAVE_RESULTS')
+            return ''
+
+        return _TELEMETRY_CODE
+
+
+    #----------------------------------------------------------------------------
+    def _uses_telemetry(self, exp):
+        return self.telemetry and exp.save_results
+
+
     #------------------------------------------------------------
     #  Code replacing the ${trials} keyword
     #------------------------------------------------------------
@@ -337,40 +726,259 @@ class ExpGenerator(object):
         """
         Generate an array with the data for each trial
         """
-        lines = ['const trial_data = [']
+        if exp.uses_blocks:
+            return self.generate_block_data_code(exp)
+
+        if self.trial_data_url is not None:
+            return self.generate_trial_data_loading_code(exp)
+
+        lines = self.generate_expand_repetitions_func(exp)
 
-        for config_trial_number, trial in enumerate(exp.trials):
-            lines.extend(self.generate_one_trial_data(trial, exp, config_trial_number))
+        if self._uses_repetitions(exp):
+            lines.append('const trial_data = expand_repetitions([')
+        else:
+            lines.append('const trial_data = [')
+
+        for trial, config_trial_numbers in self._trial_rows(exp.trials, exp, self._page_first_trial_number(exp)):
+            lines.extend(self.generate_one_trial_data(trial, exp, config_trial_numbers))
 
-        lines.append('];')
+        lines.append(']);' if self._uses_repetitions(exp) else '];')
 
         return "\n".join(lines)
 
 
     #----------------------------------------------------------------------------
-    def generate_one_trial_data(self, trial, exp, config_trial_number):
+    def _uses_repetitions(self, exp):
+        """ Whether a row of the trial data may stand for several trials """
+        return self.compact_trials or any(trial.repetitions > 1 for trial in exp.trials)
+
+
+    #----------------------------------------------------------------------------
+    def generate_expand_repetitions_func(self, exp):
+        """
+        A JS function that converts the trial data rows into one entry per trial. The repetitions of a row share the
+        row's data (only the config_trial_number is specific to each repetition).
+        """
+        if not self._uses_repetitions(exp):
+            return []
+
+        repetitions = self._short_name('repetitions')
+        config_trial_number = self._short_name(expobj.ResultsColumn.config_trial_number)
+
+        lines = [
+            'function expand_repetitions(rows) {',
+            tabs(1) + 'const result = [];',
+            tabs(1) + 'rows.forEach(function(row) {',
+            tabs(2) + 'const n = Number(row.{} || 1);'.format(repetitions),
+            tabs(2) + 'for (let i = 0; i < n; i++) {',
+            tabs(3) + 'if (Array.isArray(row.{})) {{'.format(config_trial_number),
+            tabs(4) + 'const trial = Object.assign({}, row);',
+            tabs(4) + 'trial.{0} = row.{0}[i];'.format(config_trial_number),
+            tabs(4) + 'result.push(trial);',
+            tabs(3) + '} else {',
+            tabs(4) + 'result.push(row);',
+            tabs(3) + '}',
+            tabs(2) + '}',
+            tabs(1) + '});',
+            tabs(1) + 'return result;',
+            '}',
+            '',
+        ]
+
+        return [tabs(2) + line for line in lines]
+
+
+    #----------------------------------------------------------------------------
+    def _trial_rows(self, trials, exp, first_trial_number):
+        """
+        Get the rows of the trial data. Each row is a trial, possibly with repetitions (if the trial has repetitions,
+        or, in compact mode, if several consecutive trials are identical).
+
+        :param first_trial_number: The index of the first trial in the full experiment
+        :return: list of (Trial, list of config_trial_number - one per repetition)
+        """
+        rows = []
+        prev_key = None
+
+        for config_trial_number, trial in enumerate(trials, first_trial_number):
+            numbers = [config_trial_number] * trial.repetitions
+
+            key = _trial_content_hash(trial) if self.compact_trials else None
+            if key is not None and key == prev_key:
+                rows[-1][1].extend(numbers)
+            else:
+                rows.append((trial, numbers))
+            prev_key = key
+
+        return rows
+
+
+    #----------------------------------------------------------------------------
+    def generate_trial_data_loading_code(self, exp):
+        """
+        Code for loading the trial data from a separate file. The loading starts as soon as the page is loaded.
+        """
+        lines = [
+            '//-- The trial data is loaded from a separate file, while the instructions are shown',
+            'const trial_data = [];',
+            'const trial_data_loaded = fetch({}).then(function(response) {{'.format(json.dumps(self.trial_data_url)),
+            tabs(1) + 'if (!response.ok) {',
+            tabs(2) + "throw new Error('HTTP status ' + response.status);",
+            tabs(1) + '}',
+            tabs(1) + 'return response.json();',
+            '}).then(function(data) {',
+            tabs(1) + 'trial_data.push.apply(trial_data, {});'.format('expand_repetitions(data)' if self._uses_repetitions(exp) else 'data'),
+            '});',
+        ]
+        return '\n'.join(self.generate_expand_repetitions_func(exp) + [tabs(2) + line for line in lines])
+
+
+    #----------------------------------------------------------------------------
+    def generate_block_data_code(self, exp):
+        """
+        The trial data when the trials are divided into blocks. The data of each block is materialized only when the
+        block is about to start: it's either embedded as a JSON string (decoded when the block starts), or loaded
+        from a separate file (the loading starts when the previous block starts).
+        """
+        lines = ['//-- The trial data of each block (materialized only when the block starts)']
+
+        if self.trial_data_url is None:
+            lines.append('const block_trial_data = [')
+            for i, (block_name, trials) in enumerate(self._blocks):
+                block_json = self._trials_json(trials, exp, self._first_trial_number(exp, i), separator=',')
+                lines.append(tabs(1) + json.dumps(block_json, ensure_ascii=False).replace('</', '<\\/') + ',')
+            lines.append('];')
+            lines.extend([
+                '',
+                'function load_block_data(block_num) {',
+                tabs(1) + '//-- Each block is loaded once: only its decoded trials are kept, not the JSON string too',
+                tabs(1) + 'const block_json = block_trial_data[block_num];',
+                tabs(1) + 'block_trial_data[block_num] = null;',
+                tabs(1) + 'return Promise.resolve({}(JSON.parse(block_json)));'.format(
+                    'expand_repetitions' if self._uses_repetitions(exp) else ''),
+                '}',
+            ])
+
+        else:
+            urls = [self._block_data_url(i) for i in range(len(self._blocks))]
+            lines.extend([
+                'const block_data_urls = {};'.format(json.dumps(urls)),
+                '',
+                'function load_block_data(block_num) {',
+                tabs(1) + 'return fetch(block_data_urls[block_num]).then(function(response) {',
+                tabs(2) + 'if (!response.ok) {',
+                tabs(3) + "throw new Error('HTTP status ' + response.status);",
+                tabs(2) + '}',
+                tabs(2) + 'return response.json();',
+                tabs(1) + '}}){};'.format('.then(expand_repetitions)' if self._uses_repetitions(exp) else ''),
+                '}',
+                '',
+                '//-- The first block is loaded while the instructions are shown',
+                'let next_block_data = load_block_data(0);',
+            ])
+
+        return '\n'.join(self.generate_expand_repetitions_func(exp) + [tabs(2) + line for line in lines])
+
+
+    #----------------------------------------------------------------------------
+    def trial_data_files(self, exp):
+        """
+        The trial data files, when the trial data is not embedded in the HTML: one file, or one file per block
+
+        :return: list of (file name, JSON text)
+        """
+        assert self.trial_data_url is not None
+        self._init_short_names(exp)
+        self._init_trial_css_classes(exp)
+        self._init_blocks(exp)
+
+        if exp.uses_blocks:
+            return [(self._block_data_url(i), self._trials_json(trials, exp, self._first_trial_number(exp, i)))
+                    for i, (block_name, trials) in enumerate(self._blocks)]
+        else:
+            return [(self.trial_data_url, self._trials_json(exp.trials, exp, 0))]
+
+
+    #----------------------------------------------------------------------------
+    def _block_data_url(self, block_num):
+        """ The URL of the data file of one block (e.g. "exp.trials.json" -> "exp.trials.1.json") """
+        base, ext = os.path.splitext(self.trial_data_url)
+        return '{}.{}{}'.format(base, block_num + 1, ext)
+
 
+    #----------------------------------------------------------------------------
+    def _first_trial_number(self, exp, block_num):
+        """ The index of the first trial in the given block (see _page_first_trial_number()) """
+        return self._page_first_trial_number(exp) + self._block_first_trials[block_num]
+
+
+    #----------------------------------------------------------------------------
+    def _init_blocks(self, exp):
+        """
+        Divide the trials into blocks, once per generation (exp.blocks builds the list of blocks on each access)
+        """
+        self._blocks = exp.blocks if exp.uses_blocks else []
+        self._block_first_trials = []
+        n_trials = 0
+        for block_name, trials in self._blocks:
+            self._block_first_trials.append(n_trials)
+            n_trials += len(trials)
+
+
+    #----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _page_first_trial_number(self, exp):
+        """
+        The index of exp.trials[0] in the full experiment: when the experiment is split into pages, the trials are
+        numbered across all pages
+        """
+        return 0 if exp.page is None else exp.page.first_trial_number
+
+
+    #----------------------------------------------------------------------------
+    def _trials_json(self, trials, exp, first_trial_number, separator=',\n'):
+        """
+        The data of the given trials, as a JSON array
+        """
         result = []
+        for trial, config_trial_numbers in self._trial_rows(trials, exp, first_trial_number):
+            ttype = exp.trial_types[trial.trial_type]
+            entries = [(self._step_name(step, ttype), self._step_stimulus(step, trial, exp)) for step in ttype.steps]
+            entries += [(k, [str(x) for x in v] if isinstance(v, list) else str(v))
+                        for k, v in self._trial_saved_values(trial, exp, config_trial_numbers)]
+            result.append('{' + ','.join('{}:{}'.format(json.dumps(k), json.dumps(v, ensure_ascii=False, separators=(',', ':'))) for k, v in entries) + '}')
+
+        if separator == ',\n':
+            return '[\n' + separator.join(result) + '\n]\n'
+        else:
+            return '[' + separator.join(result) + ']'
 
-        ttype = exp.trial_types[trial.trial_type]
 
-        for i_step, step in enumerate(ttype.steps):
+    #----------------------------------------------------------------------------
+    def generate_one_trial_data(self, trial, exp, config_trial_numbers):
+        """
+        Generate the data row of one trial
 
-            #-- Generate the HTML text for all controls of this step (one <div> for each control)
-            controls_html = ''.join([self._one_control_html(ctl_name, trial, exp) for ctl_name in sorted(step.control_names)])
+        :param config_trial_numbers: The trial's index in exp.trials - one per repetition of this row
+        """
 
-            step_line = '{ ' if i_step == 0 else '  '
-            step_line += '{}: "{}", '.format(self._step_name(step, ttype), controls_html)
+        result = []
 
-            if exp.save_results:
+        ttype = exp.trial_types[trial.trial_type]
+        saved_values = self._trial_saved_values(trial, exp, config_trial_numbers)
 
-                save_values = {'stim_' + k: ('' if v == 'nan' else v) for k, v in trial.control_values.items()}
-                save_values.update({'val_' + k: ('' if v == 'nan' else v) for k, v in trial.save_values.items()})
+        if self.minify:
+            #-- All steps in one line; the saved values appear only once
+            entries = ['{}:{}'.format(self._short_name(self._full_step_name(step, ttype)), self._step_stimulus_js(step, trial, exp))
+                       for step in ttype.steps]
+            entries.extend('{}:{}'.format(k, _js_str(v)) for k, v in saved_values)
+            return ['{' + ','.join(entries) + '},']
 
-                save_html = ['{}: "{}", '.format(k, v) for k, v in save_values.items()]
-                step_line += ''.join(save_html)
+        for i_step, step in enumerate(ttype.steps):
 
-            step_line += 'config_trial_number: "{}", '.format(config_trial_number + 2)
+            step_line = '{ ' if i_step == 0 else '  '
+            step_line += '{}: {}, '.format(self._step_name(step, ttype), self._step_stimulus_js(step, trial, exp))
+            step_line += ''.join('{}: {}, '.format(k, _js_str(v)) for k, v in saved_values)
 
             result.append(step_line)
 
@@ -380,19 +988,88 @@ class ExpGenerator(object):
 
 
     #----------------------------------------------------------------------------
-    def saved_data_custom_cols(self, exp):
+    def _step_controls_html(self, step, trial, exp):
+        """
+        Generate the HTML text for all controls of this step (one <div> for each control)
+        """
+        return ''.join([self._one_control_html(ctl_name, trial, exp) for ctl_name in self._visual_control_names(step, exp)])
+
 
-        result = dict(config_trial_number='config_trial_number')
+    #----------------------------------------------------------------------------
+    def _step_stimulus(self, step, trial, exp):
+        """
+        The stimulus of this step: the HTML text of its controls, or - in persistent-layout mode, for steps shown by
+        the layout-step plugin - a list of [control name, text, per-trial CSS class]
+        """
+        if not (self.persistent_layout and self._layout_step(step, exp)):
+            return self._step_controls_html(step, trial, exp)
+
+        return [[ctl_name, str(self._control_value(ctl_name, trial, exp)), self._control_trial_css_class(ctl_name, trial)]
+                for ctl_name in self._visual_control_names(step, exp)]
 
-        for trial in exp.trials:
 
-            for k in trial.control_values.keys():
-                result[k] = 'stim_' + k
+    #----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _visual_control_names(self, step, exp):
+        """ The controls that this step shows (i.e., not the sounds), sorted by name """
+        return [ctl_name for ctl_name in sorted(step.control_names) if not isinstance(exp.layout[ctl_name], expobj.AudioControl)]
 
-            for k in trial.save_values.keys():
-                result[k] = 'val_' + k
 
-        return result
+    #----------------------------------------------------------------------------
+    def _step_stimulus_js(self, step, trial, exp):
+        """ The stimulus of this step (see _step_stimulus()), as a JS expression """
+        stimulus = self._step_stimulus(step, trial, exp)
+        if isinstance(stimulus, str):
+            return '"{}"'.format(stimulus)
+        return json.dumps(stimulus, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+
+
+    #----------------------------------------------------------------------------
+    def _trial_saved_values(self, trial, exp, config_trial_numbers):
+        """
+        The per-trial values that are copied to the results file (and the number of repetitions, if more than 1, the
+        images to decode before the trial starts, and the sounds of each step)
+
+        :param config_trial_numbers: The trial's index in exp.trials - one per repetition
+        :return: list of (timeline variable name, value) pairs. The config_trial_number is a list if it differs between repetitions.
+        """
+        result = []
+
+        if exp.save_results:
+            result.extend(('stim_' + k, '' if v == 'nan' else v) for k, v in trial.control_values.items())
+            result.extend(('val_' + k, '' if v == 'nan' else v) for k, v in trial.save_values.items())
+
+        if trial.block is not None:
+            result.append(('block', trial.block))
+
+        if len(set(config_trial_numbers)) == 1:
+            result.append(('config_trial_number', config_trial_numbers[0] + 2))
+        else:
+            result.append(('config_trial_number', [n + 2 for n in config_trial_numbers]))
+
+        if len(config_trial_numbers) > 1:
+            result.append(('repetitions', len(config_trial_numbers)))
+
+        ttype = exp.trial_types[trial.trial_type]
+        if self._has_images(ttype, exp):
+            result.append(('images', self._trial_images(trial, exp)))
+
+        for step in ttype.steps:
+            if self._has_audio(step, exp):
+                result.append((self._step_audio_name(step, ttype), self._step_sounds(step, trial, exp)))
+
+        return [(self._short_name(k), v) for k, v in result]
+
+
+    #----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def saved_data_custom_cols(self, exp):
+        """
+        The custom columns of the results file (determined once, while parsing)
+
+        :return: list of ResultsColumn
+        """
+        return exp.results_columns
 
 
     #----------------------------------------------------------------------------
@@ -401,30 +1078,115 @@ class ExpGenerator(object):
         Generate the HTML code (<div>) for a single control in one trial
         """
 
-        html_of_css = self._generate_css_style_html_attr(trial.css[ctl_name]) if ctl_name in trial.css else ''
+        class_names = ctl_name
+        trial_class = self._control_trial_css_class(ctl_name, trial)
+        if trial_class != '':
+            class_names += ' ' + trial_class
+
+        html = "<div class='{}'>{}</div>".format(class_names, self._control_value(ctl_name, trial, exp))
+        return html
+
+
+    #----------------------------------------------------------------------------
+    def _control_trial_css_class(self, ctl_name, trial):
+        """ The CSS class of the control's per-trial formatting ('' if none) """
+        if ctl_name in trial.css and len(trial.css[ctl_name]) > 0:
+            return self._trial_css_classes[_css_text(trial.css[ctl_name])]
+        return ''
+
+
+    #----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _control_value(self, ctl_name, trial, exp):
+        """ The text of a single control in one trial (for images: an <img> tag) """
+        if isinstance(exp.layout.get(ctl_name), expobj.ImageControl):
+            source = self._media_source(ctl_name, trial, exp)
+            return '' if source is None else "<img src='{}'>".format(html.escape(source))
 
-        ctl_value = ''
         if ctl_name in trial.control_values:
-            ctl_value = trial.control_values[ctl_name]
+            return trial.control_values[ctl_name]
         elif ctl_name in exp.layout:
             control = exp.layout[ctl_name]
             if hasattr(control, 'text') and control.text is not None:
-                ctl_value = control.text
+                return control.text
+        return ''
 
-        html = "<div class='{}'{}>{}</div>".format(ctl_name, html_of_css, ctl_value)
-        return html
+
+    #----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _media_source(self, ctl_name, trial, exp):
+        """ The URL of an image/audio control in one trial (None if there is no file) """
+        value = trial.control_values.get(ctl_name, 'nan').strip()
+        if value not in ('', 'nan'):
+            return value
+        return exp.layout[ctl_name].source
 
 
     #----------------------------------------------------------------------------
-    def _generate_css_style_html_attr(self, css_attrs):
+    # noinspection PyMethodMayBeStatic
+    def _has_images(self, ttype, exp):
+        """ Whether trials of this type show images """
+        return any(isinstance(exp.layout[ctl_name], expobj.ImageControl) for ctl_name in ttype.control_names)
 
-        if len(css_attrs) == 0:
-            return ''
 
-        result = " style='"
-        for css_attr, value in css_attrs.items():
-            result += "{}: {};".format(css_attr, _to_str(value))
-        return result + "'"
+    #----------------------------------------------------------------------------
+    def _trial_images(self, trial, exp):
+        """ The URLs of the images shown in one trial """
+        ttype = exp.trial_types[trial.trial_type]
+        result = []
+        for ctl_name in sorted(ttype.control_names):
+            if isinstance(exp.layout[ctl_name], expobj.ImageControl):
+                source = self._media_source(ctl_name, trial, exp)
+                if source is not None and source not in result:
+                    result.append(source)
+        return result
+
+
+    #----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _has_audio(self, step, exp):
+        """ Whether this step plays sounds """
+        return any(isinstance(exp.layout[ctl_name], expobj.AudioControl) for ctl_name in step.control_names)
+
+
+    #----------------------------------------------------------------------------
+    def _step_sounds(self, step, trial, exp):
+        """ The URLs of the sounds that this step plays in one trial """
+        result = []
+        for ctl_name in sorted(step.control_names):
+            if isinstance(exp.layout[ctl_name], expobj.AudioControl):
+                source = self._media_source(ctl_name, trial, exp)
+                if source is not None and source not in result:
+                    result.append(source)
+        return result
+
+
+    #----------------------------------------------------------------------------
+    def _step_audio_name(self, step, ttype):
+        """ The name of the timeline variable with the sounds of this step """
+        return self._full_step_name(step, ttype) + '_audio'
+
+
+    #----------------------------------------------------------------------------
+    def _init_trial_css_classes(self, exp):
+        """
+        Collect the distinct per-trial formatting definitions, and assign a CSS class to each of them.
+        The class name is derived from the definitions, so it doesn't depend on the order of trials. If two
+        definitions get the same name, the name of the later one (in sorted order) uses more digits of the hash.
+        """
+        css_texts = {_css_text(css_attrs) for trial in exp.trials for css_attrs in trial.css.values() if len(css_attrs) > 0}
+
+        self._trial_css_classes = {}
+        used_names = set()
+        for css_text in sorted(css_texts):
+            digest = hashlib.md5(css_text.encode('utf-8')).hexdigest()
+            n_digits = css_class_hash_length
+            class_name = 'fmt_' + digest[:n_digits]
+            while class_name in used_names:
+                n_digits += 1
+                class_name = 'fmt_' + digest[:n_digits] if n_digits <= len(digest) else 'fmt_{}_{}'.format(digest, n_digits)
+            used_names.add(class_name)
+            self._trial_css_classes[css_text] = class_name
 
 
     # ------------------------------------------------------------
@@ -439,8 +1201,140 @@ class ExpGenerator(object):
 
         #todo: probably need to create a single flow supporting all trial types (is this possible?)
         lst = [self.generate_flow_for_one_trial_type(exp, trial_type) for trial_type in exp.trial_types]
+
+        if any(self._has_images(ttype, exp) for ttype in exp.trial_types.values()):
+            lst.insert(0, _WAIT_FOR_IMAGES_CODE.replace('${images}', self._short_name('images')))
+
+        if self._uses_audio(exp):
+            lst.insert(0, _AUDIO_PLAYBACK_CODE)
+
+        if exp.uses_blocks:
+            lst.append(self.generate_blocks_flow_code(exp))
+        elif self.trial_data_url is not None:
+            lst.append(self.generate_wait_for_trial_data_code(exp))
+
         return "\n".join(lst)
 
+    # ----------------------------------------------------------------------------
+    def _uses_audio(self, exp):
+        return any(self._has_audio(step, exp) for ttype in exp.trial_types.values() for step in ttype.steps)
+
+    # ----------------------------------------------------------------------------
+    def generate_blocks_flow_code(self, exp):
+        """
+        When the trials are divided into blocks: before each block, a step materializes the block's data, and then
+        adds the block's trials to the timeline, followed by the between-blocks page and the next block's step.
+        """
+        procedures = ', '.join('{}_procedure'.format(trial_type) for trial_type in exp.trial_types)
+        prefetch = self.trial_data_url is not None
+
+        lines = [
+            'const n_blocks = {};'.format(len(self._blocks)),
+            '',
+        ]
+
+        if exp.block_break_text is not None:
+            text = exp.block_break_text.replace('\n', '<p>').replace('"', '\\"')
+            lines.extend([
+                'const block_break = {',
+                tabs(1) + 'type: jsPsychHtmlKeyboardResponse,',
+                tabs(1) + 'stimulus: "<div>{}</div>",'.format(text),
+                tabs(1) + "choices: 'ALL_KEYS',",
+                tabs(1) + 'data: {block_break: true},',
+                '}',
+                '',
+            ])
+
+        lines.extend([
+            'function start_block(block_num) {',
+            tabs(1) + 'return {',
+            tabs(2) + 'type: jsPsychCallFunction,',
+            tabs(2) + 'async: true,',
+            tabs(2) + 'func: function(done) {',
+        ])
+
+        if prefetch:
+            lines.extend([
+                tabs(3) + 'const block_data = next_block_data;',
+                tabs(3) + 'if (block_num + 1 < n_blocks) {',
+                tabs(4) + 'next_block_data = load_block_data(block_num + 1);',
+                tabs(3) + '}',
+            ])
+        else:
+            lines.append(tabs(3) + 'const block_data = load_block_data(block_num);')
+
+        preload_media = len(self.media_manifest(exp)) > 1
+
+        if preload_media:
+            lines.append(tabs(3) + 'preload_media_in_background(block_num + 1);')
+
+        lines.append(tabs(3) + 'block_data.then(function(trial_data) {')
+
+        if preload_media:
+            lines.extend([
+                tabs(4) + 'if (block_num > 0) {',
+                tabs(5) + 'jsPsych.addNodeToEndOfTimeline(media_preload_step(block_num));',
+                tabs(4) + '}',
+            ])
+
+        lines.extend([
+            tabs(4) + 'jsPsych.addNodeToEndOfTimeline({',
+            tabs(5) + 'timeline: [{}],'.format(procedures),
+            tabs(5) + 'timeline_variables: trial_data,',
+            tabs(5) + 'on_timeline_finish: function() {',
+            tabs(6) + 'trial_data.length = 0;  // release the block data',
+            tabs(5) + '},',
+            tabs(4) + '});',
+            tabs(4) + 'if (block_num + 1 < n_blocks) {',
+        ])
+
+        if exp.block_break_text is not None:
+            lines.append(tabs(5) + 'jsPsych.addNodeToEndOfTimeline(block_break);')
+
+        lines.extend([
+            tabs(5) + 'jsPsych.addNodeToEndOfTimeline(start_block(block_num + 1));',
+            tabs(4) + '}',
+            tabs(4) + 'done();',
+            tabs(3) + '}).catch(function(error) {',
+            tabs(4) + "jsPsych.endExperiment('Error: the trial data could not be loaded (' + error.message + ')');",
+            tabs(3) + '});',
+            tabs(2) + '}',
+            tabs(1) + '}',
+            '}',
+            '',
+            'timeline.push(start_block(0));',
+        ])
+
+        return "\n".join(tabs(1) + line for line in lines)
+
+    # ----------------------------------------------------------------------------
+    def generate_wait_for_trial_data_code(self, exp):
+        """
+        When the trial data is loaded from a separate file: a step that waits until the data was loaded, and then adds
+        the trials to the timeline (jsPsych determines the order of timeline variables when a node is added,
+        so the trials can't be added before the data is there).
+        """
+        procedures = ', '.join('{}_procedure'.format(trial_type) for trial_type in exp.trial_types)
+
+        lines = [
+            'const wait_for_trial_data = {',
+            tabs(1) + 'type: jsPsychCallFunction,',
+            tabs(1) + 'async: true,',
+            tabs(1) + 'func: function(done) {',
+            tabs(2) + 'trial_data_loaded.then(function() {',
+            tabs(3) + 'jsPsych.addNodeToEndOfTimeline({{timeline: [{}]}});'.format(procedures),
+            tabs(3) + 'done();',
+            tabs(2) + '}).catch(function(error) {',
+            tabs(3) + "jsPsych.endExperiment('Error: the trial data could not be loaded (' + error.message + ')');",
+            tabs(2) + '});',
+            tabs(1) + '}',
+            '}',
+            '',
+            'timeline.push(wait_for_trial_data);',
+        ]
+
+        return "\n".join(tabs(1) + line for line in lines)
+
     # ----------------------------------------------------------------------------
     def generate_flow_for_one_trial_type(self, exp, trial_type):
 
@@ -464,7 +1358,10 @@ class ExpGenerator(object):
 
         step_resposne_type = self.check_response_type(step.responses, exp)
 
-        if step_resposne_type is not None and step_resposne_type is not False:
+        layout_step = self._layout_step(step, exp)
+        if layout_step:
+            trial_type_response = "jsPsychLayoutStep"
+        elif step_resposne_type is not None and step_resposne_type is not False:
             if step_resposne_type == StepType.html_button_response:
                 trial_type_response = "jsPsychHtmlButtonResponse"
             else:
@@ -505,15 +1402,34 @@ class ExpGenerator(object):
         if step.duration is not None:
             result.append(tabs(1) + "trial_duration: {},".format(_to_str(step.duration)))
 
-        if step.delay_after is not None:
+        if layout_step and self.precise_timing:
+            #-- The delay is waited for by the plugin, so it's measured too
+            result.append(tabs(1) + "step: {},".format(step.num))
+            if step.delay_after is not None:
+                result.append(tabs(1) + "delay_after: {},".format(_to_str(step.delay_after)))
+            if step is [s for s in ttype.steps if self._layout_step(s, exp)][-1]:
+                result.append(tabs(1) + "last_step: true,")
+
+        elif step.delay_after is not None:
             result.append(tabs(1) + "post_trial_gap: {},".format(_to_str(step.delay_after)))
 
+        if self._has_audio(step, exp):
+            #-- on_load is called after the plugin has prepared the stimulus
+            result.append(tabs(1) + "on_load: function() {")
+            result.append(tabs(2) + "play_step_audio({}, jsPsych.timelineVariable('{}', true));".format(
+                step.num, self._short_name(self._step_audio_name(step, ttype))))
+            result.append(tabs(1) + "},")
+
         result.append('}')
 
         return result
 
     # ----------------------------------------------------------------------------
     def _step_name(self, step, ttype):
+        return self._short_name(self._full_step_name(step, ttype))
+
+    # noinspection PyMethodMayBeStatic
+    def _full_step_name(self, step, ttype):
         return 'trial_type_{}_step{}'.format(ttype.name, step.num)
 
     # ----------------------------------------------------------------------------
@@ -523,7 +1439,9 @@ class ExpGenerator(object):
 
         :return: StepType
         """
-        control_types = {type(exp.layout[c]) for c in step.control_names}
+        #-- Images are shown as HTML, like text, so both may appear in the same step; sounds may appear in any step
+        control_types = {expobj.TextControl if isinstance(exp.layout[c], expobj.MediaControl) else type(exp.layout[c])
+                         for c in step.control_names}
         if len(control_types) > 1:
             type_names = ", ".join([t.__name__ for t in control_types])
             self.logger.error(
@@ -633,25 +1551,32 @@ class ExpGenerator(object):
         """ Generate the code part describing the full trial flow of a given trial type """
 
         step_type_names = [self._step_name(step, ttype) for step in ttype.steps]
+        if self._has_images(ttype, exp):
+            step_type_names.insert(0, 'wait_for_images')
 
         result = [
             'const {}_procedure = '.format(ttype.name),
             '{',
-            tabs(1) + 'timeline: [{}],'.format(", ".join(step_type_names)),
-            tabs(1) + 'timeline_variables: trial_data,']
+            tabs(1) + 'timeline: [{}],'.format(", ".join(step_type_names))]
+
+        if not exp.uses_blocks:
+            #-- With blocks, the timeline variables are defined per block
+            result.append(tabs(1) + 'timeline_variables: trial_data,')
 
-        saved_data_col_names = self.saved_data_custom_cols(exp)
-        if len(saved_data_col_names) > 0:
+        saved_data_cols = self.saved_data_custom_cols(exp)
+        if len(saved_data_cols) > 0:
             result.append(tabs(1) + 'data: {')
-            for column in saved_data_col_names:
-                result.append(tabs(2) + '{}: jsPsych.timelineVariable("{}"),'.format(column, saved_data_col_names[column]))
+            for column in saved_data_cols:
+                result.append(tabs(2) + '{}: jsPsych.timelineVariable("{}"),'.format(column.name, self._short_name(column.timeline_var)))
             result.append(tabs(1) + '},')
 
-        result.extend([
-            '}',
-            '',
-            'timeline.push({}_procedure);\n'.format(ttype.name),
-        ])
+        result.append('}')
+
+        if self.trial_data_url is None and not exp.uses_blocks:
+            result.extend([
+                '',
+                'timeline.push({}_procedure);\n'.format(ttype.name),
+            ])
 
         return result
 
@@ -664,13 +1589,36 @@ class ExpGenerator(object):
 
         result = []
 
-        #-- Remove instruction trials
-        instructions_indexes = [pos for pos, instruction in enumerate(exp.instructions)]
-        if len(instructions_indexes) > 0:
-            result.append("if ({}.indexOf(trial.trial_index) != -1) {{".format(json.dumps(instructions_indexes)))
+        #-- Remove instruction trials (they are tagged in their data)
+        if len(exp.instructions) > 0:
+            result.append("if (trial.instruction) {")
+            result.append(tabs(1) + "return false;")
+            result.append("}")
+
+        #-- Remove the steps that wait for the images to be decoded
+        if any(self._has_images(ttype, exp) for ttype in exp.trial_types.values()):
+            result.append("if (trial.image_wait) {")
             result.append(tabs(1) + "return false;")
             result.append("}")
 
+        #-- Remove the pages shown between blocks
+        if exp.uses_blocks and exp.block_break_text is not None:
+            result.append("if (trial.block_break) {")
+            result.append(tabs(1) + "return false;")
+            result.append("}")
+
+        #-- The media preloading steps are saved (they have no response)
+        if len(self.media_manifest(exp)) > 0:
+            result.append("if (trial.media_preload !== undefined) {")
+            result.append(tabs(1) + "return true;")
+            result.append("}")
+
+        #-- The telemetry calibration step is saved (it has no response)
+        if self._uses_telemetry(exp):
+            result.append("if (trial.telemetry_calibration) {")
+            result.append(tabs(1) + "return true;")
+            result.append("}")
+
         #-- Remove trials without response
         if not exp.save_steps_without_responses:
             result.append("if (trial.rt == null) {")
@@ -679,7 +1627,101 @@ class ExpGenerator(object):
 
         result.append("return true;")
 
-        return '\n'.join(tabs(4) + line for line in result)
+        return '\n'.join(tabs(3) + line for line in result)
+
+
+    #------------------------------------------------------------
+    # Code to replace the ${save_results} keyword
+    #------------------------------------------------------------
+
+    def generate_save_results_code(self, exp):
+
+        if not exp.save_results:
+            return ''
+
+        parts = [_RESULTS_FILE_CODE]
+
+        if self.compact_results:
+            trial_columns = [col.name for col in exp.results_columns if col.name != expobj.ResultsColumn.config_trial_number]
+            parts.append(_COMPACT_FORMAT_CODE.replace('${trial_columns}', json.dumps(trial_columns)))
+        else:
+            parts.append(_CSV_FORMAT_CODE)
+
+        if self.persist_results:
+            parts.append(_PERSISTENT_RESULTS_CODE)
+        else:
+            parts.append("""
+        function generateCSVFile() {
+            const filename = ${results_filename};
+            if (results_file_url == null) {
+                const rows = jsPsych.data.get().filterCustom(is_saved_trial).values().map(results_row);
+                results_file_url = create_results_file(rows).then(function(file) { return URL.createObjectURL(file); });
+            }
+            results_file_url.then(function(file_url) {
+                save_file(file_url, filename);
+            });
+        }
+        """)
+
+        if exp.results_upload_url is not None:
+            parts.append(_UPLOAD_RESULTS_CODE
+                         .replace('${upload_url}', json.dumps(exp.results_upload_url))
+                         .replace('${batch_size}', str(exp.results_upload_batch_size))
+                         .replace('${interval}', str(int(exp.results_upload_interval * 1000))))
+
+        parts.append(self._generate_trial_finish_func(exp))
+
+        return '\n'.join(parts)
+
+    #------------------------------------------------------------
+    def _generate_trial_finish_func(self, exp):
+        """
+        The on_trial_finish hook: remove the large fields that are not saved (the stimulus HTML and the response) as
+        soon as the trial ends, so they don't accumulate in jsPsych's data store, and save the trial's results where
+        needed. The other ignored fields (internal_node_id, trial_type) are kept, because jsPsych uses them - they are
+        removed only when the results are saved.
+        """
+        lines = [
+            'function on_jspsych_trial_finish(trial) {',
+            tabs(1) + 'trial_payload_fields.forEach(function(field) {',
+            tabs(2) + 'delete trial[field];',
+            tabs(1) + '});',
+        ]
+
+        #-- The telemetry is measured per step: what happened during a step that isn't saved is discarded with it,
+        #-- rather than added to the next saved step
+        if self._uses_telemetry(exp):
+            lines.append(tabs(1) + 'record_trial_telemetry(trial);')
+
+        lines.append(tabs(1) + 'if (!is_saved_trial(trial)) {')
+
+        if self.drop_filtered_results:
+            #-- jsPsych's data API can't remove a trial; values() returns the data store's array itself. If it ever
+            #-- returns a copy, the trial is simply kept.
+            lines.extend([
+                tabs(2) + 'const trials = jsPsych.data.get().values();',
+                tabs(2) + 'if (trials[trials.length - 1] === trial) {',
+                tabs(3) + 'trials.pop();',
+                tabs(2) + '}',
+            ])
+
+        lines.extend([
+            tabs(2) + 'return;',
+            tabs(1) + '}',
+        ])
+
+        if self._uses_audio(exp):
+            lines.append(tabs(1) + 'record_trial_audio_timing(trial);')
+        if self.persist_results or exp.results_upload_url is not None:
+            lines.append(tabs(1) + 'const row = results_row(trial);')
+        if self.persist_results:
+            lines.append(tabs(1) + 'store_trial_results(row);')
+        if exp.results_upload_url is not None:
+            lines.append(tabs(1) + 'upload_trial_results(row);')
+
+        lines.append('}')
+
+        return '\n'.join(tabs(2) + line for line in lines)
 
 
     #------------------------------------------------------------
@@ -688,10 +1730,969 @@ class ExpGenerator(object):
 
     def generate_init_jspysch_params(self, exp):
 
-        if exp.save_results:
-            return "{on_finish: on_jspsych_finish}"
+        next_page = exp.page is not None and not exp.page.is_last
+
+        if not exp.save_results:
+            return "{on_finish: go_to_next_page}" if next_page else "{}"
+
+        on_finish = 'on_jspsych_finish'
+        if exp.results_upload_url is not None or next_page:
+            #-- The next page is opened by the participant, so it doesn't interrupt the saving of this page's results
+            on_finish = 'function() {{ {}on_jspsych_finish();{} }}'.format('flush_results_upload(); ' if exp.results_upload_url is not None else '',
+                                                                          ' show_next_page_link();' if next_page else '')
+
+        return "{{on_finish: {}, on_trial_finish: on_jspsych_trial_finish}}".format(on_finish)
+
+
+#-- A page of an experiment that was split into pages. The first page creates the session ID (unless it's in the URL),
+#-- and puts it in the URL, so reloading the page (e.g. after a crash) continues the same session. The next page
+#-- gets the same URL parameters.
+_PAGE_CODE = """
+        const page_num = ${page_num};
+        const n_pages = ${n_pages};
+        const next_page = ${next_page_url};
+        const page_url = new URL(window.location.href);
+
+        if (!page_url.searchParams.get('session')) {
+            page_url.searchParams.set('session', new Date().toISOString().replace(/[^0-9]/g, '') + '_' + Math.random().toString(36).slice(2, 10));
+            window.history.replaceState(null, '', page_url.href);
+        }
+        const page_session = page_url.searchParams.get('session');
+
+        jsPsych.data.addProperties({session: page_session, page: page_num});
+
+        function next_page_url() {
+            const url = new URL(next_page, page_url.href);
+            url.search = page_url.search;
+            return url.href;
+        }
+
+        function go_to_next_page() {
+            window.location.href = next_page_url();
+        }
+
+        function show_next_page_link() {
+            const paragraph = document.createElement('p');
+            const link = document.createElement('a');
+            link.href = next_page_url();
+            link.appendChild(document.createTextNode('Part ' + page_num + ' of ' + n_pages + ' is complete. Click here to continue to the next part.'));
+            paragraph.appendChild(link);
+            const jspsych_content = document.getElementById('jspsych-content');
+            if (jspsych_content) {
+                jspsych_content.appendChild(paragraph);
+            }
+            else {
+                document.body.prepend(paragraph);
+            }
+        }
+"""
+
+
+#-- Creating the results file. The file's content is created in a background thread (a Web Worker, whose code is
+#-- created from the functions in results_file_format), so a large results file would not block the page.
+_RESULTS_FILE_CODE = """
+        const results_ignored_fields = ['internal_node_id', 'trial_type', 'stimulus', 'response'];
+        const trial_payload_fields = ['stimulus', 'response'];   // Removed from jsPsych's data store as soon as the trial ends
+
+        function results_row(trial) {
+            const row = {};
+            Object.keys(trial).forEach(function(key) {
+                if (results_ignored_fields.indexOf(key) == -1) {
+                    row[key] = trial[key];
+                }
+            });
+            if (typeof row.rt == 'number') {
+                row.rt -= time0;
+            }
+            return row;
+        }
+
+        //-- Returns a promise of the results file (a Blob)
+        function create_results_file(rows) {
+            const functions = results_file_format.functions;
+            const create_content = functions[functions.length - 1];
+            function create_here() {
+                return new Blob([create_content(rows)], {type: results_file_format.type});
+            }
+            if (!window.Worker) {
+                return Promise.resolve(create_here());
+            }
+            return new Promise(function(resolve) {
+                const code = functions.map(function(f) { return f.toString(); }).concat([
+                    'onmessage = function(event) { postMessage(new Blob([' + create_content.name + '(event.data)], {type: "' + results_file_format.type + '"})); };']);
+                const code_url = URL.createObjectURL(new Blob([code.join(';\\n')], {type: 'text/javascript'}));
+                let worker = null;
+                function done(blob) {
+                    if (worker) {
+                        worker.terminate();
+                    }
+                    URL.revokeObjectURL(code_url);
+                    resolve(blob);
+                }
+                //-- The worker may be blocked (e.g. by a Content Security Policy), or the rows may not be cloneable
+                try {
+                    worker = new Worker(code_url);
+                    worker.onmessage = function(event) { done(event.data); };
+                    worker.onerror = function() { done(create_here()); };
+                    worker.postMessage(rows);
+                } catch (e) {
+                    done(create_here());
+                }
+            });
+        }
+
+        function save_file(file_url, filename) {
+            const link = document.createElement('a');
+            link.href = file_url;
+            link.download = filename;
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+        }
+
+        //-- The results file is created once, and then cached for re-downloading
+        let results_file_url = null;
+        """
+
+
+#-- The results file in CSV format
+_CSV_FORMAT_CODE = """
+        function csv_value(value) {
+            if (value === undefined || value === null) {
+                value = '';
+            }
+            else if (typeof value == 'object') {
+                value = JSON.stringify(value);
+            }
+            return '"' + String(value).replace(/"/g, '""') + '"';
+        }
+
+        function rows_to_csv(rows) {
+            const columns = [];
+            rows.forEach(function(row) {
+                Object.keys(row).forEach(function(key) {
+                    if (columns.indexOf(key) == -1) {
+                        columns.push(key);
+                    }
+                });
+            });
+            const lines = [columns.map(csv_value).join(',')];
+            rows.forEach(function(row) {
+                lines.push(columns.map(function(column) { return csv_value(row[column]); }).join(','));
+            });
+            return lines.join('\\r\\n') + '\\r\\n';
+        }
+
+        const results_file_format = {functions: [csv_value, rows_to_csv], type: 'text/csv'};
+        """
+
+
+#-- The results file in the compact format: a JSON container, in which the per-trial values (which are the same in
+#-- all steps of a trial) are saved once per trial, keyed by config_trial_number, and the values of string columns
+#-- with many repetitions are replaced by indexes into a per-column dictionary. See expcompiler.results.
+_COMPACT_FORMAT_CODE = """
+        function rows_to_compact_json(rows) {
+            const trial_columns = new Set(${trial_columns});
+            const column_order = [];
+            const columns = [];
+            const trials = {};
+            rows = rows.map(function(row) {
+                const trial_num = row.config_trial_number;
+                const has_trial = trial_num !== undefined && trial_num !== null;
+                if (has_trial && !(trial_num in trials)) {
+                    trials[trial_num] = {};
+                }
+                const result = {};
+                Object.keys(row).forEach(function(key) {
+                    if (column_order.indexOf(key) == -1) {
+                        column_order.push(key);
+                    }
+                    if (has_trial && trial_columns.has(key)) {
+                        trials[trial_num][key] = row[key];
+                        return;
+                    }
+                    if (columns.indexOf(key) == -1) {
+                        columns.push(key);
+                    }
+                    result[key] = row[key];
+                });
+                return result;
+            });
+
+            const dictionaries = {};
+            columns.forEach(function(column) {
+                const codes = new Map();
+                let n_values = 0;
+                const strings_only = rows.every(function(row) {
+                    const value = row[column];
+                    if (value === undefined || value === null) {
+                        return true;
+                    }
+                    n_values++;
+                    if (!codes.has(value)) {
+                        codes.set(value, codes.size);
+                    }
+                    return typeof value == 'string';
+                });
+                if (strings_only && codes.size * 2 <= n_values) {
+                    dictionaries[column] = codes;
+                }
+            });
+
+            const values = rows.map(function(row) {
+                return columns.map(function(column) {
+                    const value = row[column] === undefined ? null : row[column];
+                    return (value !== null && column in dictionaries) ? dictionaries[column].get(value) : value;
+                });
+            });
+
+            Object.keys(dictionaries).forEach(function(column) {
+                dictionaries[column] = Array.from(dictionaries[column].keys());
+            });
+
+            return JSON.stringify({format: 'expcompiler-results', version: 1, column_order: column_order, columns: columns,
+                                   dictionaries: dictionaries, rows: values, trials: trials});
+        }
+
+        const results_file_format = {functions: [rows_to_compact_json], type: 'application/json'};
+        """
+
+
+#-- Saving the results in IndexedDB: each trial is stored as soon as it ends, already filtered and aligned to time0,
+#-- so the results survive a crash of the browser. Opening the page with "?recover_results=1" downloads the results
+#-- of sessions that did not end (e.g., when the browser crashed or the page was reloaded).
+_PERSISTENT_RESULTS_CODE = """
+        const results_db_name = 'expcompiler_results';
+        const results_page = window.location.pathname;
+        const results_session = results_page + '|' + new Date().toISOString() + '|' + Math.random().toString(36).slice(2);
+        const results_in_memory = [];    // used only if IndexedDB is not available
+        const results_db = open_results_db();
+        let results_stored = Promise.resolve();
+
+        function open_results_db() {
+            return new Promise(function(resolve) {
+                if (!window.indexedDB) {
+                    resolve(null);
+                    return;
+                }
+                const request = indexedDB.open(results_db_name, 1);
+                request.onupgradeneeded = function() {
+                    request.result.createObjectStore('rows', {autoIncrement: true}).createIndex('session', 'session');
+                    request.result.createObjectStore('sessions', {keyPath: 'session'});
+                };
+                request.onsuccess = function() { resolve(request.result); };
+                request.onerror = function() { resolve(null); };
+            });
+        }
+
+        function db_request(request) {
+            return new Promise(function(resolve, reject) {
+                request.onsuccess = function() { resolve(request.result); };
+                request.onerror = function() { reject(request.error); };
+            });
+        }
+
+        function results_store(db, name) {
+            return db.transaction(name, 'readwrite').objectStore(name);
+        }
+
+        function store_trial_results(row) {
+            results_stored = results_stored.then(function() { return results_db; }).then(function(db) {
+                if (db == null) {
+                    results_in_memory.push(row);
+                    return;
+                }
+                return db_request(results_store(db, 'rows').add({session: results_session, data: row}));
+            }).catch(function(error) { console.error('Saving the trial results failed: ' + error); });
+        }
+
+        function load_session_rows(session) {
+            return results_db.then(function(db) {
+                if (db == null) {
+                    return results_in_memory;
+                }
+                return db_request(results_store(db, 'rows').index('session').getAll(session)).then(function(entries) {
+                    return entries.map(function(entry) { return entry.data; });
+                });
+            });
+        }
+
+        function set_session_status(session, filename, finished) {
+            return results_db.then(function(db) {
+                if (db != null) {
+                    return db_request(results_store(db, 'sessions').put({session: session, page: results_page, filename: filename, finished: finished}));
+                }
+            });
+        }
+
+        function generateCSVFile() {
+            const filename = ${results_filename};
+            if (results_file_url == null) {
+                results_file_url = results_stored.then(function() {
+                    return load_session_rows(results_session);
+                }).then(create_results_file).then(function(file) { return URL.createObjectURL(file); });
+            }
+            results_file_url.then(function(file_url) {
+                save_file(file_url, filename);
+                return set_session_status(results_session, filename, true);
+            });
+        }
+
+        //-- Download the results of sessions that did not end
+        function recover_results() {
+            return page_sessions().then(function(sessions) {
+                return Promise.all(sessions.filter(function(s) { return !s.finished; }).map(function(s) {
+                    return load_session_rows(s.session).then(function(rows) {
+                        if (rows.length == 0) {
+                            return;
+                        }
+                        return create_results_file(rows).then(function(file) {
+                            save_file(URL.createObjectURL(file), 'partial_' + s.filename);
+                        });
+                    }).then(function() {
+                        return set_session_status(s.session, s.filename, true);
+                    });
+                }));
+            });
+        }
+
+        //-- The results of sessions that ended were already downloaded, no need to keep them
+        function discard_finished_sessions() {
+            return page_sessions().then(function(sessions) {
+                return Promise.all(sessions.filter(function(s) { return s.finished; }).map(function(s) {
+                    return results_db.then(function(db) {
+                        return db_request(results_store(db, 'rows').index('session').getAllKeys(s.session));
+                    }).then(function(keys) {
+                        return results_db.then(function(db) {
+                            const rows = results_store(db, 'rows');
+                            keys.forEach(function(key) { rows.delete(key); });
+                            return db_request(results_store(db, 'sessions').delete(s.session));
+                        });
+                    });
+                }));
+            });
+        }
+
+        function page_sessions() {
+            return results_db.then(function(db) {
+                if (db == null) {
+                    return [];
+                }
+                return db_request(results_store(db, 'sessions').getAll()).then(function(sessions) {
+                    return sessions.filter(function(s) { return s.page == results_page; });
+                });
+            });
+        }
+
+        if (new URLSearchParams(window.location.search).get('recover_results')) {
+            recover_results().then(function() {
+                document.body.appendChild(document.createTextNode('The results of incomplete sessions were downloaded.'));
+            });
+            return;
+        }
+
+        discard_finished_sessions().then(function() {
+            return set_session_status(results_session, ${results_filename}, false);
+        });
+        """
+
+
+#-- The layout-step plugin, which shows one step of a trial.
+#-- The stimulus is either HTML text, or - in persistent-layout mode - a list of [control name, text, per-trial CSS
+#-- class]: the step shows these controls, and hides them when it ends. A control's text and class are changed only if
+#-- they differ from the control's current ones, so the browser doesn't re-parse HTML at stimulus onset.
+#-- Other plugins clear jsPsych's display element, which detaches the controls; they are re-attached when needed.
+#--
+#-- In precise-timing mode, the stimulus is shown and hidden in requestAnimationFrame() callbacks. The onset/offset is
+#-- the time of the frame after the change (the frame in which the change is painted), and the duration ends on the
+#-- frame nearest to the requested time. The delay after a step is waited for by the plugin too, so the next step's
+#-- onset is on the frame nearest to the requested time. RTs are measured from the onset to the key event's timestamp.
+#-- The requested and measured durations of the trial's steps (and the delays between them) are saved with the step
+#-- that got the response; the steps after it (or all steps, if there was no response) are saved with the trial's last
+#-- step.
+_LAYOUT_STEP_PLUGIN_CODE = """
+        const jsPsychLayoutStep = (function(jspsych) {
+
+            const layout_controls = ${layout_controls};
+            const precise_timing = ${precise_timing};
+            let layout_root = null;
+            const layout_elements = {};
+            let step_timing = {};
+            let prev_step = null;
+
+            function create_layout_elements() {
+                layout_root = document.createElement('div');
+                layout_controls.forEach(function(control) {
+                    const element = document.createElement('div');
+                    element.className = control[0];
+                    element.positioned = control[1];
+                    element.current_text = '';
+                    hide_layout_element(element);
+                    layout_root.appendChild(element);
+                    layout_elements[control[0]] = element;
+                });
+            }
+
+            function show_layout_element(element) {
+                if (element.positioned) {
+                    element.style.visibility = 'visible';
+                }
+                else {
+                    element.style.display = '';
+                }
+            }
+
+            function hide_layout_element(element) {
+                if (element.positioned) {
+                    element.style.visibility = 'hidden';
+                }
+                else {
+                    element.style.display = 'none';
+                }
+            }
+
+            //-- Prepare the stimulus, without showing it yet. Returns functions that show/hide it.
+            function prepare_stimulus(display_element, stimulus) {
+                if (typeof stimulus == 'string') {
+                    display_element.innerHTML = '<div style="visibility: hidden">' + stimulus + '</div>';
+                    const container = display_element.firstChild;
+                    return {
+                        show: function() { container.style.visibility = 'visible'; },
+                        hide: function() { container.style.visibility = 'hidden'; },
+                    };
+                }
+
+                if (layout_root == null) {
+                    create_layout_elements();
+                }
+                if (layout_root.parentNode !== display_element) {
+                    display_element.innerHTML = '';
+                    display_element.appendChild(layout_root);
+                }
+
+                const elements = stimulus.map(function(entry) {
+                    const element = layout_elements[entry[0]];
+                    const class_name = entry[2] ? entry[0] + ' ' + entry[2] : entry[0];
+                    if (element.current_text !== entry[1]) {
+                        element.innerHTML = entry[1];
+                        element.current_text = entry[1];
+                    }
+                    if (element.className !== class_name) {
+                        element.className = class_name;
+                    }
+                    return element;
+                });
+
+                return {
+                    show: function() { elements.forEach(show_layout_element); },
+                    hide: function() { elements.forEach(hide_layout_element); },
+                };
+            }
+
+            function round_ms(value) {
+                return Math.round(value * 10) / 10;
+            }
+
+            class LayoutStepPlugin {
+
+                constructor(jsPsych) {
+                    this.jsPsych = jsPsych;
+                }
+
+                trial(display_element, trial) {
+                    const stimulus = prepare_stimulus(display_element, trial.stimulus);
+                    if (precise_timing) {
+                        this.precise_trial(stimulus, trial);
+                        return;
+                    }
+
+                    stimulus.show();
+
+                    const end_trial = (info) => {
+                        this.jsPsych.pluginAPI.clearAllTimeouts();
+                        this.jsPsych.pluginAPI.cancelAllKeyboardResponses();
+                        stimulus.hide();
+                        this.jsPsych.finishTrial({rt: info ? info.rt : null, response: info ? info.key : null});
+                    };
+
+                    if (trial.choices != 'NO_KEYS') {
+                        this.jsPsych.pluginAPI.getKeyboardResponse({
+                            callback_function: end_trial,
+                            valid_responses: trial.choices,
+                            rt_method: 'performance',
+                            persist: false,
+                            allow_held_key: false,
+                        });
+                    }
+
+                    if (trial.trial_duration !== null) {
+                        this.jsPsych.pluginAPI.setTimeout(end_trial, trial.trial_duration);
+                    }
+                }
+
+                precise_trial(stimulus, trial) {
+                    if (prev_step == null || trial.step <= prev_step.step) {
+                        step_timing = {};
+                        prev_step = null;
+                    }
+
+                    const choices = Array.isArray(trial.choices) ? trial.choices.map(function(key) { return key.toLowerCase(); }) : trial.choices;
+                    let frame_duration = 1000 / 60;
+                    let prev_frame = null;
+                    let shown = false;
+                    let onset = null;
+                    let hidden = false;
+                    let offset = null;
+                    let response = null;
+
+                    function on_key(event) {
+                        const key = event.key.toLowerCase();
+                        if (onset == null || hidden || response != null || event.repeat) {
+                            return;
+                        }
+                        if (choices == 'ALL_KEYS' || (Array.isArray(choices) && choices.indexOf(key) >= 0)) {
+                            response = {key: key, rt: round_ms(event.timeStamp - onset)};
+                        }
+                    }
+
+                    const end_trial = () => {
+                        document.removeEventListener('keydown', on_key);
+
+                        const prefix = 'step' + trial.step + '_';
+                        step_timing[prefix + 'requested_duration'] = trial.trial_duration;
+                        step_timing[prefix + 'measured_duration'] = round_ms(offset - onset);
+                        step_timing[prefix + 'requested_delay_after'] = trial.delay_after;
+                        prev_step = {step: trial.step, prefix: prefix, offset: offset};
+
+                        const data = {rt: response ? response.rt : null, response: response ? response.key : null};
+                        if (response != null || trial.last_step) {
+                            Object.assign(data, step_timing);
+                            step_timing = {};
+                        }
+                        this.jsPsych.finishTrial(data);
+                    };
+
+                    //-- A change made in one frame's callback is painted in the next frame
+                    const on_frame = (time) => {
+                        if (prev_frame != null) {
+                            frame_duration = Math.min(time - prev_frame, 1000 / 30);
+                        }
+                        prev_frame = time;
+
+                        if (!shown) {
+                            stimulus.show();
+                            shown = true;
+                        }
+                        else if (onset == null) {
+                            onset = time;
+                            if (prev_step != null) {
+                                step_timing[prev_step.prefix + 'measured_delay_after'] = round_ms(onset - prev_step.offset);
+                            }
+                        }
+                        else if (!hidden) {
+                            if (response != null || (trial.trial_duration !== null && time + frame_duration * 1.5 >= onset + trial.trial_duration)) {
+                                stimulus.hide();
+                                hidden = true;
+                            }
+                        }
+                        else if (offset == null) {
+                            offset = time;
+                        }
+
+                        //-- The next step is shown in the next frame, and painted in the frame after it
+                        if (offset != null && time + frame_duration * 2.5 >= offset + trial.delay_after) {
+                            end_trial();
+                        }
+                        else {
+                            requestAnimationFrame(on_frame);
+                        }
+                    };
+
+                    if (choices != 'NO_KEYS') {
+                        document.addEventListener('keydown', on_key);
+                    }
+                    requestAnimationFrame(on_frame);
+                }
+            }
+
+            LayoutStepPlugin.info = {
+                name: 'layout-step',
+                parameters: {
+                    stimulus: {type: jspsych.ParameterType.COMPLEX, default: []},
+                    choices: {type: jspsych.ParameterType.KEYS, default: 'ALL_KEYS'},
+                    trial_duration: {type: jspsych.ParameterType.INT, default: null},
+                    step: {type: jspsych.ParameterType.INT, default: 0},
+                    delay_after: {type: jspsych.ParameterType.INT, default: 0},
+                    last_step: {type: jspsych.ParameterType.BOOL, default: false},
+                },
+            };
+
+            return LayoutStepPlugin;
+
+        })(jsPsychModule);
+        """
+
+
+#-- Telemetry. The frame intervals measured in the calibration step give the refresh rate (from their median) and the
+#-- frame jitter (their standard deviation). After the calibration, a requestAnimationFrame() loop counts the frames
+#-- that were dropped (intervals longer than one frame), except while the page is hidden. Long tasks are counted with
+#-- a PerformanceObserver, where supported (otherwise they are saved as empty). The counts are saved with each saved
+#-- trial, and cover all steps since the previous saved trial.
+_TELEMETRY_CODE = """
+        const telemetry_calibration_frames = 120;
+        const telemetry_long_tasks_supported = window.PerformanceObserver !== undefined && PerformanceObserver.supportedEntryTypes !== undefined &&
+            PerformanceObserver.supportedEntryTypes.indexOf('longtask') >= 0;
+        const telemetry = {frame_interval: null, last_frame: null, dropped_frames: 0, long_tasks: 0, long_task_duration: 0, page_hidden: false};
+
+        function telemetry_round(value) {
+            return Math.round(value * 100) / 100;
+        }
+
+        if (telemetry_long_tasks_supported) {
+            new PerformanceObserver(function(list) {
+                list.getEntries().forEach(function(entry) {
+                    telemetry.long_tasks++;
+                    telemetry.long_task_duration += entry.duration;
+                });
+            }).observe({type: 'longtask'});
+        }
+
+        document.addEventListener('visibilitychange', function() {
+            if (document.hidden) {
+                telemetry.page_hidden = true;
+            }
+            telemetry.last_frame = null;
+        });
+
+        function telemetry_frame(time) {
+            if (telemetry.last_frame != null) {
+                const dropped = Math.round((time - telemetry.last_frame) / telemetry.frame_interval) - 1;
+                if (dropped > 0) {
+                    telemetry.dropped_frames += dropped;
+                }
+            }
+            telemetry.last_frame = document.hidden ? null : time;
+            requestAnimationFrame(telemetry_frame);
+        }
+
+        function page_load_timings() {
+            const result = {dom_content_loaded: null, page_load: null, resources_load: null};
+            if (!performance.getEntriesByType) {
+                return result;
+            }
+            const navigation = performance.getEntriesByType('navigation')[0];
+            if (navigation) {
+                result.dom_content_loaded = telemetry_round(navigation.domContentLoadedEventEnd);
+                result.page_load = navigation.loadEventEnd > 0 ? telemetry_round(navigation.loadEventEnd) : null;
+            }
+            const resources = performance.getEntriesByType('resource');
+            if (resources.length > 0) {
+                result.resources_load = telemetry_round(Math.max.apply(null, resources.map(function(entry) { return entry.responseEnd; })));
+            }
+            return result;
+        }
+
+        const telemetry_calibration = {
+            type: jsPsychCallFunction,
+            async: true,
+            func: function(done) {
+                const frames = [];
+                function on_frame(time) {
+                    frames.push(time);
+                    if (frames.length < telemetry_calibration_frames) {
+                        requestAnimationFrame(on_frame);
+                        return;
+                    }
+                    const intervals = frames.slice(1).map(function(t, i) { return t - frames[i]; });
+                    const sorted = intervals.slice().sort(function(a, b) { return a - b; });
+                    const median = sorted[Math.floor(sorted.length / 2)];
+                    const mean = intervals.reduce(function(a, b) { return a + b; }, 0) / intervals.length;
+                    const variance = intervals.reduce(function(a, b) { return a + (b - mean) * (b - mean); }, 0) / intervals.length;
+
+                    telemetry.frame_interval = median;
+                    telemetry.dropped_frames = 0;
+                    requestAnimationFrame(telemetry_frame);
+
+                    done(Object.assign({
+                        refresh_rate: telemetry_round(1000 / median),
+                        frame_jitter: telemetry_round(Math.sqrt(variance)),
+                    }, page_load_timings()));
+                }
+                requestAnimationFrame(on_frame);
+            },
+            data: {telemetry_calibration: true},
+            on_finish: function(data) {
+                Object.assign(data, data.value);
+                delete data.value;
+            },
+        };
+
+        timeline.push(telemetry_calibration);
+
+        function record_trial_telemetry(trial) {
+            trial.dropped_frames = telemetry.frame_interval == null ? null : telemetry.dropped_frames;
+            trial.long_tasks = telemetry_long_tasks_supported ? telemetry.long_tasks : null;
+            trial.long_task_duration = telemetry_long_tasks_supported ? telemetry_round(telemetry.long_task_duration) : null;
+            trial.page_hidden = telemetry.page_hidden;
+            telemetry.dropped_frames = 0;
+            telemetry.long_tasks = 0;
+            telemetry.long_task_duration = 0;
+            telemetry.page_hidden = false;
+        }
+        """
+
+
+#-- Waiting for a trial's images to be decoded, before the trial starts (so the onset of an image doesn't depend on
+#-- network or decoding speed). The images were already loaded by the preloading steps. The decoded images are kept in
+#-- a cache (the least recently used ones are removed from it); the image elements are kept, so the browser keeps
+#-- their decoded data.
+_WAIT_FOR_IMAGES_CODE = """
+    const image_cache_size = 64;
+    const image_cache = new Map();
+
+    function decoded_image(url) {
+        let image = image_cache.get(url);
+        if (image) {
+            image_cache.delete(url);
+        }
+        else {
+            const img = new Image();
+            img.src = url;
+            image = img.decode().then(function() { return img; }, function() {
+                console.warn('The image ' + url + ' could not be decoded');
+                return img;
+            });
+        }
+        image_cache.set(url, image);
+        while (image_cache.size > image_cache_size) {
+            image_cache.delete(image_cache.keys().next().value);
+        }
+        return image;
+    }
+
+    const wait_for_images = {
+        type: jsPsychCallFunction,
+        async: true,
+        func: function(done) {
+            Promise.all(jsPsych.timelineVariable('${images}', true).map(decoded_image)).then(function() { done(); });
+        },
+        data: {image_wait: true},
+    }
+"""
+
+
+#-- Playing the sounds of a step. jsPsych's preloading decodes each sound file once into an AudioBuffer (kept by
+#-- jsPsych), so playing a sound doesn't wait for the network or for decoding. The sound is scheduled on the audio
+#-- clock to start when the step's stimulus appears on the screen: the stimulus is painted in the frame following
+#-- the step's first animation frame. The audio clock is mapped to the page's clock with getOutputTimestamp(), which
+#-- accounts for the output latency. The measured latency (the sound's output time minus the stimulus onset) is saved
+#-- with the next saved trial.
+_AUDIO_PLAYBACK_CODE = """
+    let audio_frame_interval = 1000 / 60;
+    let audio_timing = {};
+
+    function audio_round(value) {
+        return Math.round(value * 10) / 10;
+    }
+
+    //-- The page time (performance.now()) corresponding with an audio context time
+    function audio_output_time(context, context_time) {
+        if (context.getOutputTimestamp) {
+            const timestamp = context.getOutputTimestamp();
+            if (timestamp.performanceTime > 0) {
+                return timestamp.performanceTime + (context_time - timestamp.contextTime) * 1000;
+            }
+        }
+        const latency = context.outputLatency || context.baseLatency || 0;
+        return performance.now() + (context_time - context.currentTime + latency) * 1000;
+    }
+
+    function play_step_audio(step_num, urls) {
+        const context = jsPsych.pluginAPI.audioContext();
+        if (context != null && context.state == 'suspended') {
+            context.resume();
+        }
+
+        Promise.all(urls.map(function(url) { return jsPsych.pluginAPI.getAudioBuffer(url); })).then(function(buffers) {
+            requestAnimationFrame(function(frame_time) {
+                const onset = frame_time + audio_frame_interval;
+                let output_time = null;
+
+                buffers.forEach(function(buffer) {
+                    if (context != null && buffer instanceof AudioBuffer) {
+                        const source = context.createBufferSource();
+                        source.buffer = buffer;
+                        source.connect(context.destination);
+                        const when = Math.max(context.currentTime, context.currentTime + (onset - audio_output_time(context, context.currentTime)) / 1000);
+                        source.start(when);
+                        output_time = audio_output_time(context, when);
+                    }
+                    else {
+                        //-- No Web Audio: an <audio> element, whose latency can't be measured
+                        buffer.currentTime = 0;
+                        buffer.play();
+                    }
+                });
+
+                requestAnimationFrame(function(onset_time) {
+                    audio_frame_interval = Math.min(onset_time - frame_time, 1000 / 30);
+                    audio_timing['step' + step_num + '_audio_latency'] = output_time == null ? null : audio_round(output_time - onset_time);
+                });
+            });
+        }).catch(function(error) {
+            console.warn('A sound could not be played: ' + error);
+        });
+    }
+
+    function record_trial_audio_timing(trial) {
+        Object.assign(trial, audio_timing);
+        audio_timing = {};
+    }
+"""
+
+
+#-- Uploading the results to a server, in batches of trials. A batch is sent when it has enough trials, or some time
+#-- after its first trial. Failed uploads are retried with exponential backoff. When the page is closed, whatever was
+#-- not uploaded yet is sent with navigator.sendBeacon(). The server may get the same batch twice (e.g. when a retry
+#-- and the beacon both arrive), so each batch is identified by its session and batch number.
+_UPLOAD_RESULTS_CODE = """
+        const upload_url = ${upload_url};
+        const upload_batch_size = ${batch_size};
+        const upload_interval = ${interval};
+        const upload_max_attempts = 6;
+        const upload_session = new Date().toISOString().replace(/[^0-9]/g, '') + '_' + Math.random().toString(36).slice(2, 10);
+        const upload_pending = {};    // batches not uploaded yet. key = batch number, value = request body
+        let upload_rows = [];
+        let upload_batch_num = 0;
+        let upload_timer = null;
+
+        function upload_trial_results(row) {
+            upload_rows.push(row);
+            if (upload_rows.length >= upload_batch_size) {
+                flush_results_upload();
+            }
+            else if (upload_timer == null) {
+                upload_timer = setTimeout(flush_results_upload, upload_interval);
+            }
+        }
+
+        function flush_results_upload() {
+            const batch_num = close_upload_batch();
+            if (batch_num != null) {
+                send_results_batch(batch_num, 0);
+            }
+        }
+
+        function close_upload_batch() {
+            clearTimeout(upload_timer);
+            upload_timer = null;
+            if (upload_rows.length == 0) {
+                return null;
+            }
+            const batch_num = upload_batch_num++;
+            upload_pending[batch_num] = JSON.stringify({session: upload_session, batch: batch_num, rows: upload_rows});
+            upload_rows = [];
+            return batch_num;
+        }
+
+        //-- The "text/plain" content type avoids a CORS preflight request
+        function send_results_batch(batch_num, attempt) {
+            if (!(batch_num in upload_pending)) {
+                return;
+            }
+            fetch(upload_url, {method: 'POST', body: upload_pending[batch_num], headers: {'Content-Type': 'text/plain'}, keepalive: true})
+                .then(function(response) {
+                    if (!response.ok) {
+                        throw new Error('HTTP status ' + response.status);
+                    }
+                    delete upload_pending[batch_num];
+                })
+                .catch(function(error) {
+                    if (attempt + 1 >= upload_max_attempts) {
+                        console.error('Uploading the results failed: ' + error);
+                        return;
+                    }
+                    const delay = Math.min(30000, 1000 * Math.pow(2, attempt)) * (0.5 + Math.random());
+                    setTimeout(function() { send_results_batch(batch_num, attempt + 1); }, delay);
+                });
+        }
+
+        window.addEventListener('pagehide', function() {
+            close_upload_batch();
+            Object.keys(upload_pending).forEach(function(batch_num) {
+                if (navigator.sendBeacon(upload_url, new Blob([upload_pending[batch_num]], {type: 'text/plain'}))) {
+                    delete upload_pending[batch_num];
+                }
+            });
+        });
+        """
+
+
+_media_extensions = {
+    'images': expobj.ImageControl.extensions,
+    'audio': expobj.AudioControl.extensions,
+    'video': ('mp4', 'webm', 'ogv', 'mov'),
+}
+
+_media_file_pattern = re.compile(r'^[^\s<>"\'()]+\.({})$'.format('|'.join(e for exts in _media_extensions.values() for e in exts)), re.IGNORECASE)
+_media_attr_pattern = re.compile(r'(?:src|poster)\s*=\s*["\']([^"\']+)["\']|url\(\s*["\']?([^"\')]+?)["\']?\s*\)', re.IGNORECASE)
+
+
+#-----------------------------------------------------------------------------
+def _media_references(values):
+    """
+    The URLs of the media files referred to in the given values - either the whole value is a media file name,
+    or it's an HTML/CSS text that refers to media files
+
+    :return: list of URLs, in the order of their first appearance
+    """
+    result = []
+    for value in values:
+        if not isinstance(value, str):
+            continue
+
+        if _media_file_pattern.match(value.strip()):
+            urls = [value.strip()]
         else:
-            return "{}"
+            urls = [m.group(1) or m.group(2) for m in _media_attr_pattern.finditer(value)]
+
+        for url in urls:
+            if _media_file_pattern.match(url) and url not in result:
+                result.append(url)
+
+    return result
+
+
+#-----------------------------------------------------------------------------
+def _media_kind(url):
+    extension = url.rsplit('.', 1)[-1].lower()
+    return [kind for kind, extensions in _media_extensions.items() if extension in extensions][0]
+
+
+def _js_str(value):
+    """ A value in the trial data, as a JS string (or array of strings) """
+    if isinstance(value, list):
+        return '[' + ', '.join('"{}"'.format(v) for v in value) + ']'
+    else:
+        return '"{}"'.format(value)
+
+
+def _trial_content_hash(trial):
+    """ A hash of everything that defines a trial (two trials with the same hash are identical) """
+    content = (trial.trial_type, trial.block, sorted(trial.control_values.items()), sorted((k, str(v)) for k, v in trial.save_values.items()),
+               sorted((ctl, sorted((k, str(v)) for k, v in css.items())) for ctl, css in trial.css.items()))
+    return hashlib.sha1(repr(content).encode('utf-8')).hexdigest()
+
+
+def _css_text(css_attrs):
+    return ' '.join('{}: {};'.format(css_attr, _to_str(css_attrs[css_attr])) for css_attr in sorted(css_attrs))
+
+
+@functools.lru_cache(maxsize=None)
+def _read_template(filename):
+    """ The template is read once per process (a long-running compiler reuses it) """
+    with open(filename, 'r') as fp:
+        return fp.read()
 
 
 def _format_value_to_js(value):
@@ -703,3 +2704,27 @@ def _format_value_to_js(value):
 
 def tabs(n):
     return '    ' * n
+
+
+def _to_base36(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    result = ''
+    while True:
+        n, d = divmod(n, 36)
+        result = digits[d] + result
+        if n == 0:
+            return result
+
+
+def minify_script(script):
+    """
+    Remove non-essential whitespace and comments from a generated script.
+
+    The script is processed line by line (line breaks are kept, because the generated code relies on them
+    in places where a semicolon is missing): indentation and empty lines are removed, as are lines
+    that contain only a comment. This is not a token-level minifier - whitespace within lines and comments
+    at the end of a line are kept, and no code is rewritten. Most of the size reduction in minify mode comes from
+    the short internal names and the one-line trials (see _init_short_names()).
+    """
+    lines = [line.strip() for line in script.split('\n')]
+    return '\n'.join(line for line in lines if line != '' and not line.startswith('//'))
@@ -1,12 +1,11 @@
-
-
-
 class Logger(object):
 
     def __init__(self):
         self.err_codes = {}
+        self.messages = []      # All messages, in order: list of (error code, message)
 
 
     def error(self, msg, err_code):
         print(msg)
         self.err_codes[err_code] = msg
+        self.messages.append((err_code, msg))
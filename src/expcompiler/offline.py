@@ -0,0 +1,167 @@
+"""
+Running an experiment offline: a service worker that caches all the files of the experiment, so repeated loads
+(e.g. in a lab kiosk) are served from the browser's cache, and a session survives a network drop.
+
+The cache name includes a hash of the cached files' content, so when any of the files changes (e.g., the
+experiment is recompiled), the service worker changes too, and the stale caches are deleted.
+"""
+
+import hashlib
+import json
+import os
+
+import expcompiler.generator
+
+
+#-----------------------------------------------------------------------------
+def service_worker_filename(target_fn):
+    """
+    The name of the service-worker file. It's in the same directory as the HTML file, so its scope covers the
+    experiment's files.
+    """
+    return os.path.splitext(target_fn)[0] + '.sw.js'
+
+
+#-----------------------------------------------------------------------------
+def cache_manifest_filename(target_fn):
+    return os.path.splitext(target_fn)[0] + '.cache-manifest.json'
+
+
+#-----------------------------------------------------------------------------
+def experiment_urls(exp, generator, target_fn, data_files):
+    """
+    The URLs of all the files that the experiment's page loads: the HTML, the trial data, jsPsych's scripts and CSS,
+    the start-of-session beep, and the preloaded media files.
+
+    :param data_files: The trial data files' URLs
+    """
+    urls = [os.path.basename(target_fn)]
+    urls.extend(data_files)
+    urls.extend(generator.script_urls(exp))
+    urls.append(generator.css_url())
+    if exp.start_of_session_beep:
+        urls.append(expcompiler.generator.start_of_session_beep_file)
+    for stage in generator.media_manifest(exp):
+        urls.extend(stage['images'] + stage['audio'] + stage['video'])
+
+    result = []
+    for url in urls:
+        if url not in result:
+            result.append(url)
+    return result
+
+
+#-----------------------------------------------------------------------------
+def _is_remote(url):
+    return '://' in url or url.startswith('//')
+
+
+#-----------------------------------------------------------------------------
+def cache_manifest(base_dir, urls, logger=None):
+    """
+    The list of files to cache, with their content hashes. The hash of a remote file (e.g., jsPsych from unpkg) is
+    the hash of its URL, which includes the version number.
+
+    :param base_dir: The directory of the HTML file (relative URLs are relative to it)
+    :return: dict with "version" (a hash of all files) and "files" (dict: URL -> content hash)
+    """
+    files = {}
+    for url in urls:
+        fn = None if _is_remote(url) else os.path.join(base_dir, url.split('?')[0].split('#')[0])
+        if fn is not None and os.path.isfile(fn):
+            with open(fn, 'rb') as fp:
+                files[url] = hashlib.sha256(fp.read()).hexdigest()[:16]
+        else:
+            if fn is not None and logger is not None:
+                logger.error('Warning: the file "{}" was not found. It will be cached by the service worker, but its changes will not be detected'.format(url),
+                             'OFFLINE_FILE_NOT_FOUND')
+            files[url] = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+
+    version = hashlib.sha256(''.join('{}:{}\n'.format(url, files[url]) for url in sorted(files)).encode('utf-8')).hexdigest()[:16]
+
+    return dict(version=version, files=files)
+
+
+#-----------------------------------------------------------------------------
+def service_worker_code(cache_prefix, manifest):
+    """
+    The service worker: on installation, cache all the files in the manifest (in a cache whose name depends on the
+    manifest's version); serve them from the cache; and delete older versions of the cache.
+    """
+    return _service_worker_template \
+        .replace('${cache_prefix}', json.dumps(cache_prefix)) \
+        .replace('${version}', json.dumps(manifest['version'])) \
+        .replace('${files}', json.dumps(sorted(manifest['files']), indent=4))
+
+
+#-----------------------------------------------------------------------------
+def write_offline_files(exp, generator, target_fn, data_files, logger=None):
+    """
+    Write the service worker and the cache manifest. Call this after all other files of the experiment were written.
+
+    :return: list of the written file names
+    """
+    urls = experiment_urls(exp, generator, target_fn, data_files)
+    manifest = cache_manifest(os.path.dirname(target_fn), urls, logger)
+    cache_prefix = 'expcompiler-{}-'.format(os.path.splitext(os.path.basename(target_fn))[0])
+
+    manifest_fn = cache_manifest_filename(target_fn)
+    with open(manifest_fn, 'w', encoding='utf-8') as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+
+    sw_fn = service_worker_filename(target_fn)
+    with open(sw_fn, 'w', encoding='utf-8') as fp:
+        fp.write(service_worker_code(cache_prefix, manifest))
+
+    return [sw_fn, manifest_fn]
+
+
+_service_worker_template = """//-- Generated by expcompiler: caches the experiment's files, so it can run offline
+
+const cache_prefix = ${cache_prefix};
+const cache_name = cache_prefix + ${version};
+const cached_files = ${files};
+
+//-- Files that could not be loaded are not cached (they will be loaded from the network when needed)
+self.addEventListener('install', function(event) {
+    event.waitUntil(caches.open(cache_name).then(function(cache) {
+        return Promise.all(cached_files.map(function(url) {
+            return fetch(new Request(url, {cache: 'reload'})).then(function(response) {
+                if (!response.ok) {
+                    throw new Error('HTTP status ' + response.status);
+                }
+                return cache.put(url, response);
+            }).catch(function(error) {
+                console.warn('The file ' + url + ' could not be cached: ' + error);
+            });
+        }));
+    }).then(function() {
+        return self.skipWaiting();
+    }));
+});
+
+//-- Delete the caches of older versions of this experiment
+self.addEventListener('activate', function(event) {
+    event.waitUntil(caches.keys().then(function(names) {
+        return Promise.all(names.filter(function(name) {
+            return name.startsWith(cache_prefix) && name != cache_name;
+        }).map(function(name) {
+            return caches.delete(name);
+        }));
+    }).then(function() {
+        return self.clients.claim();
+    }));
+});
+
+//-- The URL parameters (e.g. subject ID) don't affect the cached files
+self.addEventListener('fetch', function(event) {
+    if (event.request.method != 'GET') {
+        return;
+    }
+    event.respondWith(caches.open(cache_name).then(function(cache) {
+        return cache.match(event.request, {ignoreSearch: true}).then(function(cached) {
+            return cached || fetch(event.request);
+        });
+    }));
+});
+"""
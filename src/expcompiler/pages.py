@@ -0,0 +1,91 @@
+"""
+Splitting a long experiment into several pages. Each page is a separate HTML file with its own slice of the trials,
+so it loads faster, and if the browser crashes, only the current page has to be run again.
+
+The first page starts the session; each page, when it ends, continues to the next one. The session ID and the URL
+parameters are passed from page to page in the URL, and each page saves its own results file, with the session ID
+and the page number in each row (see expcompiler.results.merge_page_results()).
+"""
+
+import copy
+import os
+
+import expcompiler.experiment
+
+
+#-- The value of the "pages" option for splitting the experiment into one page per block
+by_blocks = 'blocks'
+
+
+#-----------------------------------------------------------------------------
+def page_filename(target_fn, page_num):
+    """
+    The name of a page's HTML file: the first page is the target file itself, so the experiment's URL doesn't change;
+    the others are <target>.page<N>.html
+    """
+    if page_num == 1:
+        return target_fn
+    base, ext = os.path.splitext(target_fn)
+    return '{}.page{}{}'.format(base, page_num, ext)
+
+
+#-----------------------------------------------------------------------------
+def split_trials(exp, pages, logger):
+    """
+    Divide the trials into pages
+
+    :param pages: The number of pages (the trials are divided evenly between them), or by_blocks
+    :return: list of lists of Trial; None if the experiment can't be split this way
+    """
+    if pages == by_blocks:
+        if not exp.uses_blocks:
+            logger.error('Error: the experiment cannot be split into one page per block, because its trials are not divided into blocks',
+                         'PAGES_WITHOUT_BLOCKS')
+            return None
+        return [trials for block_name, trials in exp.blocks]
+
+    if not isinstance(pages, int) or pages < 1:
+        logger.error('Error: invalid number of pages ({}). Specify a positive number, or "{}"'.format(pages, by_blocks), 'INVALID_PAGES')
+        return None
+
+    if pages > len(exp.trials):
+        logger.error('Error: the experiment cannot be split into {} pages, because it has only {} trials'.format(pages, len(exp.trials)),
+                     'TOO_MANY_PAGES')
+        return None
+
+    bounds = [len(exp.trials) * i // pages for i in range(pages + 1)]
+    return [exp.trials[bounds[i]:bounds[i + 1]] for i in range(pages)]
+
+
+#-----------------------------------------------------------------------------
+def split_experiment(exp, pages, target_fn, logger):
+    """
+    Split the experiment into pages. The instructions and the start-of-session beep are only in the first page.
+
+    :param pages: The number of pages, or by_blocks
+    :param target_fn: The name of the first page's HTML file
+    :return: list of (Experiment, HTML file name) - one per page; None if the experiment can't be split this way
+    """
+    page_trials = split_trials(exp, pages, logger)
+    if page_trials is None:
+        return None
+
+    n_pages = len(page_trials)
+    result = []
+    first_trial_number = 0
+
+    for i, trials in enumerate(page_trials):
+        page_num = i + 1
+        next_page_url = os.path.basename(page_filename(target_fn, page_num + 1)) if page_num < n_pages else None
+
+        page_exp = copy.copy(exp)
+        page_exp.trials = trials
+        page_exp.page = expcompiler.experiment.Page(page_num, n_pages, first_trial_number, next_page_url)
+        if page_num > 1:
+            page_exp.instructions = []
+            page_exp.start_of_session_beep = False
+
+        result.append((page_exp, page_filename(target_fn, page_num)))
+        first_trial_number += len(trials)
+
+    return result
@@ -2,13 +2,14 @@
 Parse an excel file with the experiment definitions (stage 1 of the compilation)
 """
 
-import webcolors
 import re
 from numbers import Number
 import math
-import cssutils
+import functools
 
-import expcompiler
+import expcompiler.experiment
+import expcompiler.logger
+from expcompiler.utils import to_str as _to_str
 
 
 _css_prefix = 'format:'
@@ -27,7 +28,11 @@ class Parser(object):
     #-----------------------------------------------------------------------------
     def __init__(self, filename, reader=None, logger=None):
         self.logger = logger or expcompiler.logger.Logger()
-        self.reader = reader or expcompiler.xlsreader.XlsReader(filename, logger=self.logger)
+        if reader is None:
+            #-- The workbook reader loads pandas and openpyxl, so it's imported only when a workbook is read
+            from expcompiler import xlsreader
+            reader = xlsreader.XlsReader(filename, logger=self.logger)
+        self.reader = reader
         self.errors_found = False
         self.warnings_found = False
         self._parsing_config = None
@@ -102,7 +107,17 @@ class Parser(object):
                                                 background_color=background_color,
                                                 full_screen=self._get_bool_param(df, 'full_screen', False),
                                                 start_of_session_beep=start_of_session_beep,
-                                                title=self._get_param(df, 'title', as_str=True) or '')
+                                                title=self._get_param(df, 'title', as_str=True) or '',
+                                                block_break_text=self._get_param(df, 'block_break_text', as_str=True),
+                                                results_upload_url=self._get_param(df, 'results_upload_url', as_str=True),
+                                                results_upload_batch_size=self._get_positive_number_param(df, 'results_upload_batch_size', 20, False),
+                                                results_upload_interval=self._get_positive_number_param(df, 'results_upload_interval', 10, True))
+
+        if exp.results_upload_url is not None and not exp.save_results:
+            self.logger.error('Warning in worksheet "{}": the parameter "results_upload_url" was ignored, because "save_results" is not set'.
+                              format(expcompiler.xlsreader.XlsReader.ws_general), 'UPLOAD_WITHOUT_SAVE_RESULTS')
+            self.warnings_found = True
+
         return exp
 
 
@@ -131,6 +146,31 @@ class Parser(object):
         return result
 
 
+    #-----------------------------------------------------------------------------
+    def _get_positive_number_param(self, df, param_name, default_value, non_int_allowed):
+        val = self._get_param(df, param_name)
+        if val is None or val == '':
+            return default_value
+
+        try:
+            fval = float(val)
+        except ValueError:
+            fval = None
+
+        #-- An empty cell may be read as NaN
+        if fval is not None and math.isnan(fval):
+            return default_value
+
+        if fval is None or not math.isfinite(fval) or fval <= 0 or (not non_int_allowed and int(fval) != fval):
+            self.logger.error('Error in worksheet "{}": the parameter "{}" is invalid ({}) - expecting a positive {} number'.
+                              format(expcompiler.xlsreader.XlsReader.ws_general, param_name, val, 'float' if non_int_allowed else 'integer'),
+                              'INVALID_PARAM_VALUE')
+            self.errors_found = True
+            return default_value
+
+        return int(fval) if int(fval) == fval else fval
+
+
     #-----------------------------------------------------------------------------
     def _get_bool_param(self, df, param_name, default_value):
         val = self._get_param(df, param_name)
@@ -250,8 +290,16 @@ class Parser(object):
             control = self._parse_text_control(control_name, row, xls_line_num, existing_cols_to_letter_mapping,
                                                expcompiler.xlsreader.XlsReader.ws_layout)
 
+        elif control_type == 'image':
+            control = self._parse_image_control(control_name, row, xls_line_num, existing_cols_to_letter_mapping,
+                                                expcompiler.xlsreader.XlsReader.ws_layout)
+
+        elif control_type == 'audio':
+            control = self._parse_audio_control(control_name, row, xls_line_num, existing_cols_to_letter_mapping,
+                                                expcompiler.xlsreader.XlsReader.ws_layout)
+
         else:
-            self.logger.error('Error in worksheet "{}", cell {}{}: type="{}" is unknown, only "text" is supported'.
+            self.logger.error('Error in worksheet "{}", cell {}{}: type="{}" is unknown, only "text", "image", and "audio" are supported'.
                               format(expcompiler.xlsreader.XlsReader.ws_layout, existing_cols_to_letter_mapping['type'], xls_line_num, row.type),
                               'INVALID_CONTROL_TYPE')
             self.errors_found = True
@@ -291,6 +339,12 @@ class Parser(object):
             elif col_name.lower() == 'text':
                 text = str(row.text) if 'text' in row and not _isempty(row.text, also_empty_str=False) else ""
 
+            elif col_name.lower() == 'source':
+                if not _isempty(row[col_name]):
+                    self.logger.error('Warning in worksheet "{}", cell {}{}: the "{}" column is used only for images and sounds; it was ignored for the text item "{}".'.
+                                      format(ws_name, existing_cols_to_letter_mapping[col_name], xls_line_num, col_name, control_name), 'SOURCE_OF_TEXT_CONTROL')
+                    self.warnings_found = True
+
             elif xls_line_num == 2:  # this error is issued only once per column
                 self.logger.error('Warning in worksheet "{}", column {}: the column name "{}" is invalid and was ignored.'.
                                   format(expcompiler.xlsreader.XlsReader.ws_layout, existing_cols_to_letter_mapping[col_name], col_name), 'EXCESSIVE_COLUMN')
@@ -299,6 +353,90 @@ class Parser(object):
         return expcompiler.experiment.TextControl(control_name, text, frame, css)
 
 
+    #-----------------------------------------------------------------------------
+    def _parse_image_control(self, control_name, row, xls_line_num, existing_cols_to_letter_mapping, ws_name):
+
+        source = None
+
+        frame, frame_cols = self._parse_frame(row, xls_line_num, existing_cols_to_letter_mapping, ws_name)
+        css, css_cols = self.parse_css(row, xls_line_num, existing_cols_to_letter_mapping)
+
+        for col_name in row.index:
+            if col_name.lower() in ('layout_name', 'type', 'explanation') + frame_cols + css_cols:
+                pass
+
+            elif col_name.lower() == 'source':
+                if not _isempty(row[col_name]):
+                    source = str(row[col_name]).strip()
+                    self._validate_media_source(expcompiler.experiment.ImageControl, source, ws_name,
+                                                existing_cols_to_letter_mapping[col_name], xls_line_num)
+
+            elif col_name.lower() == 'text':
+                if not _isempty(row[col_name]):
+                    self.logger.error('Warning in worksheet "{}", cell {}{}: the "{}" column is not used for images; it was ignored for the image "{}".'.
+                                      format(ws_name, existing_cols_to_letter_mapping[col_name], xls_line_num, col_name, control_name), 'TEXT_OF_IMAGE_CONTROL')
+                    self.warnings_found = True
+
+            elif xls_line_num == 2:  # this error is issued only once per column
+                self.logger.error('Warning in worksheet "{}", column {}: the column name "{}" is invalid and was ignored.'.
+                                  format(ws_name, existing_cols_to_letter_mapping[col_name], col_name), 'EXCESSIVE_COLUMN')
+                self.warnings_found = True
+
+        if frame.width is None and frame.height is None:
+            self.logger.error('Warning in worksheet "{}", line {}: the width and height of the image "{}" were not specified. '.format(ws_name, xls_line_num, control_name) +
+                              'Each image will be shown in its natural size (up to the screen width).', 'IMAGE_SIZE_NOT_SPECIFIED')
+            self.warnings_found = True
+
+        return expcompiler.experiment.ImageControl(control_name, source, frame, css)
+
+
+    #-----------------------------------------------------------------------------
+    def _parse_audio_control(self, control_name, row, xls_line_num, existing_cols_to_letter_mapping, ws_name):
+
+        source = None
+
+        for col_name in row.index:
+            if col_name.lower() in ('layout_name', 'type', 'explanation'):
+                pass
+
+            elif col_name.lower() == 'source':
+                if not _isempty(row[col_name]):
+                    source = str(row[col_name]).strip()
+                    self._validate_media_source(expcompiler.experiment.AudioControl, source, ws_name,
+                                                existing_cols_to_letter_mapping[col_name], xls_line_num)
+
+            elif col_name.lower() in ('text', 'left', 'top', 'width', 'height', 'border-color') or col_name.lower().startswith(_css_prefix):
+                #-- A sound is not shown, so its text, position and format are irrelevant
+                if not _isempty(row[col_name]):
+                    self.logger.error('Warning in worksheet "{}", cell {}{}: the "{}" column is not used for sounds; it was ignored for the sound "{}".'.
+                                      format(ws_name, existing_cols_to_letter_mapping[col_name], xls_line_num, col_name, control_name), 'VISUAL_PROPERTY_OF_AUDIO_CONTROL')
+                    self.warnings_found = True
+
+            elif xls_line_num == 2:  # this error is issued only once per column
+                self.logger.error('Warning in worksheet "{}", column {}: the column name "{}" is invalid and was ignored.'.
+                                  format(ws_name, existing_cols_to_letter_mapping[col_name], col_name), 'EXCESSIVE_COLUMN')
+                self.warnings_found = True
+
+        return expcompiler.experiment.AudioControl(control_name, source)
+
+
+    #-----------------------------------------------------------------------------
+    def _validate_media_source(self, control_type, source, ws_name, xls_col, xls_line_num):
+        """
+        Validate the file name of an image or a sound
+
+        :param control_type: ImageControl or AudioControl
+        """
+        if control_type.is_valid_source(source):
+            return
+
+        kind = 'image' if control_type == expcompiler.experiment.ImageControl else 'audio'
+        self.logger.error('Error in worksheet "{}", cell {}{}: "{}" is not a valid {} file name. The supported {} types are: {}'
+                          .format(ws_name, xls_col, xls_line_num, source, kind, kind, ', '.join(control_type.extensions)),
+                          'INVALID_{}_SOURCE'.format(kind.upper()))
+        self.errors_found = True
+
+
     #-----------------------------------------------------------------------------
     def _parse_frame(self, row, xls_line_num, existing_cols_to_letter_mapping, ws_name):
 
@@ -880,11 +1018,15 @@ class Parser(object):
             return
 
         data_col_names, save_col_names, formatting_cols = self._check_trials_col_names(col_names, exp)
+        exp.results_columns = self._results_columns(data_col_names, save_col_names, 'block' in col_names)
 
         for i, row in df.iterrows():
             trial = self._parse_trial(exp, row, i+2, data_col_names, save_col_names, formatting_cols, col_names)
             if trial is not None:
                 exp.trials.append(trial)
+
+        if 'block' in col_names:
+            self._validate_blocks(exp)
                 
     #-----------------------------------------------------------------------------
     def _check_trials_col_names(self, col_names, exp):
@@ -895,7 +1037,7 @@ class Parser(object):
 
         for col in col_names:
 
-            if col == 'type':
+            if col in ('type', 'block', 'repetitions'):
                 continue
 
             if col.lower().startswith('save:'):
@@ -948,6 +1090,33 @@ class Parser(object):
         return data_col_names, save_col_names, formatting_cols
 
 
+    #-----------------------------------------------------------------------------
+    # noinspection PyMethodMayBeStatic
+    def _results_columns(self, data_col_names, save_col_names, with_block):
+        """
+        Get the custom columns of the results file. They are determined by the columns of the trials worksheet.
+        If a column name appears twice, the later definition is used (but the column keeps its first position).
+        """
+        columns = [expcompiler.experiment.ResultsColumn(expcompiler.experiment.ResultsColumn.config_trial_number,
+                                                        expcompiler.experiment.ResultsColumn.config_trial_number)]
+        if with_block:
+            columns.append(expcompiler.experiment.ResultsColumn(expcompiler.experiment.ResultsColumn.block,
+                                                                expcompiler.experiment.ResultsColumn.block))
+        columns += [expcompiler.experiment.ResultsColumn(col, 'stim_' + col) for col in data_col_names]
+        columns += [expcompiler.experiment.ResultsColumn(col[5:], 'val_' + col[5:]) for col in save_col_names]
+
+        result = []
+        positions = {}
+        for col in columns:
+            if col.name in positions:
+                result[positions[col.name]] = col
+            else:
+                positions[col.name] = len(result)
+                result.append(col)
+
+        return result
+
+
     #-----------------------------------------------------------------------------
     def _parse_trial(self, exp, row, xls_line_num, data_col_names, save_col_names, formatting_cols, all_col_names):
 
@@ -972,10 +1141,21 @@ class Parser(object):
         trial = expcompiler.experiment.Trial(type_name)
         ttype = exp.trial_types[type_name]
 
+        if 'block' in all_col_names:
+            trial.block = self._parse_trial_block(exp, row, xls_line_num, all_col_names)
+
+        if 'repetitions' in all_col_names and not _isempty(row['repetitions']):
+            repetitions = self._check_positive_number(row['repetitions'], 'repetitions', all_col_names, expcompiler.xlsreader.XlsReader.ws_trials,
+                                                      xls_line_num, default_value=1, zero_allowed=False, non_int_allowed=False)
+            trial.repetitions = repetitions if isinstance(repetitions, int) and repetitions > 0 else 1
+
         #-- Columns indicating the main data of each control (e.g. the text)
         for col in data_col_names:
             value = row[col]
             trial.control_values[col] = str(value)
+            if isinstance(exp.layout[col], expcompiler.experiment.MediaControl) and not _isempty(value):
+                self._validate_media_source(type(exp.layout[col]), str(value).strip(), expcompiler.xlsreader.XlsReader.ws_trials,
+                                            all_col_names[col], xls_line_num)
 
         #-- Columns indicating values to save as-is
         for col in save_col_names:
@@ -1003,6 +1183,38 @@ class Parser(object):
         return trial
 
 
+    #-----------------------------------------------------------------------------
+    def _parse_trial_block(self, exp, row, xls_line_num, all_col_names):
+
+        block = row['block']
+        if not _isempty(block):
+            return _to_str(block)
+
+        if len(exp.trials) == 0:
+            self.logger.error('Error in worksheet "{}", cell {}{}: The block was not specified.'
+                              .format(expcompiler.xlsreader.XlsReader.ws_trials, all_col_names['block'], xls_line_num), 'TRIALS_NO_BLOCK')
+            self.errors_found = True
+            return ''
+
+        self.logger.error('Warning in worksheet "{}", cell {}{}: The block was not specified. Assuming this trial belongs to the block of the previous trial.'
+                          .format(expcompiler.xlsreader.XlsReader.ws_trials, all_col_names['block'], xls_line_num), 'TRIALS_NO_BLOCK')
+        self.warnings_found = True
+        return exp.trials[-1].block
+
+
+    #-----------------------------------------------------------------------------
+    def _validate_blocks(self, exp):
+        """
+        The trials of each block must appear in consecutive lines
+        """
+        block_names = [name for name, trials in exp.blocks]
+        split_blocks = sorted({name for name in block_names if block_names.count(name) > 1})
+        if len(split_blocks) > 0:
+            self.logger.error('Error in worksheet "{}": The trials of each block must appear in consecutive lines, but some blocks were split ({}).'
+                              .format(expcompiler.xlsreader.XlsReader.ws_trials, ", ".join(split_blocks)), 'TRIALS_BLOCK_NOT_CONSECUTIVE')
+            self.errors_found = True
+
+
     #=========================================================================================
     # Helper funcs
     #=========================================================================================
@@ -1012,19 +1224,8 @@ class Parser(object):
         if color is None:
             color = ""
 
-        #-- Check whether it's a valid color name
-        try:
-            webcolors.name_to_hex(color)
-            return
-        except ValueError:
-            pass
-
-        #-- Check whether it's a valid HEX color
-        try:
-            webcolors.hex_to_rgb(color)
+        if _is_valid_color(color):
             return
-        except ValueError:
-            pass
 
         self.logger.error('WARNING in worksheet "{}", in {}: the color "{}" seems invalid and may fail. '.format(ws_name, cell_name, color) +
                           'For an explanation about valid color speficication (as color name or color code), see http://htmlcolorcodes.com', 'INVALID_COLOR')
@@ -1093,14 +1294,7 @@ class Parser(object):
     #-----------------------------------------------------------------------------
     def _validate_css_attr_value(self, css_attr, value, ws_name, xls_col, xls_line_num, col_name):
 
-        try:
-            css_property = cssutils.css.Property(css_attr, value)
-            css_property._log.enabled = False
-            valid_css_attr = css_property.validate()
-        except:
-            valid_css_attr = False
-
-        if not valid_css_attr:
+        if not _is_valid_css(css_attr, value):
             error_message = "For more information about using this CSS attribute, see http://developer.mozilla.org/en-US/docs/Web/CSS/"+css_attr
             self.logger.error('Error in worksheet "{}", cell {}{} (column "{}"): The value "{}" is invalid, '.
                               format(ws_name, xls_col, xls_line_num, col_name, value) + error_message,
@@ -1111,6 +1305,43 @@ class Parser(object):
     valid_position = 'expecting an x/y coordinate (i.e., a number with either "%" or "px" after it)'
 
 
+#-----------------------------------------------------------------------------
+# The validation results are cached: the same formatting/colors usually appear in many cells, and a process that
+# compiles many experiments (the batch compiler, the compile daemon) validates them only once.
+# webcolors and cssutils are imported on first use (cssutils takes a long time to import).
+#-----------------------------------------------------------------------------
+@functools.lru_cache(maxsize=4096)
+def _is_valid_color(color):
+    import webcolors
+
+    #-- Check whether it's a valid color name
+    try:
+        webcolors.name_to_hex(color)
+        return True
+    except ValueError:
+        pass
+
+    #-- Check whether it's a valid HEX color
+    try:
+        webcolors.hex_to_rgb(color)
+        return True
+    except ValueError:
+        pass
+
+    return False
+
+
+@functools.lru_cache(maxsize=4096)
+def _is_valid_css(css_attr, value):
+    import cssutils
+    try:
+        css_property = cssutils.css.Property(css_attr, value)
+        css_property._log.enabled = False
+        return css_property.validate()
+    except:
+        return False
+
+
 #-----------------------------------------------------------------------------
 def _isempty(value, also_empty_str=True):
     # noinspection PyTypeChecker
@@ -1123,18 +1354,6 @@ def _nan_to_none(value):
 
 
 #-----------------------------------------------------------------------------
-def _to_str(value):
-    """Convert to string; make sure that integers are printed as such (even if their type is float)"""
-    if isinstance(value, expcompiler.experiment.UrlParameter):
-        return value.js_var_name
-
-    try:
-        value = int(value)
-    except ValueError:
-        pass
-    return str(value)
-
-
 #-----------------------------------------------------------------------------
 def xls_col_letter(n):
     """
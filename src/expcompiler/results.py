@@ -0,0 +1,99 @@
+"""
+Loading the results files saved by the experiment
+"""
+
+import json
+import os
+
+import pandas as pd
+
+
+compact_format_name = 'expcompiler-results'
+
+
+#-----------------------------------------------------------------------------
+def load_compact_results(filename):
+    """
+    Load a results file saved in the compact format (see the compact_results option of the generator), and expand
+    it into a data frame with the same columns as the CSV results file.
+
+    Dictionary-encoded columns are loaded as categorical columns.
+
+    :return: pd.DataFrame
+    """
+    with open(filename, 'r', encoding='utf-8') as fp:
+        container = json.load(fp)
+
+    return expand_compact_results(container)
+
+
+#-----------------------------------------------------------------------------
+def expand_compact_results(container):
+    """
+    Convert the (already parsed) compact results container into a data frame
+    """
+    if container.get('format') != compact_format_name or container.get('version') != 1:
+        raise ValueError('Invalid results file: unsupported format ({} version {})'.format(container.get('format'), container.get('version')))
+
+    columns = container['columns']
+    dictionaries = container['dictionaries']
+    rows = container['rows']
+
+    data = {}
+    for i, col in enumerate(columns):
+        values = [row[i] for row in rows]
+        if col in dictionaries:
+            data[col] = pd.Categorical.from_codes([-1 if v is None else v for v in values], categories=dictionaries[col])
+        else:
+            data[col] = values
+
+    df = pd.DataFrame(data, columns=columns)
+
+    #-- Per-trial values: copy them into the rows of each trial
+    trials = pd.DataFrame.from_dict(container['trials'], orient='index')
+    if trials.shape[0] > 0:
+        trial_nums = df['config_trial_number'].astype(object).map(lambda v: None if v is None or v != v else str(v))
+        for col in trials.columns:
+            trial_values = trial_nums.map(trials[col])
+            if col in df.columns:
+                #-- Rows that are not part of a trial have their own value
+                df[col] = df[col].astype(object).where(df[col].notna(), trial_values)
+            else:
+                df[col] = trial_values
+
+    return df[container['column_order']]
+
+
+#-----------------------------------------------------------------------------
+def load_results(filename):
+    """
+    Load a results file: CSV, or the compact format (a .json file)
+
+    :return: pd.DataFrame
+    """
+    if os.path.splitext(filename)[1].lower() == '.json':
+        return load_compact_results(filename)
+    else:
+        return pd.read_csv(filename)
+
+
+#-----------------------------------------------------------------------------
+def merge_page_results(filenames):
+    """
+    Merge the results files saved by the pages of an experiment that was split into pages (see expcompiler.pages)
+    into one data frame. The rows are ordered by session and page; within each page, they keep their order.
+
+    :param filenames: The pages' results files (of one or several sessions), in any order
+    :return: pd.DataFrame
+    """
+    frames = [load_results(fn) for fn in filenames]
+    for df in frames:
+        if 'session' not in df.columns or 'page' not in df.columns:
+            raise ValueError('Invalid results file: it was not saved by a page of a multi-page experiment (there is no "session" or "page" column)')
+
+    #-- Categorical columns (of compact results files) are converted, as their categories differ between files
+    frames = [df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)}) for df in frames]
+
+    result = pd.concat(frames, ignore_index=True, sort=False)
+    result['page'] = pd.to_numeric(result['page'])
+    return result.sort_values(['session', 'page'], kind='mergesort').reset_index(drop=True)
@@ -12,6 +12,9 @@ ${layout_css}
 
   <script>
 
+    //-- The imported scripts are deferred, so the experiment can run only after the page was loaded
+    window.addEventListener('DOMContentLoaded', function() {
+
         //---------------------
         //-- URL parameters  --
         //---------------------
@@ -25,22 +28,14 @@ ${url_parameters}
         //-- Allows aligning all RTs to a fixed offset
         let time0 = 0;
 
-        // Code for saving results in case this is needed
-
-        function generateCSVFile() {
-            var data = jsPsych.data.get();
-            data = data.filterCustom(function(trial) {
+        //-- Whether a trial should be saved in the results file
+        function is_saved_trial(trial) {
 ${filter_trials_func};
-            });
-            results_filename = ${results_filename};
-            data.response_raw = data.response
+        }
 
-            for (var trial_index = 0; trial_index < data.trials.length; trial_index++) {
-                data.trials[trial_index].rt -= time0;
-            }
+        // Code for saving results in case this is needed
 
-            data.ignore('internal_node_id').ignore('trial_type').ignore('stimulus').ignore('response').localSave('csv', results_filename);
-        }
+${save_results}
 
         function on_jspsych_finish() {
             generateCSVFile();
@@ -63,6 +58,10 @@ ${filter_trials_func};
 
         let jsPsych = initJsPsych(${init_jspsych_params});
 
+${layout_plugin}
+
+${page}
+
 
         //--------------------------------
         //-- Create experiment timeline --
@@ -76,6 +75,8 @@ ${instructions}
 
 ${play_start_of_session_beep}
 
+${telemetry}
+
 ${trials}
 
 
@@ -88,5 +89,7 @@ ${trial_flow}
 
         jsPsych.run(timeline);
 
+    });
+
   </script>
 </html>
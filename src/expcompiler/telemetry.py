@@ -0,0 +1,94 @@
+"""
+Summarizing the telemetry saved in the results files (see the telemetry option of the generator), and flagging the
+sessions whose timing is unreliable
+"""
+
+import pandas as pd
+
+
+#-- The default criteria for reliable timing
+min_refresh_rate = 50               # Hz
+max_frame_jitter = 2                # ms (standard deviation of the frame intervals)
+max_dropped_frames_ratio = 0.05     # Ratio of trials with dropped frames
+max_long_tasks_ratio = 0.05         # Ratio of trials with long tasks
+max_duration_error = 1              # Mean absolute error of the step durations (with precise timing), in frames
+
+
+#-----------------------------------------------------------------------------
+def _is_true(values):
+    return values.astype(str).str.lower() == 'true'
+
+
+#-----------------------------------------------------------------------------
+def summarize_session(df):
+    """
+    Summarize the telemetry of one session
+
+    :param df: The session's results
+    :return: dict
+    """
+    calibration = df[_is_true(df['telemetry_calibration'])] if 'telemetry_calibration' in df.columns else df.iloc[0:0]
+    trials = df.drop(calibration.index)
+    if 'media_preload' in trials.columns:
+        trials = trials[trials['media_preload'].isna()]
+
+    result = dict(trials=trials.shape[0])
+
+    for col in ('refresh_rate', 'frame_jitter', 'dom_content_loaded', 'page_load', 'resources_load'):
+        result[col] = calibration[col].iloc[0] if calibration.shape[0] > 0 and col in calibration.columns else None
+
+    def ratio(mask):
+        return float(mask.sum()) / trials.shape[0] if trials.shape[0] > 0 else 0.0
+
+    result['dropped_frames_ratio'] = ratio(trials['dropped_frames'].fillna(0) > 0) if 'dropped_frames' in trials.columns else None
+    result['long_tasks_ratio'] = ratio(trials['long_tasks'].fillna(0) > 0) \
+        if 'long_tasks' in trials.columns and trials['long_tasks'].notna().any() else None
+    result['hidden_trials'] = int(_is_true(trials['page_hidden']).sum()) if 'page_hidden' in trials.columns else 0
+
+    #-- With precise timing: the mean absolute difference between the requested and measured step durations
+    errors = []
+    for col in trials.columns:
+        if col.endswith('_requested_duration'):
+            measured_col = col[:-len('_requested_duration')] + '_measured_duration'
+            if measured_col in trials.columns:
+                both = trials[[col, measured_col]].apply(pd.to_numeric, errors='coerce').dropna()
+                errors.extend((both[measured_col] - both[col]).abs())
+    result['duration_error'] = sum(errors) / len(errors) if len(errors) > 0 else None
+
+    result['problems'] = timing_problems(result)
+
+    return result
+
+
+#-----------------------------------------------------------------------------
+def timing_problems(summary):
+    """
+    The reasons for which a session's timing is unreliable
+
+    :param summary: The session's summary (see summarize_session())
+    :return: list of str (empty if the timing is reliable)
+    """
+    problems = []
+
+    if summary['refresh_rate'] is None:
+        problems.append('no telemetry calibration')
+    else:
+        if summary['refresh_rate'] < min_refresh_rate:
+            problems.append('refresh rate is {:.1f} Hz'.format(summary['refresh_rate']))
+        if summary['frame_jitter'] > max_frame_jitter:
+            problems.append('frame jitter is {:.1f} ms'.format(summary['frame_jitter']))
+
+    if summary['dropped_frames_ratio'] is not None and summary['dropped_frames_ratio'] > max_dropped_frames_ratio:
+        problems.append('frames were dropped in {:.0%} of the trials'.format(summary['dropped_frames_ratio']))
+
+    if summary['long_tasks_ratio'] is not None and summary['long_tasks_ratio'] > max_long_tasks_ratio:
+        problems.append('long tasks ran in {:.0%} of the trials'.format(summary['long_tasks_ratio']))
+
+    if summary['hidden_trials'] > 0:
+        problems.append('the page was hidden in {} trials'.format(summary['hidden_trials']))
+
+    if summary['duration_error'] is not None and summary['refresh_rate'] is not None and \
+            summary['duration_error'] > max_duration_error * 1000 / summary['refresh_rate']:
+        problems.append('step durations are off by {:.1f} ms on average'.format(summary['duration_error']))
+
+    return problems
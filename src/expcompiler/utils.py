@@ -0,0 +1,19 @@
+"""
+Small helpers shared by the compilation stages. This module must stay light: it's imported by the parser and the
+generator, which don't load the workbook-reading libraries.
+"""
+
+import expcompiler.experiment
+
+
+#-----------------------------------------------------------------------------
+def to_str(value):
+    """Convert to string; make sure that integers are printed as such (even if their type is float)"""
+    if isinstance(value, expcompiler.experiment.UrlParameter):
+        return value.js_var_name
+
+    try:
+        value = int(value)
+    except ValueError:
+        pass
+    return str(value)
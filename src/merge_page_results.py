@@ -0,0 +1,24 @@
+#!/opt/rh/rh-python38/root/usr/bin/python
+"""
+Merge the results files saved by the pages of an experiment that was split into pages (see the --pages option of
+compiler.py) into one CSV file
+
+Usage: merge_page_results.py <output-csv-file> <results-file> [<results-file> ...]
+"""
+
+import sys
+import os
+import expcompiler.results
+
+if len(sys.argv) < 3:
+    print("Usage: {} <output-csv-file> <results-file> [<results-file> ...]".format(os.path.basename(sys.argv[0])))
+    sys.exit(1)
+
+try:
+    df = expcompiler.results.merge_page_results(sys.argv[2:])
+except ValueError as e:
+    print(str(e))
+    sys.exit(2)
+
+df.to_csv(sys.argv[1], index=False)
+print('{} rows ({} sessions) were saved in {}'.format(df.shape[0], df['session'].nunique(), sys.argv[1]))
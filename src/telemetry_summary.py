@@ -0,0 +1,29 @@
+#!/opt/rh/rh-python38/root/usr/bin/python
+"""
+Summarize the telemetry in results files, and flag the sessions whose timing is unreliable
+
+Usage: telemetry_summary.py <results-file> [<results-file> ...]
+"""
+
+import sys
+import os
+import expcompiler.results
+import expcompiler.telemetry
+
+if len(sys.argv) < 2:
+    print("Usage: {} <results-file> [<results-file> ...]".format(os.path.basename(sys.argv[0])))
+    sys.exit(1)
+
+n_unreliable = 0
+
+for filename in sys.argv[1:]:
+    summary = expcompiler.telemetry.summarize_session(expcompiler.results.load_results(filename))
+    refresh_rate = '?' if summary['refresh_rate'] is None else '{:.1f}'.format(summary['refresh_rate'])
+    if len(summary['problems']) == 0:
+        print('{}: OK ({} trials, {} Hz)'.format(filename, summary['trials'], refresh_rate))
+    else:
+        n_unreliable += 1
+        print('{}: UNRELIABLE ({} trials, {} Hz): {}'.format(filename, summary['trials'], refresh_rate, '; '.join(summary['problems'])))
+
+print('{} of {} sessions have unreliable timing'.format(n_unreliable, len(sys.argv) - 1))
+sys.exit(53 if n_unreliable > 0 else 0)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import openpyxl
+
+from expcompiler.batch import find_workbooks, target_filename, compile_batch, batch_return_code
+
+
+#-----------------------------------------------------------------------------
+def write_workbook(filename, trials):
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    sheets = dict(general=[('param', 'value'), ('save_results', 'Y')],
+                  instructions=[('text', 'responses'), ('Hello', 'left')],
+                  layout=[('layout_name', 'type', 'text'), ('target', 'text', None)],
+                  trial_type=[('layout items', 'duration', 'responses'), ('target', None, 'left')],
+                  response=[('response_name', 'type', 'value', 'key'), ('left', 'key', 1, 'a')],
+                  trials=[('target',)] + [(t,) for t in trials])
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(row)
+    wb.save(filename)
+
+
+#=============================================================================================
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_find_workbooks(self):
+        for name in ('b.xlsx', 'a.xlsx', '~$a.xlsx', 'c.txt'):
+            open(os.path.join(self.dir, name), 'w').close()
+        expected = [os.path.join(self.dir, 'a.xlsx'), os.path.join(self.dir, 'b.xlsx')]
+        self.assertEqual(expected, find_workbooks([self.dir]))
+        self.assertEqual(expected, find_workbooks([os.path.join(self.dir, '*.xlsx'), self.dir]))
+
+    def test_target_filename(self):
+        self.assertEqual(os.path.join('src', 'exp.html'), target_filename(os.path.join('src', 'exp.xlsx')))
+        self.assertEqual(os.path.join('out', 'exp.html'), target_filename(os.path.join('src', 'exp.xlsx'), 'out'))
+
+    def test_batch_return_code(self):
+        self.assertEqual(0, batch_return_code([dict(rc=0), dict(rc=0)]))
+        self.assertEqual(53, batch_return_code([dict(rc=0), dict(rc=53)]))
+        self.assertEqual(2, batch_return_code([dict(rc=53), dict(rc=2)]))
+        self.assertEqual(2, batch_return_code([dict(rc=1)]))
+
+    def test_same_target_for_two_workbooks(self):
+        src_fns = [os.path.join(self.dir, 'a', 'exp.xlsx'), os.path.join(self.dir, 'b', 'exp.xlsx')]
+        with self.assertRaisesRegex(ValueError, 'exp.html'):
+            compile_batch(src_fns, '1', {}, target_dir=os.path.join(self.dir, 'out'))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'out')))
+
+    def test_compile_batch(self):
+        write_workbook(os.path.join(self.dir, 'exp1.xlsx'), ['a', 'b'])
+        write_workbook(os.path.join(self.dir, 'exp2.xlsx'), ['c'])
+        with open(os.path.join(self.dir, 'bad.xlsx'), 'w') as fp:
+            fp.write('not a workbook')
+
+        out_dir = os.path.join(self.dir, 'out')
+        results = compile_batch(find_workbooks([self.dir]), '1', {}, target_dir=out_dir, n_workers=2)
+
+        self.assertEqual(['bad.xlsx', 'exp1.xlsx', 'exp2.xlsx'], [os.path.basename(r['source']) for r in results])
+        self.assertNotIn(results[0]['rc'], (0, 53))
+        self.assertEqual([0, 0], [r['rc'] for r in results[1:]])
+        self.assertTrue(os.path.exists(os.path.join(out_dir, 'exp1.html')))
+        self.assertTrue(os.path.exists(os.path.join(out_dir, 'exp2.html')))
+        self.assertTrue(all(r['seconds'] >= 0 for r in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+import expcompiler.compile
+import expcompiler.generator
+import expcompiler.parser
+from expcompiler.bundle import bundle_assets, experiment_assets, hashed_filename
+from expcompiler.logger import Logger
+from generator_tests import parse_exp, generate
+from batch_tests import write_workbook
+
+
+#=============================================================================================
+class BundleTests(unittest.TestCase):
+
+    def setUp(self):
+        self.src_dir = tempfile.TemporaryDirectory()
+        self.target_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.src_dir.name, 'jspsych-7.1'))
+        self.write('jspsych-7.1/jspsych.js', 'js')
+        self.write('start-session-beep.mp3', 'beep')
+
+    def tearDown(self):
+        self.src_dir.cleanup()
+        self.target_dir.cleanup()
+
+    def write(self, fn, content):
+        with open(os.path.join(self.src_dir.name, fn), 'w') as fp:
+            fp.write(content)
+
+    def test_hashed_filename(self):
+        self.assertRegex(hashed_filename('jspsych-7.1/jspsych.js', b'js'), r'^assets/jspsych\.[0-9a-f]{12}\.js$')
+        self.assertNotEqual(hashed_filename('jspsych.js', b'a'), hashed_filename('jspsych.js', b'b'))
+
+    def test_bundle_assets(self):
+        assets = bundle_assets(['jspsych-7.1/jspsych.js', 'start-session-beep.mp3'], self.src_dir.name, self.target_dir.name, Logger())
+        self.assertEqual(2, len(assets))
+        self.assertEqual(2, assets['jspsych-7.1/jspsych.js']['size'])
+        self.assertTrue(os.path.isfile(os.path.join(self.target_dir.name, assets['start-session-beep.mp3']['file'])))
+
+    def test_missing_asset(self):
+        logger = Logger()
+        self.assertIsNone(bundle_assets(['jspsych-7.1/plugin-preload.js'], self.src_dir.name, self.target_dir.name, logger))
+        self.assertIn('BUNDLE_FILE_NOT_FOUND', logger.err_codes)
+
+    def test_references_rewritten(self):
+        exp = parse_exp([{'f1': 'a'}], general=[dict(param='start_of_session_beep', value='Y')])
+        generator, script = generate(exp)
+        self.assertIn('start-session-beep.mp3', experiment_assets(exp, generator))
+        generator.asset_urls = {'jspsych-7.1/jspsych.js': 'assets/jspsych.1.js', 'start-session-beep.mp3': 'assets/beep.2.mp3'}
+        script = generator.generate(exp)
+        self.assertIn('<script src="assets/jspsych.1.js" defer></script>', script)
+        self.assertIn('stimulus: ["assets/beep.2.mp3"],', script)
+
+
+    def test_bundle_with_pages(self):
+        src_fn = os.path.join(self.target_dir.name, 'exp.xlsx')
+        target_fn = os.path.join(self.target_dir.name, 'exp.html')
+        write_workbook(src_fn, ['a', 'b'])
+
+        exp = expcompiler.parser.Parser(src_fn, logger=Logger()).parse()
+        for url in experiment_assets(exp, expcompiler.generator.ExpGenerator(Logger())):
+            os.makedirs(os.path.dirname(os.path.join(self.src_dir.name, url)), exist_ok=True)
+            self.write(url, url)
+
+        logger = Logger()
+        rc = expcompiler.compile.compile_exp(src_fn, target_fn, '1', logger=logger, bundle_from=self.src_dir.name, pages=2)
+        self.assertEqual(0, rc, 'error codes: ' + ','.join(logger.err_codes.keys()))
+        for fn in (target_fn, os.path.join(self.target_dir.name, 'exp.page2.html')):
+            with open(fn) as fp:
+                self.assertRegex(fp.read(), r'<script src="assets/jspsych\.[0-9a-f]{12}\.js" defer></script>')
+
+
+if __name__ == '__main__':
+    unittest.main()
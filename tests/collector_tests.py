@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from expcompiler.collector import ResultsCollector, load_session_rows
+
+
+#-----------------------------------------------------------------------------
+def batch(session, batch_num, rows):
+    return json.dumps(dict(session=session, batch=batch_num, rows=rows)).encode('utf-8')
+
+
+#=============================================================================================
+class CollectorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.collector = ResultsCollector(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_batches_appended_to_session_file(self):
+        self.assertEqual(200, self.collector.store_batch(batch('s1', 1, [dict(rt=3)]))[0])
+        self.assertEqual(200, self.collector.store_batch(batch('s1', 0, [dict(rt=1), dict(rt=2)]))[0])
+        self.assertEqual(200, self.collector.store_batch(batch('s2', 0, [dict(rt=4)]))[0])
+        self.assertEqual([1, 2, 3], [r['rt'] for r in load_session_rows(self.collector.session_filename('s1'))])
+        self.assertEqual([4], [r['rt'] for r in load_session_rows(self.collector.session_filename('s2'))])
+
+    def test_duplicate_batch_ignored(self):
+        self.collector.store_batch(batch('s1', 0, [dict(rt=1)]))
+        self.collector.store_batch(batch('s1', 0, [dict(rt=1)]))
+        self.assertEqual(1, len(load_session_rows(self.collector.session_filename('s1'))))
+
+    def test_duplicate_batch_ignored_after_restart(self):
+        self.collector.store_batch(batch('s1', 0, [dict(rt=1)]))
+        ResultsCollector(self.tmp_dir.name).store_batch(batch('s1', 0, [dict(rt=1)]))
+        self.assertEqual(1, len(load_session_rows(self.collector.session_filename('s1'))))
+
+    def test_invalid_session_name(self):
+        self.assertEqual(400, self.collector.store_batch(batch('../s1', 0, []))[0])
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+    def test_invalid_json(self):
+        self.assertEqual(400, self.collector.store_batch(b'{"session": ')[0])
+
+    def test_http_request(self):
+        loop = asyncio.new_event_loop()
+        server = self.collector.start(loop, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def post():
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            body = batch('s1', 0, [dict(rt=1)])
+            writer.write('POST / HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(len(body)).encode('latin-1') + body)
+            response = await reader.read()
+            writer.close()
+            return response
+
+        response = loop.run_until_complete(post())
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'Access-Control-Allow-Origin: *', response)
+        self.assertEqual(1, len(load_session_rows(self.collector.session_filename('s1'))))
+
+    def test_load_test_smoke(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = self.collector.start(loop, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'collector_load_test.py')
+
+        async def run_load_test():
+            process = await asyncio.create_subprocess_exec(sys.executable, script, '127.0.0.1', str(port), '5', '3', '4',
+                                                           stdout=subprocess.DEVNULL)
+            return await process.wait()
+
+        rc = loop.run_until_complete(run_load_test())
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+        asyncio.set_event_loop(None)
+
+        self.assertEqual(0, rc)
+        self.assertEqual(5 * 3, self.collector.n_batches)
+        session_files = os.listdir(self.tmp_dir.name)
+        self.assertEqual(5, len(session_files))
+        for fn in session_files:
+            rows = load_session_rows(os.path.join(self.tmp_dir.name, fn))
+            self.assertEqual(list(range(3 * 4)), sorted(r['trial_index'] for r in rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
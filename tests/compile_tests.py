@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import expcompiler.compile
+from expcompiler.compile import compile_exp, compression_summary, write_precompressed
+from batch_tests import write_workbook
+
+
+#=============================================================================================
+class PrecompressedTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'exp.html')
+        with open(self.filename, 'w') as fp:
+            fp.write('<html>' + 'hello ' * 1000 + '</html>')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_compressed_files_decompress_to_original(self):
+        with open(self.filename, 'rb') as fp:
+            data = fp.read()
+
+        result = write_precompressed(self.filename)
+
+        compressors = expcompiler.compile._compressors()
+        self.assertEqual([self.filename + suffix for suffix, compress_func, decompress_func in compressors], [fn for fn, size in result])
+        for (suffix, compress_func, decompress_func), (compressed_fn, size) in zip(compressors, result):
+            with open(compressed_fn, 'rb') as fp:
+                self.assertEqual(data, decompress_func(fp.read()))
+            self.assertEqual(os.path.getsize(compressed_fn), size)
+            self.assertLess(size, len(data))
+
+    def test_unchanged_file_not_rewritten(self):
+        write_precompressed(self.filename)
+        for compressed_fn, size in write_precompressed(self.filename):
+            os.utime(compressed_fn, (1000000000, 1000000000))
+
+        result = write_precompressed(self.filename)
+        self.assertEqual([1000000000] * len(result), [os.path.getmtime(fn) for fn, size in result])
+
+    def test_changed_file_rewritten(self):
+        result = write_precompressed(self.filename)
+        for compressed_fn, size in result:
+            os.utime(compressed_fn, (1000000000, 1000000000))
+        with open(self.filename, 'w') as fp:
+            fp.write('<html>bye</html>')
+
+        result = write_precompressed(self.filename)
+        self.assertTrue(all(os.path.getmtime(fn) > 1000000000 for fn, size in result))
+
+    def test_compile_returns_sizes(self):
+        src_fn = os.path.join(self.dir, 'exp.xlsx')
+        write_workbook(src_fn, ['a', 'b'])
+        compressed_files = []
+
+        rc = compile_exp(src_fn, self.filename, '1', compress=True, compressed_files=compressed_files)
+
+        self.assertEqual(0, rc)
+        self.assertEqual([(self.filename, os.path.getsize(self.filename))], [(fn, size) for fn, size, compressed in compressed_files])
+        lines = compression_summary(compressed_files)
+        self.assertEqual('exp.html: {:,} bytes'.format(os.path.getsize(self.filename)), lines[0])
+        self.assertTrue(lines[1].startswith('exp.html.gz: '))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from batch_tests import write_workbook
+from expcompiler.daemon import CompileDaemon, send_job
+
+
+#=============================================================================================
+class CompileDaemonTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.socket_path = os.path.join(cls.dir, 'daemon.sock')
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'compile_daemon.py')
+        cls.process = subprocess.Popen([sys.executable, script, '--socket=' + cls.socket_path, '--workers=1'],
+                                       stdout=subprocess.DEVNULL)
+        for i in range(100):
+            if os.path.exists(cls.socket_path):
+                break
+            time.sleep(0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.process.terminate()
+        cls.process.wait(10)
+        shutil.rmtree(cls.dir)
+
+    def test_compile(self):
+        src_fn = os.path.join(self.dir, 'exp.xlsx')
+        target_fn = os.path.join(self.dir, 'exp.html')
+        write_workbook(src_fn, ['a', 'b'])
+        result = send_job(self.socket_path, src_fn, target_fn, '1', dict(minify=True), timeout=60)
+        self.assertEqual(0, result['rc'], result)
+        self.assertEqual([], result['diagnostics'])
+        self.assertGreaterEqual(result['queue_seconds'], 0)
+        self.assertTrue(os.path.exists(target_fn))
+
+    def test_diagnostics(self):
+        src_fn = os.path.join(self.dir, 'exp2.xlsx')
+        write_workbook(src_fn, ['a'])
+        result = send_job(self.socket_path, src_fn, os.path.join(self.dir, 'exp2.html'), '1', dict(pages=2), timeout=60)
+        self.assertEqual(2, result['rc'], result)
+        self.assertEqual(['TOO_MANY_PAGES'], [d['code'] for d in result['diagnostics']])
+
+    def test_invalid_option(self):
+        result = send_job(self.socket_path, 'exp.xlsx', 'exp.html', '1', dict(no_such_option=True), timeout=60)
+        self.assertEqual(1, result['rc'])
+        self.assertIn('no_such_option', result['error'])
+
+    def test_client_sends_absolute_bundle_dir(self):
+        src_fn = os.path.join(self.dir, 'exp3.xlsx')
+        write_workbook(src_fn, ['a'])
+        result = send_job(self.socket_path, src_fn, os.path.join(self.dir, 'exp3.html'), '1', dict(bundle_from='no-such-dir'), timeout=60)
+        self.assertNotIn('error', result)
+        self.assertEqual(2, result['rc'], result)
+
+    def test_relative_bundle_dir(self):
+        with self.assertRaises(ValueError):
+            CompileDaemon()._job_args(dict(source='/x/exp.xlsx', target='/x/exp.html', options=dict(bundle_from='assets-src')))
+
+
+#=============================================================================================
+class BrokenWorkerTests(unittest.TestCase):
+
+    def test_executor_replaced(self):
+        dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir)
+        src_fn = os.path.join(dir, 'exp.xlsx')
+        write_workbook(src_fn, ['a'])
+        job_args = (src_fn, os.path.join(dir, 'exp.html'), '1', {})
+
+        daemon = CompileDaemon(socket_path=os.path.join(dir, 'daemon.sock'), n_workers=1)
+        broken_executor = daemon._executor = daemon._create_executor()
+        #-- Kill the worker process
+        broken_executor.submit(os._exit, 1)
+
+        async def run_jobs():
+            daemon._slots = asyncio.Semaphore(1)
+            return await daemon._run_job(job_args, time.perf_counter()), await daemon._run_job(job_args, time.perf_counter())
+
+        loop = asyncio.new_event_loop()
+        try:
+            failed, result = loop.run_until_complete(run_jobs())
+        finally:
+            loop.close()
+            daemon._executor.shutdown()
+
+        self.assertEqual(1, failed['rc'], failed)
+        self.assertIn('error', failed)
+        self.assertIsNot(broken_executor, daemon._executor)
+        self.assertEqual(0, result['rc'], result)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,453 @@
+//-- A minimal stand-in for jsPsych 7.1 and the browser, for running generated experiment pages in node.
+//-- It implements only what the generated code uses: the timeline (nested timelines, timeline variables,
+//-- addNodeToEndOfTimeline), the data store, the plugins (keyboard/button responses are simulated), and the DOM calls
+//-- made by the results-saving code.
+//--
+//-- Input (stdin): JSON {html, respond: "first"|"none", files: {url: text}, dropped_frames: {step number: n}}
+//-- The animation frames are 16 ms apart (in the time passed to requestAnimationFrame callbacks); dropped_frames
+//-- simulates n dropped frames during a step (the step number is its index in "shown").
+//-- Output (stdout): JSON {data, shown, downloads, ended, max_store_size, plugins}
+
+'use strict';
+
+const vm = require('vm');
+
+//-- Like a browser, an unhandled promise rejection doesn't stop the page (e.g., a prefetch that fails before the page
+//-- waits for it)
+process.on('unhandledRejection', function() {});
+
+function read_stdin() {
+    return new Promise(function(resolve) {
+        let text = '';
+        process.stdin.setEncoding('utf8');
+        process.stdin.on('data', function(chunk) { text += chunk; });
+        process.stdin.on('end', function() { resolve(JSON.parse(text)); });
+    });
+}
+
+//============================================================================
+// The browser
+//============================================================================
+
+const downloads = [];
+const blobs = {};
+let n_blobs = 0;
+
+class Element {
+    constructor(tag) {
+        this.tagName = (tag || 'div').toUpperCase();
+        this.children = [];
+        this.parentNode = null;
+        this.style = {};
+        this.className = '';
+        this._html = '';
+    }
+    get firstChild() {
+        if (this.children.length == 0 && this._html) {
+            this.appendChild(new Element('div'));
+        }
+        return this.children[0] || null;
+    }
+    get innerHTML() { return this._html; }
+    set innerHTML(html) {
+        this.children.forEach(function(child) { child.parentNode = null; });
+        this.children = [];
+        this._html = html;
+    }
+    appendChild(child) {
+        if (child.parentNode) {
+            child.parentNode.removeChild(child);
+        }
+        child.parentNode = this;
+        this.children.push(child);
+        return child;
+    }
+    prepend(child) {
+        child.parentNode = this;
+        this.children.unshift(child);
+    }
+    removeChild(child) {
+        this.children = this.children.filter(function(c) { return c !== child; });
+        child.parentNode = null;
+        return child;
+    }
+    addEventListener() {}
+    removeEventListener() {}
+    click() {
+        if (this.download) {
+            downloads.push({filename: this.download, url: this.href});
+        }
+    }
+}
+
+const window_listeners = {};
+global.window = global;
+global.addEventListener = function(name, func) {
+    (window_listeners[name] = window_listeners[name] || []).push(func);
+};
+global.removeEventListener = function() {};
+global.document = {
+    body: new Element('body'),
+    createElement: function(tag) { return new Element(tag); },
+    createTextNode: function(text) { const e = new Element('#text'); e.innerHTML = text; return e; },
+    getElementById: function() { return null; },
+    addEventListener: function() {},
+    removeEventListener: function() {},
+    visibilityState: 'visible',
+};
+global.navigator = {};
+global.location = {search: '', href: 'http://localhost/exp.html'};
+const frame_interval = 16;
+let frame_time = 0;
+let pending_dropped_frames = 0;
+global.requestAnimationFrame = function(func) {
+    return setTimeout(function() {
+        frame_time += frame_interval * (1 + pending_dropped_frames);
+        pending_dropped_frames = 0;
+        func(frame_time);
+    }, 1);
+};
+URL.createObjectURL = function(blob) {
+    const url = 'blob:' + (++n_blobs);
+    blobs[url] = blob;
+    return url;
+};
+URL.revokeObjectURL = function() {};
+
+//============================================================================
+// jsPsych
+//============================================================================
+
+global.jsPsychModule = {ParameterType: {BOOL: 0, STRING: 1, INT: 2, FLOAT: 3, FUNCTION: 4, KEY: 5, KEYS: 6, SELECT: 7,
+                                        HTML_STRING: 8, IMAGE: 9, AUDIO: 10, VIDEO: 11, OBJECT: 12, COMPLEX: 13}};
+
+//-- The plugins that a page may import (script "plugin-<name>.js" defines jsPsych<Name>)
+const plugin_names = ['html-keyboard-response', 'html-button-response', 'audio-keyboard-response', 'preload', 'call-function'];
+
+function plugin_global_name(name) {
+    return 'jsPsych' + name.split('-').map(function(word) { return word[0].toUpperCase() + word.slice(1); }).join('');
+}
+
+class TimelineVariable {
+    constructor(name) {
+        this.name = name;
+    }
+}
+
+class DataCollection {
+    constructor(trials) {
+        this.trials = trials;
+    }
+    values() { return this.trials; }
+    count() { return this.trials.length; }
+    filterCustom(func) { return new DataCollection(this.trials.filter(func)); }
+}
+
+let run_state = null;
+
+global.initJsPsych = function(options) {
+    const store = [];
+    const data_properties = {};
+    const variable_frames = [];
+    const timeline_data_frames = [];
+    const queue = [];
+    const start_time = performance.now();
+    let finish_current_trial = function() {};
+    let timeouts = [];
+    let trial_index = 0;
+    let node_id = 0;
+
+    run_state = {store: store, shown: [], ended: null, max_store_size: 0, respond: run_state.respond, dropped_frames: run_state.dropped_frames};
+
+    function variable_value(name) {
+        for (let i = variable_frames.length - 1; i >= 0; i--) {
+            if (name in variable_frames[i]) {
+                return variable_frames[i][name];
+            }
+        }
+        return undefined;
+    }
+
+    function resolve(value) {
+        if (value instanceof TimelineVariable) {
+            return variable_value(value.name);
+        }
+        if (value && typeof value == 'object' && !Array.isArray(value) && Object.getPrototypeOf(value) === Object.prototype) {
+            const result = {};
+            Object.keys(value).forEach(function(key) { result[key] = resolve(value[key]); });
+            return result;
+        }
+        return value;
+    }
+
+    function simulated_response(trial) {
+        if (run_state.respond == 'none' || trial.choices == 'NO_KEYS') {
+            return null;
+        }
+        if (Array.isArray(trial.choices) && trial.choices.length > 0) {
+            return {key: trial.choices[0], rt: 500};
+        }
+        return {key: 'a', rt: 500};
+    }
+
+    const jsPsych = {
+        timelineVariable: function(name, immediate) {
+            return immediate ? variable_value(name) : new TimelineVariable(name);
+        },
+
+        getTotalTime: function() {
+            return performance.now() - start_time;
+        },
+
+        data: {
+            get: function() { return new DataCollection(store); },
+            addProperties: function(properties) {
+                Object.assign(data_properties, properties);
+                store.forEach(function(trial) { Object.assign(trial, properties); });
+            },
+        },
+
+        pluginAPI: {
+            getKeyboardResponse: function(params) {
+                const response = simulated_response({choices: params.valid_responses});
+                if (response != null) {
+                    setImmediate(function() { params.callback_function(response); });
+                }
+            },
+            cancelAllKeyboardResponses: function() {},
+            setTimeout: function(func) {
+                timeouts.push(setTimeout(func, 5));
+            },
+            clearAllTimeouts: function() {
+                timeouts.forEach(clearTimeout);
+                timeouts = [];
+            },
+            preloadImages: function(urls, complete) { complete(); },
+            preloadAudio: function(urls, complete) { complete(); },
+            preloadVideo: function(urls, complete) { complete(); },
+        },
+
+        finishTrial: function(data) {
+            finish_current_trial(data || {});
+        },
+
+        addNodeToEndOfTimeline: function(node) {
+            queue.push(node);
+        },
+
+        endExperiment: function(message) {
+            run_state.ended = message || '';
+            //-- Like jsPsych, end the current trial (resolving an already finished trial has no effect)
+            finish_current_trial({});
+        },
+
+        run: function(timeline) {
+            timeline.forEach(function(node) { queue.push(node); });
+            const promise = (async function() {
+                while (queue.length > 0 && run_state.ended == null) {
+                    await run_node(queue.shift());
+                }
+                if (options.on_finish) {
+                    options.on_finish(new DataCollection(store));
+                }
+            })();
+            run_state.promise = promise;
+            return promise;
+        },
+    };
+
+    async function run_node(node) {
+        if (node.timeline) {
+            await run_timeline(node);
+        }
+        else {
+            await run_trial(node);
+        }
+    }
+
+    async function run_timeline(node) {
+        if (node.conditional_function && !node.conditional_function()) {
+            return;
+        }
+        if (node.on_timeline_start) {
+            node.on_timeline_start();
+        }
+        do {
+            for (let rep = 0; rep < (node.repetitions || 1); rep++) {
+                const variables = node.timeline_variables || [{}];
+                for (let i = 0; i < variables.length && run_state.ended == null; i++) {
+                    variable_frames.push(variables[i]);
+                    timeline_data_frames.push(node.data || {});
+                    for (let j = 0; j < node.timeline.length && run_state.ended == null; j++) {
+                        await run_node(node.timeline[j]);
+                    }
+                    timeline_data_frames.pop();
+                    variable_frames.pop();
+                }
+            }
+        } while (node.loop_function && run_state.ended == null && node.loop_function(new DataCollection(store)));
+        if (node.on_timeline_finish) {
+            node.on_timeline_finish();
+        }
+    }
+
+    async function run_trial(node) {
+        const trial = {};
+        Object.keys(node).forEach(function(key) {
+            if (key == 'type') {
+                trial[key] = node[key];
+            }
+            else {
+                trial[key] = (key == 'stimulus' && typeof node[key] == 'function') ? node[key]() : resolve(node[key]);
+            }
+        });
+        if (trial.type === undefined) {
+            throw new Error('A trial without a type (is its plugin imported?): ' + JSON.stringify(Object.keys(node)));
+        }
+        const trial_data = Object.assign({}, ...timeline_data_frames.map(resolve), trial.data || {});
+        if (trial.on_start) {
+            trial.on_start(trial);
+        }
+        const dropped_frames = run_state.dropped_frames[run_state.shown.length];
+        run_state.shown.push(trial.stimulus === undefined ? null : trial.stimulus);
+        if (dropped_frames) {
+            //-- Let animation frames arrive during the step: a normal one, then one after the dropped frames
+            await new Promise(function(resolve) { setTimeout(resolve, 5); });
+            pending_dropped_frames = dropped_frames;
+            await new Promise(function(resolve) { setTimeout(resolve, 5); });
+        }
+
+        const plugin_data = await new Promise(function(resolve_trial) {
+            finish_current_trial = resolve_trial;
+            run_plugin(trial);
+            if (trial.on_load) {
+                trial.on_load();
+            }
+        });
+
+        const data = Object.assign({}, plugin_data, trial_data, {
+            trial_type: trial.type.info ? trial.type.info.name : String(trial.type),
+            trial_index: trial_index++,
+            time_elapsed: Math.round(jsPsych.getTotalTime()),
+            internal_node_id: '0.0-' + (node_id++) + '.0',
+        }, data_properties);
+        store.push(data);
+        run_state.max_store_size = Math.max(run_state.max_store_size, store.length);
+        if (trial.on_finish) {
+            trial.on_finish(data);
+        }
+        if (options.on_trial_finish) {
+            options.on_trial_finish(data);
+        }
+    }
+
+    function run_plugin(trial) {
+        const type = trial.type;
+
+        if (typeof type == 'function') {
+            //-- A plugin class defined by the page
+            new type(jsPsych).trial(new Element('div'), trial);
+            return;
+        }
+
+        if (type === global.jsPsychCallFunction) {
+            if (trial.async) {
+                trial.func(function(value) { jsPsych.finishTrial({value: value}); });
+            }
+            else {
+                const value = trial.func();
+                setImmediate(function() { jsPsych.finishTrial({value: value}); });
+            }
+            return;
+        }
+
+        if (type === global.jsPsychPreload) {
+            setImmediate(function() { jsPsych.finishTrial({success: true, timeout: false, failed_images: [], failed_audio: [], failed_video: []}); });
+            return;
+        }
+
+        let response = null;
+        if (type === global.jsPsychHtmlButtonResponse) {
+            response = run_state.respond == 'none' ? null : {key: 0, rt: 500};
+        }
+        else if (type !== global.jsPsychAudioKeyboardResponse) {
+            response = simulated_response(trial);
+        }
+        const stimulus = trial.stimulus;
+        setImmediate(function() {
+            jsPsych.finishTrial({rt: response ? response.rt : null, response: response ? response.key : null, stimulus: stimulus});
+        });
+    }
+
+    return jsPsych;
+};
+
+//============================================================================
+// Running the page
+//============================================================================
+
+async function main() {
+    const input = await read_stdin();
+    const html = input.html;
+    //-- initJsPsych() completes the run state
+    run_state = {respond: input.respond, dropped_frames: input.dropped_frames || {}};
+
+    const files = input.files || {};
+    global.fetch = function(url) {
+        const ok = url in files;
+        return Promise.resolve({
+            ok: ok,
+            status: ok ? 200 : 404,
+            json: function() { return Promise.resolve(JSON.parse(files[url])); },
+            text: function() { return Promise.resolve(files[url]); },
+        });
+    };
+
+    //-- The plugins imported by the page
+    const imported = [];
+    const script_src = /<script src="([^"]*)"/g;
+    let match;
+    while ((match = script_src.exec(html)) != null) {
+        plugin_names.forEach(function(name) {
+            if (match[1].indexOf('plugin-' + name) >= 0) {
+                global[plugin_global_name(name)] = {info: {name: name}};
+                imported.push(name);
+            }
+        });
+    }
+
+    const inline_script = /<script>([\s\S]*?)<\/script>/g;
+    while ((match = inline_script.exec(html)) != null) {
+        vm.runInThisContext(match[1]);
+    }
+    (window_listeners['DOMContentLoaded'] || []).forEach(function(func) { func(); });
+    (window_listeners['load'] || []).forEach(function(func) { func(); });
+
+    if (run_state.store === undefined) {
+        throw new Error('The page did not start jsPsych');
+    }
+    await run_state.promise;
+    //-- Let the results file be created
+    await new Promise(function(resolve) { setTimeout(resolve, 20); });
+
+    const output_downloads = [];
+    for (const download of downloads) {
+        const blob = blobs[download.url];
+        output_downloads.push({filename: download.filename, content: blob ? await blob.text() : null});
+    }
+
+    process.stdout.write(JSON.stringify({
+        data: run_state.store,
+        shown: run_state.shown,
+        downloads: output_downloads,
+        ended: run_state.ended,
+        max_store_size: run_state.max_store_size,
+        plugins: imported,
+    }));
+    process.exit(0);
+}
+
+main().catch(function(error) {
+    process.stderr.write(String(error && error.stack || error));
+    process.exit(1);
+});
@@ -0,0 +1,573 @@
+import json
+import re
+import unittest
+import unittest.mock
+
+import expcompiler.generator
+import expcompiler.offline
+from testutils import *
+from jsrun import run_page, results_rows, skip_without_node
+from expcompiler.generator import ExpGenerator, minify_script
+from expcompiler.logger import Logger
+
+
+#-----------------------------------------------------------------------------
+def parse_exp(trials, layout=None, trial_types=None, responses=None, general=None, instructions=None):
+
+    general = general or [dict(param='save_results', value='Y')]
+    layout = layout or [dict(layout_name='f1', type='text', text=''), dict(layout_name='f2', type='text', text='+')]
+    trial_types = trial_types or [{'layout items': 'f2', 'duration': 100}, {'layout items': 'f1', 'duration': 100}]
+
+    reader = ReaderForTests(general=general, layout=layout, trial_types=trial_types, respones=responses, trials=trials, instructions=instructions)
+    parser = ParserForTests(reader, parse_layout=True, parse_trial_types=True, parse_trials=True)
+    return parser.parse(dict(instructions_mandatory=False))
+
+
+#-----------------------------------------------------------------------------
+def parse_exp_with_responses(trials, **kwargs):
+    """ Each trial has a step without a response (f2, not saved), then f1 with a key response """
+    return parse_exp(trials, trial_types=[{'layout items': 'f2', 'duration': 100}, {'layout items': 'f1', 'responses': 'k'}],
+                     responses=[dict(response_name='k', type='key', value=1, key='a')], **kwargs)
+
+
+#-----------------------------------------------------------------------------
+def generate(exp, **kwargs):
+    generator = ExpGenerator(Logger(), **kwargs)
+    script = generator.generate(exp)
+    return generator, script
+
+
+#=============================================================================================
+class MinifyTests(unittest.TestCase):
+
+    def test_default_names_are_kept(self):
+        exp = parse_exp([{'f1': 'a', 'save:x': 1}])
+        generator, script = generate(exp)
+        self.assertIn('trial_type_default_step1', script)
+        self.assertIn('stim_f1', script)
+
+    def test_minify_shortens_internal_names(self):
+        exp = parse_exp([{'f1': 'a', 'save:x': 1}])
+        generator, script = generate(exp, minify=True)
+        self.assertNotIn('trial_type_default_step1', script)
+        self.assertNotIn('stim_f1', script)
+        self.assertNotIn('val_x', script)
+
+    def test_minify_keeps_results_columns(self):
+        exp = parse_exp([{'f1': 'a', 'save:x': 1}])
+        generator, script = generate(exp, minify=True)
+        for col in exp.results_column_names:
+            self.assertIn(col + ': jsPsych.timelineVariable(', script)
+
+    def test_minify_names_are_stable(self):
+        exp = parse_exp([{'f1': 'a', 'save:x': 1}])
+        self.assertEqual(generate(exp, minify=True)[1], generate(exp, minify=True)[1])
+
+    def test_minify_script_removes_indentation_and_comments(self):
+        self.assertEqual('a = 1;\nb = 2;', minify_script('    a = 1;\n\n    // comment\n        b = 2;  '))
+
+    @skip_without_node
+    def test_minified_page_runs_like_the_original(self):
+        exp = parse_exp([{'f1': 'a', 'save:x': 1}, {'f1': 'b', 'save:x': 2}, {'f1': 'c', 'save:x': 3}],
+                        instructions=[dict(text='hello', responses='k')],
+                        trial_types=[{'layout items': 'f2', 'duration': 100}, {'layout items': 'f1', 'responses': 'k'}],
+                        responses=[dict(response_name='k', type='key', value=1, key='a')])
+        original = run_page(generate(exp)[1])
+        minified = run_page(generate(exp, minify=True)[1])
+        self.assertEqual(original['shown'], minified['shown'])
+        self.assertEqual(['a', 'b', 'c'], [row['f1'] for row in results_rows(minified)])
+        #-- time_elapsed is the harness's real time
+        self.assertEqual([dict(row, time_elapsed=None) for row in results_rows(original)],
+                         [dict(row, time_elapsed=None) for row in results_rows(minified)])
+
+
+#=============================================================================================
+class ExternalTrialDataTests(unittest.TestCase):
+
+    def test_trial_data_not_embedded(self):
+        exp = parse_exp([{'f1': 'hello'}])
+        generator, script = generate(exp, trial_data_url='exp.trials.json')
+        self.assertNotIn('hello', script)
+        self.assertIn('fetch("exp.trials.json")', script)
+        self.assertIn('jsPsychCallFunction', script)
+
+    def test_trial_data_json(self):
+        exp = parse_exp([{'f1': 'hello', 'save:x': 1}, {'f1': 'there', 'save:x': 2}])
+        generator, script = generate(exp, trial_data_url='exp.trials.json')
+        files = generator.trial_data_files(exp)
+        self.assertEqual(['exp.trials.json'], [fn for fn, content in files])
+        data = json.loads(files[0][1])
+        self.assertEqual(2, len(data))
+        self.assertEqual("<div class='f1'>there</div>", data[1]['trial_type_default_step2'])
+        self.assertEqual('2', data[1]['val_x'])
+        self.assertEqual('3', data[1]['config_trial_number'])
+
+
+#=============================================================================================
+class BlocksTests(unittest.TestCase):
+
+    def parse(self):
+        return parse_exp_with_responses([{'f1': 'a', 'block': 1}, {'f1': 'b', 'block': 1}, {'f1': 'c', 'block': 2}],
+                                        general=[dict(param='save_results', value='Y'), dict(param='block_break_text', value='Rest')])
+
+    @skip_without_node
+    def test_blocks_run_in_order(self):
+        generator, script = generate(self.parse())
+        run = run_page(script)
+        self.assertEqual(["<div class='f1'>a</div>", "<div class='f1'>b</div>", '<div>Rest</div>', "<div class='f1'>c</div>"],
+                         [s for s in run['shown'] if s is not None and 'f2' not in s])
+        rows = results_rows(run)
+        self.assertEqual([('a', '2'), ('b', '3'), ('c', '4')], [(row['f1'], row['config_trial_number']) for row in rows])
+
+    def test_block_json_released_when_decoded(self):
+        generator, script = generate(self.parse())
+        self.assertIn('block_trial_data[block_num] = null;', script)
+        self.assertNotIn('const trial_data = [', script)
+
+    @skip_without_node
+    def test_block_data_files(self):
+        exp = self.parse()
+        generator, script = generate(exp, trial_data_url='exp.trials.json')
+        files = generator.trial_data_files(exp)
+        self.assertEqual(['exp.trials.1.json', 'exp.trials.2.json'], [fn for fn, content in files])
+        self.assertNotIn("'f1'>a<", script)
+
+        run = run_page(script, files=dict(files))
+        self.assertIsNone(run['ended'])
+        self.assertEqual(['a', 'b', 'c'], [row['f1'] for row in results_rows(run)])
+
+    @skip_without_node
+    def test_missing_block_file(self):
+        exp = self.parse()
+        generator, script = generate(exp, trial_data_url='exp.trials.json')
+        files = dict(generator.trial_data_files(exp)[:1])
+        run = run_page(script, files=files)
+        self.assertIn('the trial data could not be loaded', run['ended'])
+        self.assertEqual(['a', 'b'], [trial['f1'] for trial in run['data'] if trial.get('rt') is not None and 'f1' in trial])
+
+
+#=============================================================================================
+class ImportsTests(unittest.TestCase):
+
+    #-- The harness defines only the plugins that the page imports; a step whose plugin isn't imported fails the page
+
+    @skip_without_node
+    def test_keyboard_only(self):
+        exp = parse_exp_with_responses([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertEqual(['html-keyboard-response'], generator.required_plugins(exp))
+        run = run_page(script)
+        self.assertEqual(['html-keyboard-response'], run['plugins'])
+        self.assertEqual(['a'], [row['f1'] for row in results_rows(run)])
+
+    @skip_without_node
+    def test_buttons_and_beep(self):
+        exp = parse_exp([{'f1': 'a'}],
+                        general=[dict(param='save_results', value='Y'), dict(param='start_of_session_beep', value='Y')],
+                        trial_types=[{'layout items': 'f1', 'responses': 'b1'}],
+                        responses=[dict(response_name='b1', type='button', value=1, text='OK')])
+        generator, script = generate(exp)
+        self.assertEqual(['html-button-response', 'audio-keyboard-response', 'preload'], generator.required_plugins(exp))
+        run = run_page(script)
+        self.assertEqual(sorted(generator.required_plugins(exp)), sorted(run['plugins']))
+        self.assertEqual(['a'], [row['f1'] for row in results_rows(run)])
+
+    @skip_without_node
+    def test_external_trial_data(self):
+        exp = parse_exp_with_responses([{'f1': 'a'}])
+        generator, script = generate(exp, trial_data_url='exp.trials.json')
+        run = run_page(script, files=dict(generator.trial_data_files(exp)))
+        self.assertEqual(['call-function', 'html-keyboard-response'], sorted(run['plugins']))
+        self.assertEqual(['a'], [row['f1'] for row in results_rows(run)])
+
+    def test_scripts_are_deferred(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp, imports_local=False)
+        self.assertIn('<script src="https://unpkg.com/jspsych@7.1.2" defer></script>', script)
+        self.assertIn('<link rel="preconnect" href="https://unpkg.com">', script)
+
+
+#=============================================================================================
+class TrialFormattingTests(unittest.TestCase):
+
+    def run_formatted(self, colors):
+        """ Run a page whose trial i shows "t<i>" in colors[i]; return {trial text: its CSS color} """
+        exp = parse_exp_with_responses([{'f1': 't{}'.format(i), 'format:f1.color': color} for i, color in enumerate(colors)])
+        generator, script = generate(exp)
+        css_classes = dict(re.findall(r'\.(fmt_\w+) \{ color: ([#\w]+); \}', script))
+        self.assertEqual(len(css_classes), len(set(colors)), 'one CSS class per format')
+
+        run = run_page(script)
+        shown = [re.match(r"<div class='f1 (fmt_\w+)'>(\w+)</div>", stimulus) for stimulus in run['shown'] if "class='f1 " in stimulus]
+        self.assertEqual(len(colors), len(shown))
+        self.assertEqual(['t{}'.format(i) for i in range(len(colors))], [row['f1'] for row in results_rows(run)])
+        return {match.group(2): css_classes[match.group(1)] for match in shown}
+
+    @skip_without_node
+    def test_formatting_as_shared_css_class(self):
+        colors = ['red', 'red', 'blue']
+        self.assertEqual({'t0': 'red', 't1': 'red', 't2': 'blue'}, self.run_formatted(colors))
+
+    def test_no_inline_style(self):
+        exp = parse_exp([{'f1': 'a', 'format:f1.color': 'red'}])
+        generator, script = generate(exp)
+        self.assertNotIn("style='", script)
+
+    @skip_without_node
+    def test_colliding_class_names(self):
+        colors = ['#0000{:02x}'.format(i) for i in range(40)]
+        #-- With 1 digit, some of the 40 names must collide
+        with unittest.mock.patch.object(expcompiler.generator, 'css_class_hash_length', 1):
+            trial_colors = self.run_formatted(colors)
+        self.assertEqual({'t{}'.format(i): color for i, color in enumerate(colors)}, trial_colors)
+
+
+#=============================================================================================
+class RepetitionsTests(unittest.TestCase):
+
+    def run_trials(self, exp, **kwargs):
+        """ Run the page; return the saved (f1, config_trial_number) of each trial """
+        generator, script = generate(exp, **kwargs)
+        files = dict(generator.trial_data_files(exp)) if 'trial_data_url' in kwargs else None
+        rows = results_rows(run_page(script, files=files))
+        return [(row['f1'], row['config_trial_number']) for row in rows]
+
+    @skip_without_node
+    def test_repetitions_column(self):
+        exp = parse_exp_with_responses([{'f1': 'a', 'repetitions': 3}, {'f1': 'b'}])
+        expected = [('a', '2'), ('a', '2'), ('a', '2'), ('b', '3')]
+        self.assertEqual(expected, self.run_trials(exp))
+        self.assertEqual(expected, self.run_trials(exp, trial_data_url='exp.trials.json'))
+
+    def test_repetitions_not_expanded_in_data_file(self):
+        exp = parse_exp([{'f1': 'a', 'repetitions': 3}])
+        generator, script = generate(exp, trial_data_url='exp.trials.json')
+        data = json.loads(generator.trial_data_files(exp)[0][1])
+        self.assertEqual(1, len(data))
+        self.assertEqual('3', data[0]['repetitions'])
+
+    def test_identical_trials_not_compacted_by_default(self):
+        exp = parse_exp([{'f1': 'a'}, {'f1': 'a'}])
+        generator, script = generate(exp, trial_data_url='exp.trials.json')
+        self.assertEqual(2, len(json.loads(generator.trial_data_files(exp)[0][1])))
+
+    @skip_without_node
+    def test_compact_identical_consecutive_trials(self):
+        exp = parse_exp_with_responses([{'f1': 'a'}, {'f1': 'a', 'repetitions': 2}, {'f1': 'b'}, {'f1': 'a'}])
+        expected = [('a', '2'), ('a', '3'), ('a', '3'), ('b', '4'), ('a', '5')]
+        self.assertEqual(expected, self.run_trials(exp))
+        self.assertEqual(expected, self.run_trials(exp, compact_trials=True))
+        self.assertEqual(expected, self.run_trials(exp, trial_data_url='exp.trials.json', compact_trials=True))
+
+        generator, script = generate(exp, trial_data_url='exp.trials.json', compact_trials=True)
+        self.assertEqual(3, len(json.loads(generator.trial_data_files(exp)[0][1])))
+
+    @skip_without_node
+    def test_compact_trials_in_blocks(self):
+        exp = parse_exp_with_responses([{'f1': 'a', 'block': 1}, {'f1': 'a', 'block': 1}, {'f1': 'a', 'block': 2}])
+        self.assertEqual([('a', '2'), ('a', '3'), ('a', '4')], self.run_trials(exp, compact_trials=True))
+
+
+#=============================================================================================
+class PersistResultsTests(unittest.TestCase):
+
+    def test_results_kept_in_memory_by_default(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertIn('{on_finish: on_jspsych_finish, on_trial_finish: on_jspsych_trial_finish}', script)
+        self.assertIn('jsPsych.data.get().filterCustom(is_saved_trial)', script)
+        self.assertNotIn('indexedDB', script)
+
+    def test_persist_results(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp, persist_results=True)
+        self.assertIn('{on_finish: on_jspsych_finish, on_trial_finish: on_jspsych_trial_finish}', script)
+        self.assertIn('indexedDB.open(', script)
+        self.assertNotIn('${results_filename}', script)
+        self.assertNotIn('jsPsych.data.get()', script)
+
+    def test_no_results_code_if_results_not_saved(self):
+        exp = parse_exp([{'f1': 'a'}], general=[dict(param='save_results', value='N')])
+        generator, script = generate(exp, persist_results=True)
+        self.assertIn('initJsPsych({})', script)
+        self.assertNotIn('indexedDB', script)
+
+
+#=============================================================================================
+class UploadResultsTests(unittest.TestCase):
+
+    def test_upload_results(self):
+        exp = parse_exp([{'f1': 'a'}], general=[dict(param='save_results', value='Y'), dict(param='results_upload_url', value='https://x.org/r'),
+                                                dict(param='results_upload_batch_size', value=5)])
+        generator, script = generate(exp)
+        self.assertIn('const upload_url = "https://x.org/r";', script)
+        self.assertIn('const upload_batch_size = 5;', script)
+        self.assertIn('const upload_interval = 10000;', script)
+        self.assertIn('on_trial_finish: on_jspsych_trial_finish', script)
+        self.assertIn('navigator.sendBeacon(', script)
+
+    def test_upload_and_persist_results(self):
+        exp = parse_exp([{'f1': 'a'}], general=[dict(param='save_results', value='Y'), dict(param='results_upload_url', value='https://x.org/r')])
+        generator, script = generate(exp, persist_results=True)
+        self.assertIn('store_trial_results(row);\n            upload_trial_results(row);', script)
+        self.assertEqual(1, script.count('function results_row('))
+
+
+#=============================================================================================
+class ResultsFileTests(unittest.TestCase):
+
+    def test_csv_created_in_worker(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertIn('new Worker(code_url)', script)
+        self.assertIn('if (results_file_url == null) {', script)
+
+    def test_instructions_filtered_by_tag(self):
+        exp = parse_exp([{'f1': 'a'}], instructions=[dict(text='hello', responses='k')],
+                        responses=[dict(response_name='k', type='key', value=1, key='a')])
+        generator, script = generate(exp)
+        self.assertIn('data: {instruction: true},', script)
+        self.assertIn('if (trial.instruction) {', script)
+        self.assertNotIn('indexOf(trial.trial_index)', script)
+
+
+#=============================================================================================
+class TrialFinishTests(unittest.TestCase):
+
+    def parse(self):
+        #-- Each trial has a step without a response (not saved) and a step with a response
+        return parse_exp([{'f1': 'a'}, {'f1': 'b'}], instructions=[dict(text='hello', responses='k')],
+                         trial_types=[{'layout items': 'f2', 'duration': 100}, {'layout items': 'f1', 'responses': 'k'}],
+                         responses=[dict(response_name='k', type='key', value=1, key='a')])
+
+    @skip_without_node
+    def test_payload_fields_removed(self):
+        generator, script = generate(self.parse())
+        run = run_page(script)
+        self.assertEqual(5, len(run['data']))
+        for trial in run['data']:
+            self.assertNotIn('stimulus', trial)
+            self.assertNotIn('response', trial)
+            #-- jsPsych uses these
+            self.assertIn('internal_node_id', trial)
+            self.assertIn('trial_type', trial)
+
+        rows = results_rows(run)
+        self.assertEqual(['a', 'b'], [row['f1'] for row in rows])
+        self.assertNotIn('internal_node_id', rows[0])
+        self.assertNotIn('trial_type', rows[0])
+
+    @skip_without_node
+    def test_drop_filtered_results(self):
+        generator, script = generate(self.parse(), drop_filtered_results=True)
+        run = run_page(script)
+        self.assertEqual(['a', 'b'], [trial['f1'] for trial in run['data']])
+        self.assertLessEqual(run['max_store_size'], 1 + len(run['data']))
+        self.assertEqual(['a', 'b'], [row['f1'] for row in results_rows(run)])
+
+
+#=============================================================================================
+class CompactResultsTests(unittest.TestCase):
+
+    def test_csv_by_default(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertIn("functions: [csv_value, rows_to_csv], type: 'text/csv'", script)
+        self.assertIn("'results_${date}.csv'", script)
+
+    def test_compact_results(self):
+        exp = parse_exp([{'f1': 'a', 'save:x': 1}])
+        generator, script = generate(exp, compact_results=True)
+        self.assertIn('const trial_columns = new Set(["f1", "x"]);', script)
+        self.assertIn("'results_${date}.json'", script)
+        self.assertNotIn('rows_to_csv', script)
+
+
+#=============================================================================================
+class MediaPreloadTests(unittest.TestCase):
+
+    def test_no_media(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertEqual([], generator.media_manifest(exp))
+        self.assertNotIn('jsPsychPreload', script)
+
+    def test_media_in_layout_and_trials(self):
+        exp = parse_exp([{'f1': 'a.png'}, {'f1': '<img src="b.JPG"> and <audio src=\'c.mp3\'>'}, {'f1': 'a.png'}, {'f1': 'x.png y'}],
+                        layout=[dict(layout_name='f1', type='text', text=''), dict(layout_name='f2', type='text', text='<img src="logo.svg">')])
+        generator, script = generate(exp)
+        self.assertEqual([dict(images=['logo.svg', 'a.png', 'b.JPG'], audio=['c.mp3'], video=[])], generator.media_manifest(exp))
+        self.assertIn('preload', generator.required_plugins(exp))
+        self.assertIn('images: media_manifest[0].images,', script)
+        self.assertIn('if (trial.media_preload !== undefined) {', script)
+
+    def test_media_per_block(self):
+        exp = parse_exp([{'f1': 'a.png', 'block': 1}, {'f1': 'b.png', 'block': 2}, {'f1': 'a.png', 'block': 2}])
+        generator, script = generate(exp)
+        self.assertEqual([dict(images=['a.png'], audio=[], video=[]), dict(images=['b.png'], audio=[], video=[])],
+                         generator.media_manifest(exp))
+        self.assertIn('preload_media_in_background(block_num + 1);', script)
+        self.assertIn('jsPsych.addNodeToEndOfTimeline(media_preload_step(block_num));', script)
+
+    def test_layout_media_in_first_block(self):
+        exp = parse_exp([{'f1': 'a.png', 'block': 1}, {'f1': 'b.png', 'block': 2}],
+                        layout=[dict(layout_name='f1', type='text', text=''), dict(layout_name='f2', type='text', text='<img src="logo.svg">')])
+        generator = ExpGenerator(Logger())
+        self.assertEqual([['logo.svg', 'a.png'], ['b.png']], [stage['images'] for stage in generator.media_manifest(exp)])
+
+    def test_manifest_computed_once_per_generation(self):
+        exp = parse_exp([{'f1': 'a.png', 'block': 1}, {'f1': 'b.png', 'block': 2}])
+        generator = ExpGenerator(Logger(), service_worker_url='exp.sw.js')
+        with unittest.mock.patch.object(generator, '_create_media_manifest', wraps=generator._create_media_manifest) as create:
+            generator.generate(exp)
+            expcompiler.offline.experiment_urls(exp, generator, 'exp.html', [])
+        self.assertEqual(1, create.call_count)
+
+
+#=============================================================================================
+class PersistentLayoutTests(unittest.TestCase):
+
+    def test_html_stimulus_by_default(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertNotIn('jsPsychLayoutStep', script)
+        self.assertIn("<div class='f1'>a</div>", script)
+
+    def test_persistent_layout(self):
+        exp = parse_exp([{'f1': 'a', 'format:f1.color': 'red'}])
+        generator, script = generate(exp, persistent_layout=True)
+        self.assertIn('const layout_controls = [["f1", false], ["f2", false]];', script)
+        self.assertIn('type: jsPsychLayoutStep,', script)
+        self.assertIn('trial_type_default_step1: [["f2","+",""]]', script)
+        self.assertRegex(script, r'trial_type_default_step2: \[\["f1","a","fmt_[0-9a-f]{8}"\]\]')
+        self.assertNotIn('html-keyboard-response', generator.required_plugins(exp))
+
+    def test_persistent_layout_json_data(self):
+        exp = parse_exp([{'f1': 'hello'}])
+        generator, script = generate(exp, persistent_layout=True, trial_data_url='exp.trials.json')
+        data = json.loads(generator.trial_data_files(exp)[0][1])
+        self.assertEqual([['f1', 'hello', '']], data[0]['trial_type_default_step2'])
+
+
+#=============================================================================================
+class PreciseTimingTests(unittest.TestCase):
+
+    def test_jspsych_timing_by_default(self):
+        exp = parse_exp([{'f1': 'a'}], trial_types=[{'layout items': 'f1', 'duration': 100, 'delay-after': 50}])
+        generator, script = generate(exp)
+        self.assertIn('post_trial_gap: 50,', script)
+        self.assertNotIn('jsPsychLayoutStep', script)
+
+    def test_precise_timing(self):
+        exp = parse_exp([{'f1': 'a'}], trial_types=[{'layout items': 'f1', 'duration': 100, 'delay-after': 50}])
+        generator, script = generate(exp, precise_timing=True)
+        self.assertIn('const precise_timing = true;', script)
+        self.assertIn('type: jsPsychLayoutStep,', script)
+        self.assertIn('step: 1,', script)
+        self.assertIn('delay_after: 50,', script)
+        self.assertNotIn('post_trial_gap', script)
+        #-- Without persistent layout, the stimulus is still HTML
+        self.assertIn("<div class='f1'>a</div>", script)
+
+    def test_precise_timing_saved_with_last_step(self):
+        exp = parse_exp([{'f1': 'a', 'f2': 'b'}], trial_types=[{'layout items': 'f1', 'duration': 100},
+                                                              {'layout items': 'f2', 'duration': 100}])
+        generator, script = generate(exp, precise_timing=True)
+        self.assertEqual(1, script.count('last_step: true,'))
+        self.assertLess(script.index('step: 1,'), script.index('last_step: true,'))
+        self.assertLess(script.index('step: 2,'), script.index('last_step: true,'))
+
+
+#=============================================================================================
+class TelemetryTests(unittest.TestCase):
+
+    def test_no_telemetry_by_default(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertNotIn('telemetry', script)
+
+    def test_telemetry(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp, telemetry=True)
+        self.assertIn('timeline.push(telemetry_calibration);', script)
+        self.assertIn('record_trial_telemetry(trial);', script)
+        self.assertIn('if (trial.telemetry_calibration) {', script)
+        self.assertIn('call-function', generator.required_plugins(exp))
+
+    @skip_without_node
+    def test_dropped_frames_per_step(self):
+        exp = parse_exp([{'f1': 'a'}, {'f1': 'b'}, {'f1': 'c'}],
+                        trial_types=[{'layout items': 'f2', 'duration': 100}, {'layout items': 'f1', 'responses': 'k'}],
+                        responses=[dict(response_name='k', type='key', value=1, key='a')])
+        generator, script = generate(exp, telemetry=True)
+        #-- Steps: calibration, then each trial's fixation (not saved) and response step
+        run = run_page(script, dropped_frames={1: 2, 4: 1})
+        rows = results_rows(run)
+        self.assertEqual('62.5', rows[0]['refresh_rate'])
+        self.assertEqual([('a', '0'), ('b', '1'), ('c', '0')], [(row['f1'], row['dropped_frames']) for row in rows[1:]])
+
+    def test_telemetry_requires_saving_results(self):
+        exp = parse_exp([{'f1': 'a'}], general=[dict(param='save_results', value='N')])
+        generator, script = generate(exp, telemetry=True)
+        self.assertNotIn('telemetry', script)
+
+
+#=============================================================================================
+class ImageTests(unittest.TestCase):
+
+    layout = [dict(layout_name='f1', type='text', text=''), dict(layout_name='pic', type='image', source='default.png', width='100px')]
+    trial_types = [{'layout items': 'f1,pic', 'duration': 100}]
+
+    def test_image_html(self):
+        exp = parse_exp([{'pic': 'cat.png'}, {'f1': 'a'}], layout=self.layout, trial_types=self.trial_types)
+        generator, script = generate(exp)
+        self.assertIn("<div class='pic'><img src='cat.png'></div>", script)
+        self.assertIn("<div class='pic'><img src='default.png'></div>", script)
+        self.assertIn('.pic img { max-width: 100%; max-height: 100%; }', script)
+
+    def test_wait_for_decoded_images(self):
+        exp = parse_exp([{'pic': 'cat.png'}, {'f1': 'a'}], layout=self.layout, trial_types=self.trial_types)
+        generator, script = generate(exp)
+        self.assertIn('timeline: [wait_for_images, trial_type_default_step1],', script)
+        self.assertIn('images: ["cat.png"]', script)
+        self.assertIn('images: ["default.png"]', script)
+        self.assertEqual([dict(images=['default.png', 'cat.png'], audio=[], video=[])], generator.media_manifest(exp))
+
+    def test_no_image_wait_without_images(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertNotIn('wait_for_images', script)
+
+
+
+#=============================================================================================
+class AudioTests(unittest.TestCase):
+
+    layout = [dict(layout_name='f1', type='text', text=''), dict(layout_name='snd', type='audio', source='beep.wav')]
+    trial_types = [{'layout items': 'f1,snd', 'duration': 100}]
+
+    def test_audio_is_not_shown(self):
+        exp = parse_exp([{'f1': 'a', 'snd': 'a.mp3'}], layout=self.layout, trial_types=self.trial_types)
+        generator, script = generate(exp)
+        self.assertIn('"<div class=\'f1\'>a</div>"', script)
+        self.assertNotIn("class='snd'", script)
+        self.assertNotIn('.snd {', script)
+
+    def test_audio_played_on_load(self):
+        exp = parse_exp([{'f1': 'a', 'snd': 'a.mp3'}, {'f1': 'b'}], layout=self.layout, trial_types=self.trial_types)
+        generator, script = generate(exp)
+        self.assertIn("play_step_audio(1, jsPsych.timelineVariable('trial_type_default_step1_audio', true));", script)
+        self.assertIn('trial_type_default_step1_audio: ["a.mp3"]', script)
+        self.assertIn('trial_type_default_step1_audio: ["beep.wav"]', script)
+        self.assertIn('record_trial_audio_timing(trial);', script)
+        self.assertEqual([dict(images=[], audio=['beep.wav', 'a.mp3'], video=[])], generator.media_manifest(exp))
+
+    def test_no_audio_code_without_audio(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertNotIn('play_step_audio', script)
+        self.assertNotIn('record_trial_audio_timing', script)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+Running generated experiment pages in node, with a minimal stand-in for jsPsych and the browser (fake_jspsych.js)
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import unittest
+
+node_available = shutil.which('node') is not None
+
+fake_jspsych = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_jspsych.js')
+
+
+#-----------------------------------------------------------------------------
+def run_page(html, respond='first', files=None, dropped_frames=None):
+    """
+    Run an experiment page until it ends
+
+    :param respond: "first" = respond to each step with its first valid key/button after 500 ms; "none" = no responses
+    :param files: The files that the page can fetch (dict: URL -> text)
+    :param dropped_frames: Simulate dropped animation frames (dict: step number, as in "shown" -> number of frames)
+    :return: dict(data=jsPsych's data store at the end, shown=the stimulus of each step, downloads=list of
+             dict(filename, content), ended=endExperiment()'s message or None, max_store_size, plugins=the imported plugins)
+    """
+    page_input = dict(html=html, respond=respond, files=files or {}, dropped_frames=dropped_frames or {})
+    result = subprocess.run(['node', fake_jspsych], input=json.dumps(page_input).encode('utf-8'),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+    if result.returncode != 0:
+        raise AssertionError('The page failed: ' + result.stderr.decode('utf-8'))
+    return json.loads(result.stdout.decode('utf-8'))
+
+
+#-----------------------------------------------------------------------------
+def results_rows(run):
+    """ The rows of the results file (CSV) that the page saved at the end """
+    import csv
+    import io
+    content = [d['content'] for d in run['downloads'] if d['filename'].endswith('.csv')][0]
+    return list(csv.DictReader(io.StringIO(content)))
+
+
+skip_without_node = unittest.skipIf(not node_available, 'node is not installed')
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from expcompiler.offline import cache_manifest, experiment_urls, service_worker_code
+from generator_tests import parse_exp, generate
+
+
+#=============================================================================================
+class CacheManifestTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.write('exp.html', 'a')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, fn, content):
+        with open(os.path.join(self.tmp_dir.name, fn), 'w') as fp:
+            fp.write(content)
+
+    def test_content_hash(self):
+        self.write('b.html', 'a')
+        manifest = cache_manifest(self.tmp_dir.name, ['exp.html', 'b.html'])
+        self.assertEqual(manifest['files']['exp.html'], manifest['files']['b.html'])
+
+    def test_version_changes_with_content(self):
+        version1 = cache_manifest(self.tmp_dir.name, ['exp.html', 'https://unpkg.com/jspsych@7.1.2'])['version']
+        self.write('exp.html', 'b')
+        version2 = cache_manifest(self.tmp_dir.name, ['exp.html', 'https://unpkg.com/jspsych@7.1.2'])['version']
+        self.assertNotEqual(version1, version2)
+
+    def test_service_worker(self):
+        code = service_worker_code('expcompiler-exp-', cache_manifest(self.tmp_dir.name, ['exp.html']))
+        self.assertIn('const cache_prefix = "expcompiler-exp-";', code)
+        self.assertIn('"exp.html"', code)
+
+
+#=============================================================================================
+class ExperimentUrlsTests(unittest.TestCase):
+
+    def test_experiment_urls(self):
+        exp = parse_exp([{'f1': 'a.png'}], general=[dict(param='start_of_session_beep', value='Y')])
+        generator, script = generate(exp, service_worker_url='exp.sw.js')
+        urls = experiment_urls(exp, generator, '/x/exp.html', ['exp.trials.json'])
+        self.assertEqual(['exp.html', 'exp.trials.json', 'jspsych-7.1/jspsych.js'], urls[:3])
+        self.assertIn('jspsych-7.1/css/jspsych.css', urls)
+        self.assertIn('start-session-beep.mp3', urls)
+        self.assertIn('a.png', urls)
+        self.assertIn("navigator.serviceWorker.register('exp.sw.js')", script)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+from generator_tests import parse_exp, generate
+from expcompiler.logger import Logger
+from expcompiler.pages import split_experiment, page_filename, by_blocks
+from expcompiler.compile import parse_cli_options
+
+
+#=============================================================================================
+class SplitExperimentTests(unittest.TestCase):
+
+    def test_split_by_trial_count(self):
+        exp = parse_exp([{'f1': str(i)} for i in range(5)])
+        pages = split_experiment(exp, 2, '/tmp/exp.html', Logger())
+        self.assertEqual([2, 3], [len(page_exp.trials) for page_exp, fn in pages])
+        self.assertEqual(['/tmp/exp.html', '/tmp/exp.page2.html'], [fn for page_exp, fn in pages])
+        self.assertEqual([0, 2], [page_exp.page.first_trial_number for page_exp, fn in pages])
+        self.assertEqual('exp.page2.html', pages[0][0].page.next_page_url)
+        self.assertTrue(pages[1][0].page.is_last)
+        self.assertEqual(5, len(exp.trials))
+
+    def test_split_by_blocks(self):
+        exp = parse_exp([{'f1': 'a', 'block': 1}, {'f1': 'b', 'block': 1}, {'f1': 'c', 'block': 2}])
+        pages = split_experiment(exp, by_blocks, 'exp.html', Logger())
+        self.assertEqual([2, 1], [len(page_exp.trials) for page_exp, fn in pages])
+
+    def test_split_by_blocks_without_blocks(self):
+        exp = parse_exp([{'f1': 'a'}])
+        logger = Logger()
+        self.assertIsNone(split_experiment(exp, by_blocks, 'exp.html', logger))
+        self.assertIn('PAGES_WITHOUT_BLOCKS', logger.err_codes)
+
+    def test_too_many_pages(self):
+        exp = parse_exp([{'f1': 'a'}])
+        logger = Logger()
+        self.assertIsNone(split_experiment(exp, 2, 'exp.html', logger))
+        self.assertIn('TOO_MANY_PAGES', logger.err_codes)
+
+    def test_instructions_only_in_first_page(self):
+        exp = parse_exp([{'f1': 'a'}, {'f1': 'b'}], instructions=[dict(text='Hello', responses='')])
+        pages = split_experiment(exp, 2, 'exp.html', Logger())
+        self.assertEqual(1, len(pages[0][0].instructions))
+        self.assertEqual([], pages[1][0].instructions)
+
+    def test_pages_option(self):
+        self.assertEqual(3, parse_cli_options([], {'--pages': '3'})['pages'])
+        self.assertEqual(by_blocks, parse_cli_options([], {'--pages': by_blocks})['pages'])
+        with self.assertRaisesRegex(ValueError, 'Invalid --pages option'):
+            parse_cli_options([], {'--pages': 'x'})
+
+    def test_page_filename(self):
+        self.assertEqual('exp.html', page_filename('exp.html', 1))
+        self.assertEqual('exp.page3.html', page_filename('exp.html', 3))
+
+
+#=============================================================================================
+class PageScriptTests(unittest.TestCase):
+
+    def test_page_continues_to_next_page(self):
+        exp = parse_exp([{'f1': 'a'}, {'f1': 'b'}])
+        pages = split_experiment(exp, 2, 'exp.html', Logger())
+
+        generator, script = generate(pages[0][0])
+        self.assertIn('const next_page = "exp.page2.html";', script)
+        self.assertIn('jsPsych.data.addProperties({session: page_session, page: page_num});', script)
+        self.assertIn('show_next_page_link();', script)
+        self.assertIn("'results_${date}_page1.csv'", script)
+
+        generator, script = generate(pages[1][0])
+        self.assertIn('const next_page = null;', script)
+        self.assertNotIn('show_next_page_link();', script)
+
+    def test_trials_numbered_across_pages(self):
+        exp = parse_exp([{'f1': 'a'}, {'f1': 'b'}])
+        pages = split_experiment(exp, 2, 'exp.html', Logger())
+        generator, script = generate(pages[1][0])
+        self.assertIn('config_trial_number: "3"', script)
+        self.assertNotIn('config_trial_number: "2"', script)
+
+    def test_no_page_code_by_default(self):
+        exp = parse_exp([{'f1': 'a'}])
+        generator, script = generate(exp)
+        self.assertNotIn('page_session', script)
+
+
+if __name__ == '__main__':
+    unittest.main()
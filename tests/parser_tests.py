@@ -44,6 +44,24 @@ def Text(ctl_name, text='', **kwargs):
     return kwargs
 
 
+#-----------------------------------------------------------------------------
+# noinspection PyPep8Naming
+def Image(ctl_name, source='', **kwargs):
+    kwargs['layout_name'] = ctl_name
+    kwargs['type'] = 'image'
+    kwargs['source'] = source
+    return kwargs
+
+
+#-----------------------------------------------------------------------------
+# noinspection PyPep8Naming
+def Audio(ctl_name, source='', **kwargs):
+    kwargs['layout_name'] = ctl_name
+    kwargs['type'] = 'audio'
+    kwargs['source'] = source
+    return kwargs
+
+
 #-----------------------------------------------------------------------------
 # noinspection PyPep8Naming
 def Instruction(text, responses, **kwargs):
@@ -254,6 +272,53 @@ class GeneralWsTests(unittest.TestCase):
         self.assertEqual('t1', exp.title)
 
 
+    #--------------------------------------------------------
+    # Upload results
+    #--------------------------------------------------------
+
+    def test_upload_results(self):
+        parser, exp = test_parse(general=[G('save_results', 'Y'), G('results_upload_url', 'https://x.org/results'),
+                                          G('results_upload_batch_size', 5), G('results_upload_interval', 2.5)], return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertEqual('https://x.org/results', exp.results_upload_url)
+        self.assertEqual(5, exp.results_upload_batch_size)
+        self.assertEqual(2.5, exp.results_upload_interval)
+
+    def test_upload_results_invalid_batch_size(self):
+        parser, exp = test_parse(general=[G('save_results', 'Y'), G('results_upload_url', 'https://x.org/results'),
+                                          G('results_upload_batch_size', 2.5)], return_exp=True)
+        self.assertTrue(parser.errors_found)
+        self.assertTrue('INVALID_PARAM_VALUE' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
+    def test_upload_results_infinite_batch_size(self):
+        for value in ('inf', '1e400', float('inf')):
+            parser, exp = test_parse(general=[G('save_results', 'Y'), G('results_upload_url', 'https://x.org/results'),
+                                              G('results_upload_batch_size', value)], return_exp=True)
+            self.assertTrue(parser.errors_found)
+            self.assertTrue('INVALID_PARAM_VALUE' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+            self.assertEqual(20, exp.results_upload_batch_size)
+
+    def test_upload_results_infinite_interval(self):
+        for value in ('inf', '1e400'):
+            parser, exp = test_parse(general=[G('save_results', 'Y'), G('results_upload_url', 'https://x.org/results'),
+                                              G('results_upload_interval', value)], return_exp=True)
+            self.assertTrue(parser.errors_found)
+            self.assertTrue('INVALID_PARAM_VALUE' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+            self.assertEqual(10, exp.results_upload_interval)
+
+    def test_upload_results_nan_is_default(self):
+        parser, exp = test_parse(general=[G('save_results', 'Y'), G('results_upload_url', 'https://x.org/results'),
+                                          G('results_upload_batch_size', float('nan')), G('results_upload_interval', 'nan')], return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertEqual(20, exp.results_upload_batch_size)
+        self.assertEqual(10, exp.results_upload_interval)
+
+    def test_upload_results_without_save_results(self):
+        parser, exp = test_parse(general=[G('results_upload_url', 'https://x.org/results')], return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertTrue('UPLOAD_WITHOUT_SAVE_RESULTS' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
+
 #=============================================================================================
 class LayoutTests(unittest.TestCase):
 
@@ -353,6 +418,56 @@ class LayoutTests(unittest.TestCase):
         self.assertTrue(parser.warnings_found)
         self.assertTrue('EXCESSIVE_COLUMN' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
 
+    #--------------------------------------------------------
+    # Images
+    #--------------------------------------------------------
+
+    def test_image(self):
+        parser, exp = test_parse(layout=[Text('field1', source=''), Image('pic', 'img/cat.png', width='100px', height='100px')], return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertFalse({'EXCESSIVE_COLUMN', 'TEXT_OF_IMAGE_CONTROL', 'IMAGE_SIZE_NOT_SPECIFIED'} & set(parser.logger.err_codes))
+        self.assertEqual('img/cat.png', exp.layout['pic'].source)
+
+    def test_image_source_is_optional(self):
+        parser, exp = test_parse(layout=[Image('pic', width='100px')], return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertIsNone(exp.layout['pic'].source)
+
+    def test_invalid_image_source(self):
+        parser = test_parse(layout=[Image('pic', 'cat.txt', width='100px')])
+        self.assertTrue(parser.errors_found)
+        self.assertTrue('INVALID_IMAGE_SOURCE' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
+    def test_image_without_size_yields_warning(self):
+        parser = test_parse(layout=[Image('pic', 'cat.png')])
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertTrue('IMAGE_SIZE_NOT_SPECIFIED' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
+    def test_source_of_text_yields_warning(self):
+        parser = test_parse(layout=[Text('field1', source='cat.png')])
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertTrue('SOURCE_OF_TEXT_CONTROL' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
+    #--------------------------------------------------------
+    # Sounds
+    #--------------------------------------------------------
+
+    def test_audio(self):
+        parser, exp = test_parse(layout=[Text('field1', source=''), Audio('snd', 'snd/beep.wav')], return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertFalse({'EXCESSIVE_COLUMN', 'VISUAL_PROPERTY_OF_AUDIO_CONTROL'} & set(parser.logger.err_codes))
+        self.assertEqual('snd/beep.wav', exp.layout['snd'].source)
+
+    def test_invalid_audio_source(self):
+        parser = test_parse(layout=[Audio('snd', 'cat.png')])
+        self.assertTrue(parser.errors_found)
+        self.assertTrue('INVALID_AUDIO_SOURCE' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
+    def test_position_of_audio_yields_warning(self):
+        parser = test_parse(layout=[Audio('snd', 'beep.mp3', width='100px')])
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertTrue('VISUAL_PROPERTY_OF_AUDIO_CONTROL' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
 
 #=============================================================================================
 class ResponsesTests(unittest.TestCase):
@@ -929,6 +1044,91 @@ class TrialsTests(unittest.TestCase):
         self.assertFalse(parser.warnings_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
         self.assertEqual(0, len(exp.trials[0].css))
 
+    #------------------------------------------
+    # Results columns
+    #------------------------------------------
+
+    def test_results_columns(self):
+        parser, exp = test_parse(trial_types=[TType('f1,f2')], layout=[Text('f1', ''), Text('f2', '')],
+                                 trials=[{'f2': 'x', 'save:b': 1, 'f1': 'y', 'save:a': 2}],
+                                 return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertEqual(['config_trial_number', 'f2', 'f1', 'b', 'a'], exp.results_column_names)
+        self.assertEqual(['config_trial_number', 'stim_f2', 'stim_f1', 'val_b', 'val_a'], [c.timeline_var for c in exp.results_columns])
+
+    def test_results_columns_include_empty_save_cols(self):
+        parser, exp = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                                 trials=[{'f1': 'x', 'save:a': None}],
+                                 return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertEqual(['config_trial_number', 'f1', 'a'], exp.results_column_names)
+
+    def test_results_columns_duplicate_name(self):
+        parser, exp = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                                 trials=[{'f1': 'x', 'save:f1': 'y'}],
+                                 return_exp=True)
+        self.assertEqual(['config_trial_number', 'f1'], exp.results_column_names)
+        self.assertEqual('val_f1', exp.results_columns[1].timeline_var)
+
+    #------------------------------------------
+    # Blocks
+    #------------------------------------------
+
+    def test_no_blocks(self):
+        parser, exp = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                                 trials=[{'f1': 'x'}],
+                                 return_exp=True)
+        self.assertFalse(exp.uses_blocks)
+        self.assertEqual([None], [name for name, trials in exp.blocks])
+
+    def test_blocks(self):
+        parser, exp = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                                 trials=[{'f1': 'x', 'block': 1}, {'f1': 'y', 'block': 1}, {'f1': 'z', 'block': 'b2'}],
+                                 return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertTrue(exp.uses_blocks)
+        self.assertEqual([('1', 2), ('b2', 1)], [(name, len(trials)) for name, trials in exp.blocks])
+        self.assertIn('block', exp.results_column_names)
+
+    def test_block_inherited_from_previous_trial(self):
+        parser, exp = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                                 trials=[{'f1': 'x', 'block': 'a'}, {'f1': 'y', 'block': None}],
+                                 return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertTrue(parser.warnings_found)
+        self.assertEqual('a', exp.trials[1].block)
+
+    def test_block_missing_in_first_trial(self):
+        parser = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                            trials=[{'f1': 'x', 'block': None}, {'f1': 'y', 'block': 'a'}])
+        self.assertTrue(parser.errors_found)
+        self.assertTrue('TRIALS_NO_BLOCK' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
+    #------------------------------------------
+    # Repetitions
+    #------------------------------------------
+
+    def test_repetitions(self):
+        parser, exp = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                                 trials=[{'f1': 'x', 'repetitions': 3}, {'f1': 'y', 'repetitions': None}],
+                                 return_exp=True)
+        self.assertFalse(parser.errors_found, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+        self.assertEqual([3, 1], [t.repetitions for t in exp.trials])
+        self.assertNotIn('repetitions', exp.results_column_names)
+
+    def test_repetitions_0_is_invalid(self):
+        parser, exp = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                                 trials=[{'f1': 'x', 'repetitions': 0}],
+                                 return_exp=True)
+        self.assertTrue(parser.errors_found)
+        self.assertEqual(1, exp.trials[0].repetitions)
+
+    def test_split_block_is_invalid(self):
+        parser = test_parse(trial_types=[TType('f1')], layout=[Text('f1', '')],
+                            trials=[{'f1': 'x', 'block': 'a'}, {'f1': 'y', 'block': 'b'}, {'f1': 'z', 'block': 'a'}])
+        self.assertTrue(parser.errors_found)
+        self.assertTrue('TRIALS_BLOCK_NOT_CONSECUTIVE' in parser.logger.err_codes, 'error codes: ' + ','.join(parser.logger.err_codes.keys()))
+
 
 #todo instructions - with trial flow potentially
 
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from expcompiler.results import expand_compact_results, merge_page_results
+
+
+#-----------------------------------------------------------------------------
+def container(**kwargs):
+    result = dict(format='expcompiler-results', version=1, column_order=['rt', 'resp', 'f1', 'config_trial_number'],
+                  columns=['rt', 'resp', 'config_trial_number', 'f1'], dictionaries=dict(resp=['a', 'b']),
+                  rows=[[100, 0, '2', None], [200, 1, '2', None], [300, 0, '3', None], [400, None, None, 'x']],
+                  trials={'2': dict(f1='s1'), '3': dict(f1='s2')})
+    result.update(kwargs)
+    return result
+
+
+#=============================================================================================
+class CompactResultsTests(unittest.TestCase):
+
+    def test_dictionary_columns_decoded(self):
+        df = expand_compact_results(container())
+        self.assertEqual(['rt', 'resp', 'f1', 'config_trial_number'], list(df.columns))
+        self.assertEqual(['a', 'b', 'a'], list(df.resp[:3]))
+        self.assertTrue(pd.isna(df.resp[3]))
+
+    def test_trial_values_expanded(self):
+        df = expand_compact_results(container())
+        self.assertEqual(['s1', 's1', 's2', 'x'], list(df.f1))
+
+    def test_no_trials(self):
+        df = expand_compact_results(container(column_order=['rt'], columns=['rt'], dictionaries={}, rows=[[1], [2]], trials={}))
+        self.assertEqual([1, 2], list(df.rt))
+
+    def test_invalid_format(self):
+        self.assertRaises(ValueError, lambda: expand_compact_results(container(version=2)))
+
+
+
+#=============================================================================================
+class MergePageResultsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, content):
+        fn = os.path.join(self.dir, name)
+        with open(fn, 'w') as fp:
+            fp.write(content)
+        return fn
+
+    def test_pages_merged_in_order(self):
+        page2 = self.write('r_page2.csv', '"rt","session","page","config_trial_number"\n"300","s1","2","4"\n')
+        page1 = self.write('r_page1.csv', '"rt","session","page","config_trial_number"\n"100","s1","1","2"\n"200","s1","1","3"\n')
+        df = merge_page_results([page2, page1])
+        self.assertEqual([100, 200, 300], list(df.rt))
+        self.assertEqual([2, 3, 4], list(df.config_trial_number))
+
+    def test_not_a_page_results_file(self):
+        fn = self.write('r.csv', '"rt"\n"100"\n')
+        self.assertRaises(ValueError, lambda: merge_page_results([fn]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+#-- Libraries that take long to import, and are needed only when compiling/reading
+heavy_modules = ('pandas', 'numpy', 'openpyxl', 'cssutils', 'webcolors')
+
+#-- A sanity limit on the time until compiler.py prints its first output (a usage message). It is generous, so a
+#-- loaded machine doesn't fail the test: what keeps the startup fast is that the heavy modules aren't imported.
+max_startup_seconds = 5
+
+
+#-----------------------------------------------------------------------------
+def run_with_importtime(args):
+    """
+    Run a Python script with "-X importtime"
+
+    :return: (seconds until the process wrote its first output, set of imported modules)
+    """
+    env = dict(os.environ, PYTHONPATH=src_dir)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-X', 'importtime'] + args, cwd=src_dir, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdout.read(1)
+    first_output = time.perf_counter() - start
+    stdout, stderr = process.communicate()
+
+    modules = {line.split('|')[-1].strip() for line in stderr.decode('utf-8').splitlines() if line.startswith('import time:')}
+    return first_output, modules
+
+
+#=============================================================================================
+class StartupTests(unittest.TestCase):
+
+    def assert_no_heavy_modules(self, modules):
+        imported = [m for m in heavy_modules if m in modules]
+        self.assertEqual([], imported, 'these modules were imported: ' + ', '.join(imported))
+
+    def test_compiler_usage_is_fast(self):
+        seconds, modules = run_with_importtime(['compiler.py'])
+        self.assert_no_heavy_modules(modules)
+        self.assertLess(seconds, max_startup_seconds)
+
+    def test_compile_client_does_not_import_compiler(self):
+        seconds, modules = run_with_importtime(['compile_client.py'])
+        self.assert_no_heavy_modules(modules)
+
+    def test_package_import_is_lazy(self):
+        seconds, modules = run_with_importtime(['-c', 'import expcompiler.compile, expcompiler.daemon, expcompiler.generator; print()'])
+        self.assert_no_heavy_modules(modules)
+        self.assertNotIn('expcompiler.xlsreader', modules)
+
+    def test_generator_import_is_light(self):
+        seconds, modules = run_with_importtime(['-c', 'import expcompiler.generator; print()'])
+        self.assert_no_heavy_modules(modules)
+        self.assertIn('expcompiler.generator', modules)
+        self.assertNotIn('expcompiler.xlsreader', modules)
+
+    def test_submodules_as_package_attributes(self):
+        code = 'import sys, expcompiler; expcompiler.compile.parse_cli_options; print(sorted(m for m in sys.modules if m in {}))'.format(heavy_modules)
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=src_dir, env=dict(os.environ, PYTHONPATH=src_dir))
+        self.assertEqual(b'[]', output.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
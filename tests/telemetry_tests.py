@@ -0,0 +1,58 @@
+import io
+import unittest
+
+import pandas as pd
+
+from expcompiler.telemetry import summarize_session
+
+
+#-----------------------------------------------------------------------------
+def session(trials, refresh_rate=60.0, frame_jitter=0.5, calibration=True):
+    """ A session's results, as they are read from the CSV file """
+    lines = ['"rt","telemetry_calibration","refresh_rate","frame_jitter","page_load","dropped_frames","long_tasks","page_hidden"']
+    if calibration:
+        lines.append('"","true","{}","{}","850","0","0","false"'.format(refresh_rate, frame_jitter))
+    for dropped_frames, long_tasks, page_hidden in trials:
+        lines.append('"500","","","","","{}","{}","{}"'.format(dropped_frames, long_tasks, page_hidden))
+    return pd.read_csv(io.StringIO('\n'.join(lines)))
+
+
+#=============================================================================================
+class SummarizeSessionTests(unittest.TestCase):
+
+    def test_reliable_session(self):
+        summary = summarize_session(session([(0, 0, 'false')] * 20))
+        self.assertEqual(20, summary['trials'])
+        self.assertEqual(60, summary['refresh_rate'])
+        self.assertEqual(850, summary['page_load'])
+        self.assertEqual([], summary['problems'])
+
+    def test_low_refresh_rate_and_jitter(self):
+        summary = summarize_session(session([(0, 0, 'false')] * 20, refresh_rate=30, frame_jitter=4))
+        self.assertEqual(2, len(summary['problems']))
+
+    def test_dropped_frames_and_long_tasks(self):
+        summary = summarize_session(session([(2, 1, 'false')] * 5 + [(0, 0, 'false')] * 15))
+        self.assertEqual(0.25, summary['dropped_frames_ratio'])
+        self.assertEqual(0.25, summary['long_tasks_ratio'])
+        self.assertEqual(2, len(summary['problems']))
+
+    def test_hidden_page(self):
+        summary = summarize_session(session([(0, 0, 'true')] + [(0, 0, 'false')] * 19))
+        self.assertEqual(['the page was hidden in 1 trials'], summary['problems'])
+
+    def test_no_calibration(self):
+        summary = summarize_session(session([(0, 0, 'false')], calibration=False))
+        self.assertEqual(['no telemetry calibration'], summary['problems'])
+
+    def test_duration_error(self):
+        df = session([(0, 0, 'false')] * 2)
+        df['step1_requested_duration'] = [None, 500, 500]
+        df['step1_measured_duration'] = [None, 534, 533]
+        summary = summarize_session(df)
+        self.assertAlmostEqual(33.5, summary['duration_error'])
+        self.assertEqual(1, len(summary['problems']))
+
+
+if __name__ == '__main__':
+    unittest.main()